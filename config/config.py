@@ -19,6 +19,8 @@ SUMMARY_OPENAI_TEMPERATURE = float(os.getenv("SUMMARY_OPENAI_TEMPERATURE", "0.3"
 
 # Конфигурация использования
 DEFAULT_REQUESTS_LIMIT = int(os.getenv("DEFAULT_REQUESTS_LIMIT", "50"))
+# Как часто (в секундах) изменения лимитов сбрасываются из памяти в базу
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "5"))
 
 MAX_HISTORY_LENGTH = int(os.getenv("MAX_HISTORY_LENGTH", "10"))
 MAIN_PROMT = EASY_ADVENTURE_PROMT
@@ -34,5 +36,107 @@ TTS_INSTRUCTIONS = TTS_PROMT
 # PROCESSED_FILE = "processed_offset.txt"
 FAISS_SUFFIX = "_faiss"
 OFFSET_SUFFIX = "_offset.txt"
+SUMMARY_SUFFIX = "_summaries.pkl"
+LEXICAL_SUFFIX = "_bm25.pkl"
+# Максимальный размер фрагмента (в символах); длинные ходы режутся по строкам.
+# После изменения индексы нужно перестроить: python reindex.py
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "4000"))
+# После скольких дельта-сегментов индекс сворачивается в новую базу
+FAISS_COMPACT_AFTER_SEGMENTS = int(os.getenv("FAISS_COMPACT_AFTER_SEGMENTS", "20"))
+# Отображать базовый индекс в память (mmap) вместо полной загрузки в RAM
+RAG_INDEX_MMAP = os.getenv("RAG_INDEX_MMAP", "false").lower() in ("1", "true", "yes")
+# Хранение векторов при уплотнении: "flat" (float32), "fp16" или "pq"
+RAG_VECTOR_STORAGE = os.getenv("RAG_VECTOR_STORAGE", "flat")
+# С какого размера индекса переходить с точного поиска на "hnsw" или "ivf" (0 - никогда)
+RAG_ANN_THRESHOLD = int(os.getenv("RAG_ANN_THRESHOLD", "20000"))
+RAG_ANN_TYPE = os.getenv("RAG_ANN_TYPE", "hnsw")
+# Минимальный recall@10 относительно точного поиска, под который подбираются параметры поиска
+RAG_MIN_RECALL = float(os.getenv("RAG_MIN_RECALL", "0.95"))
+
+# Лимиты реестра загруженных RAG-менеджеров (0 - без ограничения)
+RAG_MAX_LOADED_MANAGERS = int(os.getenv("RAG_MAX_LOADED_MANAGERS", "256"))
+RAG_MAX_MEMORY_MB = int(os.getenv("RAG_MAX_MEMORY_MB", "0"))
+RAG_MANAGER_IDLE_TTL = int(os.getenv("RAG_MANAGER_IDLE_TTL", "1800"))
+
+# Иерархический поиск: саммари блоков ходов -> ходы внутри лучших блоков (только RAG_STORAGE_MODE=per_chat)
+RAG_HIERARCHICAL = os.getenv("RAG_HIERARCHICAL", "false").lower() in ("1", "true", "yes")
+RAG_SUMMARY_TURNS = int(os.getenv("RAG_SUMMARY_TURNS", str(max(1, MAX_HISTORY_LENGTH // 2))))
+RAG_SUMMARY_TOP_K = int(os.getenv("RAG_SUMMARY_TOP_K", "2"))
+
+# Гибридный поиск: сначала локальный BM25-индекс, эмбеддинг запроса - только
+# если лучший найденный фрагмент покрывает меньше указанной доли слов запроса
+RAG_HYBRID_RETRIEVAL = os.getenv("RAG_HYBRID_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+RAG_LEXICAL_MIN_CONFIDENCE = float(os.getenv("RAG_LEXICAL_MIN_CONFIDENCE", "0.6"))
+
+# Постобработка найденного контекста: фрагменты с косинусной близостью ниже
+# порога RAG_MIN_SIMILARITY (задается ниже, по бэкенду эмбеддингов) отбрасываются,
+# итог ограничивается бюджетом токенов (0 - без ограничения)
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "1000"))
+
+# Переранжирование: из k * RAG_MMR_FETCH_FACTOR ближайших фрагментов выбираются k
+# по MMR (разнообразие, RAG_MMR_LAMBDA - вес релевантности) с учетом давности хода
+# (RAG_RECENCY_WEIGHT - доля затухания, период полураспада в часах). 1 - выключено
+RAG_MMR_FETCH_FACTOR = int(os.getenv("RAG_MMR_FETCH_FACTOR", "4"))
+RAG_MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+RAG_RECENCY_WEIGHT = float(os.getenv("RAG_RECENCY_WEIGHT", "0.2"))
+RAG_RECENCY_HALF_LIFE_HOURS = float(os.getenv("RAG_RECENCY_HALF_LIFE_HOURS", "72"))
+
+# Офлайн-переиндексация (reindex.py): лимит токенов эмбеддингов в минуту на все процессы
+REINDEX_TOKENS_PER_MINUTE = int(os.getenv("REINDEX_TOKENS_PER_MINUTE", "1000000"))
+REINDEX_STATE_PATH = os.getenv("REINDEX_STATE_PATH", "data/reindex_state.json")
+
+# Описание кампании: если длиннее CAMPAIGN_INLINE_MAX_TOKENS токенов, в промпт идет
+# только закрепленное начало (до CAMPAIGN_PINNED_MAX_TOKENS) и до CAMPAIGN_LORE_K
+# разделов, близких к сообщению (не больше CAMPAIGN_LORE_MAX_TOKENS токенов)
+CAMPAIGN_INLINE_MAX_TOKENS = int(os.getenv("CAMPAIGN_INLINE_MAX_TOKENS", "800"))
+CAMPAIGN_PINNED_MAX_TOKENS = int(os.getenv("CAMPAIGN_PINNED_MAX_TOKENS", "300"))
+CAMPAIGN_SECTION_CHARS = int(os.getenv("CAMPAIGN_SECTION_CHARS", "1200"))
+CAMPAIGN_LORE_K = int(os.getenv("CAMPAIGN_LORE_K", "3"))
+CAMPAIGN_LORE_MAX_TOKENS = int(os.getenv("CAMPAIGN_LORE_MAX_TOKENS", "800"))
+
+# Бюджет токенов промпта основного запроса (0 - без ограничения). При превышении
+# сокращаются: отрывки из истории, затем состав группы, описание кампании,
+# старые сообщения диалога; основной промпт и последнее сообщение - никогда
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "8000"))
+
+# Режим хранения векторов: "per_chat" - отдельный индекс на чат,
+# "shared" - общие шардированные индексы с фильтрацией по чату
+RAG_STORAGE_MODE = os.getenv("RAG_STORAGE_MODE", "per_chat")
+RAG_SHARED_INDEX_DIR = os.getenv("RAG_SHARED_INDEX_DIR", "data/vector_index")
+RAG_SHARED_INDEX_SHARDS = int(os.getenv("RAG_SHARED_INDEX_SHARDS", "4"))
+RAG_SHARED_JOURNAL_MAX_MB = int(os.getenv("RAG_SHARED_JOURNAL_MAX_MB", "64"))
+
+# Конфигурация общего сервиса эмбеддингов
+# Бэкенд: "openai" - API OpenAI, "local" - ONNX-модель на CPU (пакет fastembed),
+# "hashing" - детерминированный хеширующий эмбеддер без модели (для тестов/офлайна).
+# После смены бэкенда индексы нужно перестроить: python reindex.py
+EMBEDDINGS_BACKEND = os.getenv("EMBEDDINGS_BACKEND", "openai")
+EMBEDDINGS_LOCAL_MODEL = os.getenv("EMBEDDINGS_LOCAL_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+# Потоки CPU для локальной модели, 0 - все ядра
+EMBEDDINGS_LOCAL_THREADS = int(os.getenv("EMBEDDINGS_LOCAL_THREADS", "0"))
+EMBEDDINGS_HASHING_DIMENSIONS = int(os.getenv("EMBEDDINGS_HASHING_DIMENSIONS", "384"))
+EMBEDDINGS_MODEL = os.getenv("EMBEDDINGS_MODEL", "text-embedding-ada-002")
+# Уменьшенная размерность (только для моделей text-embedding-3-*), 0 - по умолчанию
+EMBEDDINGS_DIMENSIONS = int(os.getenv("EMBEDDINGS_DIMENSIONS", "0"))
+# Порог косинусной близости для контекста из истории и описания кампании (0 - без порога).
+# Шкала близости у каждой модели своя: у ada-002 даже несвязанные тексты дают ~0.7,
+# у text-embedding-3-* и локальной модели близость заметно ниже, у хеширующего
+# эмбеддера порог не имеет смысла. По умолчанию порог выбирается по бэкенду и модели
+if EMBEDDINGS_BACKEND == "openai":
+    _DEFAULT_MIN_SIMILARITY = "0.72" if EMBEDDINGS_MODEL == "text-embedding-ada-002" else "0.3"
+elif EMBEDDINGS_BACKEND == "local":
+    _DEFAULT_MIN_SIMILARITY = "0.4"
+else:
+    _DEFAULT_MIN_SIMILARITY = "0"
+RAG_MIN_SIMILARITY = float(os.getenv("RAG_MIN_SIMILARITY", _DEFAULT_MIN_SIMILARITY))
+EMBEDDINGS_CACHE_PATH = os.getenv("EMBEDDINGS_CACHE_PATH", "data/embeddings/embeddings_cache.bin")
+# Сколько векторов кеша держать в памяти (вытесняются давно не использованные), 0 - без ограничения
+EMBEDDINGS_CACHE_MAX_ITEMS = int(os.getenv("EMBEDDINGS_CACHE_MAX_ITEMS", "50000"))
+EMBEDDINGS_BATCH_WINDOW_MS = int(os.getenv("EMBEDDINGS_BATCH_WINDOW_MS", "20"))
+EMBEDDINGS_MAX_BATCH_SIZE = int(os.getenv("EMBEDDINGS_MAX_BATCH_SIZE", "256"))
+
+# База состояния бота (истории, группы, кампании, лимиты, настройки, расход токенов).
+# Данные из старых JSON-файлов переносятся командой: python import_state.py
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "data/state.db")
 
 print(MAX_HISTORY_LENGTH)
\ No newline at end of file
@@ -6,6 +6,7 @@ from services.openai_service import OpenAIService
 from services.group_service import GroupService
 from services.character_service import CharacterService
 from services.campaign_service import CampaignService
+from services.campaign_index import schedule_campaign_index, delete_campaign_index
 from services.rag_service import RAGManager, get_or_create_rag_manager, get_context
 from services.voice_service import VoiceService
 from services.chat_settings_service import ChatSettingsService
@@ -55,6 +56,7 @@ async def cmd_campaign(message: Message) -> None:
             description = args[1]
             campaign = campaign_service.get_campaign(chat_id)
             campaign = campaign_service.update_campaign(chat_id, description=description)
+            schedule_campaign_index(chat_id, campaign.description)
             await message.answer("✅ Описание кампании обновлено!")
             return
             
@@ -342,6 +344,7 @@ async def cmd_delete_campaign(message: Message) -> None:
     
     try:
         if campaign_service.delete_campaign(chat_id):
+            delete_campaign_index(chat_id)
             await message.answer("✅ Описание кампании удалено!")
         else:
             await message.answer("❌ Произошла ошибка при удалении описания кампании.")
@@ -0,0 +1,4 @@
+from services.state_import import main
+
+if __name__ == "__main__":
+    main()
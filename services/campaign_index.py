@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import pickle
+import re
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from config.config import (
+    CAMPAIGN_INLINE_MAX_TOKENS, CAMPAIGN_LORE_K, CAMPAIGN_LORE_MAX_TOKENS,
+    CAMPAIGN_PINNED_MAX_TOKENS, CAMPAIGN_SECTION_CHARS, RAG_MIN_SIMILARITY,
+)
+from services.rag_service import GLOBAL_INDEXING_QUEUE, get_embedding_service
+from services.rag_registry import ManagerRegistry
+from utils.tokens import count_tokens, truncate_to_tokens
+
+CAMPAIGNS_DIR = Path("data/campaigns")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+
+def split_sections(text: str, max_chars: int) -> list[str]:
+    """
+    Cut a campaign description into sections of at most ~``max_chars``:
+    paragraphs are packed together, a markdown heading always starts a new
+    section, and an over-long paragraph is cut at word boundaries.
+    """
+    sections: list[str] = []
+    current = ""
+    for block in (b.strip() for b in _PARAGRAPH_RE.split(text)):
+        if not block:
+            continue
+        if current and (block.startswith("#") or len(current) + len(block) + 2 > max_chars):
+            sections.append(current)
+            current = ""
+        while len(block) > max_chars:
+            cut = block.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                sections.append(current)
+                current = ""
+            sections.append(block[:cut].strip())
+            block = block[cut:].strip()
+        current = f"{current}\n\n{block}" if current else block
+    if current:
+        sections.append(current)
+    return sections
+
+
+class CampaignIndex:
+    """
+    Retrieval over one chat's campaign description.
+
+    The first section is the pinned header, always put in the prompt; the
+    other sections are embedded and the ones closest to the player's message
+    are added next to it. A description short enough is sent whole, as
+    before. Vectors are few, so search is a NumPy scan; the index is kept in
+    ``campaign_<chat_id>_index.pkl`` and rebuilt when the text changes.
+    """
+
+    def __init__(self, chat_id: int, root: Path = CAMPAIGNS_DIR) -> None:
+        self.path = root / f"campaign_{chat_id}_index.pkl"
+        self.digest = ""
+        self.header = ""
+        self.sections: list[str] = []
+        self.vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def ensure(self, description: str) -> None:
+        """(Re)build the index if ``description`` is not the indexed text."""
+        embeddings = get_embedding_service()
+        digest = hashlib.sha256(f"{embeddings.namespace}\0{description}".encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest == self.digest:
+                return
+            if count_tokens(description) <= CAMPAIGN_INLINE_MAX_TOKENS:
+                header, sections, vectors = description, [], None
+            else:
+                parts = split_sections(description, CAMPAIGN_SECTION_CHARS)
+                header, sections = truncate_to_tokens(parts[0], CAMPAIGN_PINNED_MAX_TOKENS), parts[1:]
+                vectors = np.asarray(embeddings.embed_documents(sections), dtype="float32") if sections else None
+            self.digest, self.header, self.sections, self.vectors = digest, header, sections, vectors
+            self._save()
+            print(f"[campaign] Indexed {self.path.name}: {len(sections)} sections")
+
+    async def acontext(self, description: str, user_message: str) -> tuple[str, str]:
+        """
+        Pinned header, and the sections relevant to ``user_message`` in
+        document order (empty if none). The header only depends on the
+        description, so it can stay in the cacheable prompt prefix.
+        """
+        await asyncio.to_thread(self.ensure, description)
+        if self.vectors is None:
+            return self.header, ""
+        query = np.asarray(await get_embedding_service().aembed_query(user_message), dtype="float32")
+        with self._lock:
+            header, sections, vectors = self.header, self.sections, self.vectors
+
+        similarity = vectors @ query
+        picked: list[int] = []
+        budget = CAMPAIGN_LORE_MAX_TOKENS
+        for i in np.argsort(-similarity)[:CAMPAIGN_LORE_K]:
+            if similarity[i] < RAG_MIN_SIMILARITY:
+                break
+            tokens = count_tokens(sections[i])
+            if tokens > budget:
+                continue
+            picked.append(int(i))
+            budget -= tokens
+        return header, "\n\n".join(sections[i] for i in sorted(picked))
+
+    def delete(self) -> None:
+        with self._lock:
+            self.digest, self.header, self.sections, self.vectors = "", "", [], None
+            self.path.unlink(missing_ok=True)
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"[campaign] Failed to load {self.path.name}, will rebuild: {e}")
+            return
+        self.digest, self.header, self.sections, self.vectors = (
+            state["digest"], state["header"], state["sections"], state["vectors"]
+        )
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump(
+                {"digest": self.digest, "header": self.header, "sections": self.sections, "vectors": self.vectors},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        tmp.replace(self.path)
+
+
+GLOBAL_CAMPAIGN_INDEXES: ManagerRegistry[CampaignIndex] = ManagerRegistry(CampaignIndex, max_items=256)
+
+
+async def aget_campaign_context(chat_id: int, description: str, user_message: str) -> tuple[str, str]:
+    """(pinned header, relevant lore) of the chat's campaign description."""
+    index = GLOBAL_CAMPAIGN_INDEXES.get(chat_id)
+    if index is None:
+        index = await asyncio.to_thread(GLOBAL_CAMPAIGN_INDEXES.get_or_create, chat_id)
+    return await index.acontext(description, user_message)
+
+
+def schedule_campaign_index(chat_id: int, description: str) -> bool:
+    """Index a new description on the background worker, before the next message needs it."""
+    return GLOBAL_INDEXING_QUEUE.enqueue(
+        ("campaign", chat_id),
+        lambda: GLOBAL_CAMPAIGN_INDEXES.get_or_create(chat_id).ensure(description),
+    )
+
+
+def delete_campaign_index(chat_id: int) -> None:
+    GLOBAL_INDEXING_QUEUE.discard(("campaign", chat_id))
+    index = GLOBAL_CAMPAIGN_INDEXES.pop(chat_id) or CampaignIndex(chat_id)
+    index.delete()
@@ -1,9 +1,8 @@
 from dataclasses import dataclass
 from typing import Optional
 from datetime import datetime
-import json
-from pathlib import Path
 import logging
+from services.state_store import StateStore, get_state_store
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -18,35 +17,28 @@ class CampaignData:
 class CampaignService:
     """Сервис для управления описаниями кампаний"""
     
-    def __init__(self, campaigns_dir: str = "data/campaigns") -> None:
+    def __init__(self, store: Optional[StateStore] = None) -> None:
         """
         Инициализация сервиса
         
         Args:
-            campaigns_dir: Путь к директории для хранения описаний кампаний
+            store: Хранилище состояния (по умолчанию общее для всех сервисов)
         """
-        self.campaigns_dir = Path(campaigns_dir)
-        self._ensure_campaigns_dir()
+        self.store = store or get_state_store()
+        # Общий для всех экземпляров кеш: описание читается из базы один раз
+        self.cache = self.store.cache("campaigns", self._read_campaign)
 
-    def _ensure_campaigns_dir(self) -> None:
-        """Создает директорию для хранения описаний кампаний, если она не существует"""
-        try:
-            self.campaigns_dir.mkdir(parents=True, exist_ok=True)
-        except Exception as e:
-            logger.error(f"Ошибка при создании директории кампаний: {e}")
-            raise
-
-    def _get_campaign_file_path(self, chat_id: int) -> Path:
-        """
-        Возвращает путь к файлу описания кампании
-        
-        Args:
-            chat_id: ID чата
-            
-        Returns:
-            Path: Путь к файлу кампании
-        """
-        return self.campaigns_dir / f"campaign_{chat_id}.json"
+    def _read_campaign(self, chat_id: int) -> CampaignData:
+        """Читает кампанию из хранилища (пустую, если ее нет)"""
+        row = self.store.fetchone(
+            "SELECT description, updated_at FROM campaigns WHERE chat_id = ?", (chat_id,)
+        )
+        if row is None:
+            return CampaignData(description="")
+        return CampaignData(
+            description=row["description"],
+            updated_at=datetime.fromisoformat(row["updated_at"])
+        )
 
     def get_campaign(self, chat_id: int) -> CampaignData:
         """
@@ -58,20 +50,13 @@ class CampaignService:
         Returns:
             CampaignData: Данные кампании
         """
-        campaign_file = self._get_campaign_file_path(chat_id)
-        if not campaign_file.exists():
-            return CampaignData(description="")
-            
         try:
-            with open(campaign_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return CampaignData(
-                    description=data.get('description', ''),
-                    updated_at=datetime.fromisoformat(data.get('updated_at', datetime.now().isoformat()))
-                )
+            campaign = self.cache.get(chat_id)
         except Exception as e:
             logger.error(f"Ошибка при чтении кампании {chat_id}: {e}")
             return CampaignData(description="")
+        # Копия: изменения сохраняются только через update_campaign
+        return CampaignData(description=campaign.description, updated_at=campaign.updated_at)
 
     def update_campaign(self, chat_id: int, **kwargs) -> CampaignData:
         """
@@ -93,15 +78,14 @@ class CampaignService:
         
         # Сохраняем изменения
         try:
-            data = {
-                'description': campaign.description,
-                'updated_at': campaign.updated_at.isoformat()
-            }
-            
-            with open(self._get_campaign_file_path(chat_id), 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.store.execute(
+                "INSERT OR REPLACE INTO campaigns (chat_id, description, updated_at) VALUES (?, ?, ?)",
+                (chat_id, campaign.description, campaign.updated_at.isoformat()),
+            )
         except Exception as e:
             logger.error(f"Ошибка при сохранении кампании {chat_id}: {e}")
+        finally:
+            self.cache.invalidate(chat_id)
             
         return campaign
 
@@ -116,9 +100,8 @@ class CampaignService:
             bool: True если удаление успешно, False в случае ошибки
         """
         try:
-            campaign_file = self._get_campaign_file_path(chat_id)
-            if campaign_file.exists():
-                campaign_file.unlink()
+            self.store.execute("DELETE FROM campaigns WHERE chat_id = ?", (chat_id,))
+            self.cache.invalidate(chat_id)
             return True
         except Exception as e:
             logger.error(f"Ошибка при удалении кампании {chat_id}: {e}")
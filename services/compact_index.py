@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import math
+
+import faiss
+import numpy as np
+
+# PQ needs enough points to train 256 centroids per sub-quantizer
+_PQ_MIN_TRAIN = 256 * 39
+
+
+def index_family(index: faiss.Index) -> str:
+    """Coarse kind of an index, used to decide whether its codes can be reused."""
+    for cls, family in (
+        (faiss.IndexHNSW, "HNSW"),
+        (faiss.IndexIVF, "IVF"),
+        (faiss.IndexPQ, "PQ"),
+        (faiss.IndexScalarQuantizer, "SQfp16"),
+        (faiss.IndexFlat, "Flat"),
+    ):
+        if isinstance(index, cls):
+            return family
+    return type(index).__name__
+
+
+def key_family(key: str) -> str:
+    """Family (see ``index_family``) of an ``index_factory`` key."""
+    for prefix in ("HNSW", "IVF", "PQ", "SQfp16", "Flat"):
+        if key.startswith(prefix):
+            return prefix
+    return key
+
+
+def choose_factory_key(n: int, d: int, storage: str, ann_threshold: int, ann_type: str) -> str:
+    """
+    ``index_factory`` key for ``n`` vectors of dimension ``d``.
+
+    storage: "flat" (float32), "fp16" (half precision) or "pq" (product
+    quantization, d/8 bytes per vector; falls back to fp16 while there are
+    too few vectors to train it). Past ``ann_threshold`` vectors the exact
+    scan is replaced with HNSW or IVF over the same codes.
+    """
+    codec = {"flat": "Flat", "fp16": "SQfp16", "pq": f"PQ{_pq_m(d)}"}.get(storage, "Flat")
+    if codec.startswith("PQ") and n < _PQ_MIN_TRAIN:
+        codec = "SQfp16"
+
+    if not ann_threshold or n < ann_threshold:
+        return codec
+    if ann_type == "ivf":
+        nlist = max(16, int(4 * math.sqrt(n)))
+        return f"IVF{nlist},{codec}"
+    return f"HNSW32,{codec}" if codec != "Flat" else "HNSW32"
+
+
+def build_index(
+    vectors: np.ndarray,
+    storage: str = "flat",
+    ann_threshold: int = 0,
+    ann_type: str = "hnsw",
+    min_recall: float = 0.0,
+) -> faiss.Index:
+    """Build, train and fill an index; tune ANN search breadth to ``min_recall``."""
+    n, d = vectors.shape
+    key = choose_factory_key(n, d, storage, ann_threshold, ann_type)
+    index = faiss.index_factory(d, key, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+    if key == "Flat" or n == 0:
+        return index
+
+    _set_search_breadth(index, 16 if "IVF" in key else 64)
+    recall = recall_at_k(index, vectors)
+    while min_recall and recall < min_recall and _widen_search(index):
+        recall = recall_at_k(index, vectors)
+    print(f"[index] Built {key} over {n} vectors, recall@10 vs exact = {recall:.3f}")
+    return index
+
+
+def recall_at_k(index: faiss.Index, vectors: np.ndarray, k: int = 10, sample: int = 200) -> float:
+    """
+    Share of the exact (flat) top-k neighbours that ``index`` also returns,
+    measured on a sample of the indexed vectors used as queries.
+    """
+    n = vectors.shape[0]
+    if n == 0:
+        return 1.0
+    k = min(k, n)
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(n, size=min(sample, n), replace=False)]
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, expected = exact.search(queries, k)
+    _, found = index.search(queries, k)
+    hits = sum(len(set(e) & set(f)) for e, f in zip(expected, found))
+    return hits / (len(queries) * k)
+
+
+def _set_search_breadth(index: faiss.Index, value: int) -> None:
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(value, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = value
+
+
+def _widen_search(index: faiss.Index) -> bool:
+    """Double nprobe / efSearch; False once it cannot grow any further."""
+    if isinstance(index, faiss.IndexIVF):
+        if index.nprobe >= index.nlist:
+            return False
+        index.nprobe = min(index.nprobe * 2, index.nlist)
+        return True
+    if isinstance(index, faiss.IndexHNSW):
+        if index.hnsw.efSearch >= 1024:
+            return False
+        index.hnsw.efSearch *= 2
+        return True
+    return False
+
+
+def _pq_m(d: int) -> int:
+    """Largest number of sub-quantizers <= d/8 that divides d."""
+    m = max(1, d // 8)
+    while d % m:
+        m -= 1
+    return m
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """All stored vectors (decoded, so lossy for compressed indexes)."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
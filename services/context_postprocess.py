@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from langchain_core.documents import Document
+
+from utils.tokens import count_tokens, truncate_to_tokens
+
+# A remainder of the budget smaller than this is not worth a truncated chunk
+_MIN_TRUNCATED_TOKENS = 50
+# Longest text overlap searched for between chunks without byte ranges
+# (the old splitter used chunk_overlap=200 characters)
+_MAX_TEXT_OVERLAP = 400
+
+
+def postprocess_context(docs: list[Document], max_tokens: int = 0, model: str = "gpt-4o") -> list[Document]:
+    """
+    Turn ranked retrieval results (best first, already score-filtered) into
+    the context that goes into the prompt:
+
+    - duplicates and chunks contained in another one are dropped;
+    - chunks adjacent or overlapping in the history file are merged;
+    - best chunks are kept until ``max_tokens`` (0 = no limit) is spent,
+      the last one possibly truncated;
+    - summary nodes come first, chunks follow in history order.
+    """
+    merged = _merge(_dedupe(docs))
+    if max_tokens:
+        merged = _fit_budget(merged, max_tokens, model)
+    summaries = [d for d in merged if d.metadata.get("node") == "summary"]
+    chunks = [d for d in merged if d.metadata.get("node") != "summary"]
+    if all(d.metadata.get("byte_start") is not None for d in chunks):
+        chunks.sort(key=lambda d: d.metadata["byte_start"])
+    return summaries + chunks
+
+
+def _dedupe(docs: list[Document]) -> list[Document]:
+    kept: list[Document] = []
+    for doc in docs:
+        text = doc.page_content.strip()
+        if not text or any(text in other.page_content for other in kept):
+            continue
+        # A later (lower ranked) chunk may contain an earlier one: keep the
+        # longer text at the better rank.
+        for i, other in enumerate(kept):
+            if other.page_content.strip() in text:
+                kept[i] = doc
+                break
+        else:
+            kept.append(doc)
+    return kept
+
+
+def _merge(docs: list[Document]) -> list[Document]:
+    """Merge chunks that touch or overlap; the result keeps the better rank."""
+    result = list(docs)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(result)):
+            for j in range(i + 1, len(result)):
+                combined = _try_merge(result[i], result[j])
+                if combined is not None:
+                    result[i] = combined
+                    del result[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return result
+
+
+def _try_merge(a: Document, b: Document) -> Document | None:
+    if "summary" in (a.metadata.get("node"), b.metadata.get("node")):
+        return None
+    a_start, a_end = a.metadata.get("byte_start"), a.metadata.get("byte_end")
+    b_start, b_end = b.metadata.get("byte_start"), b.metadata.get("byte_end")
+    if None not in (a_start, a_end, b_start, b_end):
+        if a_start > b_start:
+            a, b = b, a
+            a_start, a_end, b_start, b_end = b_start, b_end, a_start, a_end
+        if b_start > a_end:
+            return None
+        text = _join(a.page_content, b.page_content) if b_end > a_end else a.page_content
+        metadata = {**a.metadata, "byte_start": a_start, "byte_end": max(a_end, b_end)}
+        return Document(page_content=text, metadata=metadata)
+
+    for first, second in ((a, b), (b, a)):
+        overlap = _text_overlap(first.page_content, second.page_content)
+        if overlap:
+            return Document(
+                page_content=first.page_content + second.page_content[overlap:],
+                metadata=dict(first.metadata),
+            )
+    return None
+
+
+def _join(first: str, second: str) -> str:
+    overlap = _text_overlap(first, second)
+    if overlap:
+        return first + second[overlap:]
+    return first.rstrip() + "\n\n" + second.lstrip()
+
+
+def _text_overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of ``first`` that starts ``second``."""
+    for size in range(min(len(first), len(second), _MAX_TEXT_OVERLAP), 20, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+
+def _fit_budget(docs: list[Document], max_tokens: int, model: str) -> list[Document]:
+    kept: list[Document] = []
+    left = max_tokens
+    for doc in docs:
+        tokens = count_tokens(doc.page_content, model)
+        if tokens <= left:
+            kept.append(doc)
+            left -= tokens
+        elif left >= _MIN_TRUNCATED_TOKENS:
+            text = truncate_to_tokens(doc.page_content, left, model)
+            kept.append(Document(page_content=text, metadata={**doc.metadata, "truncated": True}))
+            left = 0
+        if left < _MIN_TRUNCATED_TOKENS:
+            break
+    return kept
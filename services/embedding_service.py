@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import struct
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Cache record: sha256(key) | dimension (uint32) | float32 * dimension
+_RECORD_HEADER = struct.Struct("<32sI")
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache.
+
+    Append-only binary file, loaded into memory once. A text is identified by
+    the sha256 of ``namespace + text``, so the same text embedded by another
+    model never collides. ``read_paths`` are other cache files that are only
+    read (e.g. the main cache, for a worker process writing its own part).
+
+    Vectors are kept as float32 arrays. With ``max_items`` the in-memory map
+    is an LRU of that size; evicted vectors stay in the file but are only
+    reloaded on the next start if they are among the most recent records.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str | Path] = None,
+        read_paths: Iterable[str | Path] = (),
+        max_items: int = 0,
+    ) -> None:
+        self.path = Path(path) if path else None
+        self.max_items = max_items
+        self._vectors: OrderedDict[bytes, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        for read_path in read_paths:
+            self._load(Path(read_path))
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._load(self.path)
+
+    def __len__(self) -> int:
+        return len(self._vectors)
+
+    def items(self) -> list[tuple[bytes, np.ndarray]]:
+        with self._lock:
+            return list(self._vectors.items())
+
+    def get(self, digest: bytes) -> Optional[list[float]]:
+        with self._lock:
+            vector = self._vectors.get(digest)
+            if vector is None:
+                return None
+            self._vectors.move_to_end(digest)
+        return vector.tolist()
+
+    def put_many(self, items: Iterable[tuple[bytes, Sequence[float]]], persist: bool = True) -> None:
+        """Add vectors; with ``persist=False`` (e.g. search queries) they are only kept in memory."""
+        with self._lock:
+            new_items = []
+            for digest, vector in items:
+                if digest in self._vectors:
+                    continue
+                vector = np.asarray(vector, dtype="<f4")
+                self._remember(digest, vector)
+                new_items.append((digest, vector))
+            if not new_items or not persist or self.path is None:
+                return
+            try:
+                with open(self.path, "ab") as f:
+                    for digest, vector in new_items:
+                        f.write(_RECORD_HEADER.pack(digest, len(vector)))
+                        f.write(vector.tobytes())
+            except OSError as e:
+                print(f"[embeddings] Failed to persist cache: {e}")
+
+    def _remember(self, digest: bytes, vector: np.ndarray) -> None:
+        self._vectors[digest] = vector
+        self._vectors.move_to_end(digest)
+        if self.max_items and len(self._vectors) > self.max_items:
+            self._vectors.popitem(last=False)
+
+    def _load(self, path: Path) -> None:
+        if not path.exists():
+            return
+        data = path.read_bytes()
+        pos = 0
+        while pos + _RECORD_HEADER.size <= len(data):
+            digest, dim = _RECORD_HEADER.unpack_from(data, pos)
+            start = pos + _RECORD_HEADER.size
+            end = start + dim * 4
+            if end > len(data):
+                # Torn write at the tail (crash mid-append) – ignore it.
+                break
+            self._remember(digest, np.frombuffer(data, dtype="<f4", count=dim, offset=start))
+            pos = end
+        print(f"[embeddings] Loaded {len(self._vectors)} cached vectors from {path}")
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Sends texts to ``embeddings`` in batches of at most ``batch_size``,
+    waiting as needed to stay under ``tokens_per_minute`` (token bucket
+    holding one minute of budget).
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        tokens_per_minute: int,
+        *,
+        batch_size: int = 256,
+        count_tokens: Callable[[str], int] = lambda text: len(text) // 4 + 1,
+    ) -> None:
+        self.embeddings = embeddings
+        self.tokens_per_minute = tokens_per_minute
+        self.batch_size = batch_size
+        self.count_tokens = count_tokens
+        self._available = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors: list[list[float]] = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            self._acquire(sum(self.count_tokens(t) for t in batch))
+            vectors.extend(self.embeddings.embed_documents(batch))
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def _acquire(self, tokens: int) -> None:
+        if self.tokens_per_minute <= 0:
+            return
+        # A batch bigger than the whole budget waits for a full bucket
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                rate = self.tokens_per_minute / 60
+                self._available = min(self.tokens_per_minute, self._available + (now - self._updated) * rate)
+                self._updated = now
+                if self._available >= tokens:
+                    self._available -= tokens
+                    return
+                time.sleep((tokens - self._available) / rate)
+
+
+class EmbeddingService(Embeddings):
+    """
+    Shared embeddings front-end for every RAGManager.
+
+    * Requests from all chats are collected for ``batch_window`` seconds and
+      sent to the underlying model as one batch (up to ``max_batch_size``).
+    * Identical texts are embedded once: results are kept in a persistent
+      content-addressed cache, and concurrent requests for the same text
+      share one in-flight future. Search queries are cached in memory only,
+      so one-off questions do not grow the cache file.
+
+    Works for sync callers (FAISS indexing in worker threads) and async
+    callers (``aembed_query`` on the event loop) alike.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        *,
+        cache: Optional[EmbeddingCache] = None,
+        namespace: Optional[str] = None,
+        batch_window: float = 0.02,
+        max_batch_size: int = 256,
+        max_concurrent_batches: int = 4,
+    ) -> None:
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.namespace = namespace if namespace is not None else str(getattr(embeddings, "model", ""))
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self._lock = threading.Lock()
+        self._has_pending = threading.Condition(self._lock)
+        self._pending: list[tuple[bytes, str]] = []
+        self._inflight: dict[bytes, Future] = {}
+        # In-flight digests requested as documents, written to the cache file
+        self._persist: set[bytes] = set()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_batches, thread_name_prefix="embeddings"
+        )
+        self._collector: threading.Thread | None = None
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.batches_sent = 0
+        self.texts_embedded = 0
+
+    # ------------------------------------------------------------------ #
+    #                     Embeddings interface
+    # ------------------------------------------------------------------ #
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [f.result() for f in self._submit(texts)]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._submit([text], persist=False)[0].result()
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        futures = [asyncio.wrap_future(f) for f in self._submit(texts)]
+        return list(await asyncio.gather(*futures))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await asyncio.wrap_future(self._submit([text], persist=False)[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cache_size": len(self.cache),
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "batches_sent": self.batches_sent,
+                "texts_embedded": self.texts_embedded,
+                "pending": len(self._pending),
+            }
+
+    # ------------------------------------------------------------------ #
+    #                     Batching
+    # ------------------------------------------------------------------ #
+    def _digest(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.namespace}\0{text}".encode("utf-8")).digest()
+
+    def _submit(self, texts: list[str], persist: bool = True) -> list[Future]:
+        futures: list[Future] = []
+        with self._lock:
+            for text in texts:
+                digest = self._digest(text)
+                cached = self.cache.get(digest)
+                if cached is not None:
+                    self.cache_hits += 1
+                    future: Future = Future()
+                    future.set_result(cached)
+                elif digest in self._inflight:
+                    self.cache_hits += 1
+                    future = self._inflight[digest]
+                    if persist:
+                        self._persist.add(digest)
+                else:
+                    self.cache_misses += 1
+                    future = Future()
+                    self._inflight[digest] = future
+                    self._pending.append((digest, text))
+                    if persist:
+                        self._persist.add(digest)
+                futures.append(future)
+            if self._pending:
+                self._ensure_collector()
+                self._has_pending.notify()
+        return futures
+
+    def _ensure_collector(self) -> None:
+        if self._collector is None or not self._collector.is_alive():
+            self._collector = threading.Thread(
+                target=self._collect, name="embeddings-collector", daemon=True
+            )
+            self._collector.start()
+
+    def _collect(self) -> None:
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._has_pending.wait()
+            # Give other chats a moment to join this batch.
+            time.sleep(self.batch_window)
+            with self._lock:
+                while self._pending:
+                    batch = self._pending[:self.max_batch_size]
+                    del self._pending[:len(batch)]
+                    self._executor.submit(self._embed_batch, batch)
+
+    def _embed_batch(self, batch: list[tuple[bytes, str]]) -> None:
+        try:
+            vectors = self.embeddings.embed_documents([text for _, text in batch])
+        except Exception as e:
+            traceback.print_exc()
+            with self._lock:
+                futures = [self._inflight.pop(digest) for digest, _ in batch]
+                self._persist.difference_update(digest for digest, _ in batch)
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            persist = [digest in self._persist for digest, _ in batch]
+            self._persist.difference_update(digest for digest, _ in batch)
+        items = [(digest, vector) for (digest, _), vector in zip(batch, vectors)]
+        self.cache.put_many([item for item, keep in zip(items, persist) if keep])
+        self.cache.put_many([item for item, keep in zip(items, persist) if not keep], persist=False)
+        with self._lock:
+            self.batches_sent += 1
+            self.texts_embedded += len(batch)
+            futures = [self._inflight.pop(digest) for digest, _ in batch]
+        for future, vector in zip(futures, vectors):
+            future.set_result(vector)
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import os
+import pickle
+import re
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from services.compact_index import (
+    build_index, choose_factory_key, index_family, key_family, reconstruct_all,
+)
+from services.mmap_index import HISTORY, MMAP_READ_FLAGS, TEXTS, LayeredIndex, LazyTextDocstore
+
+_DELTA_RE = re.compile(r"^delta_(\d+)\.pkl$")
+_BASE_RE = re.compile(r"^base_(\d+)$")
+
+
+class SegmentedIndexDir:
+    """
+    On-disk layout of an append-only FAISS index.
+
+    index_dir/
+        index.faiss, index.pkl   legacy ``save_local`` output, base generation 0
+        base_<N>/                compacted base containing every delta <= N
+            index.faiss          flat vectors (can be memory-mapped)
+            texts.bin            texts of chunks without a history byte range
+            docs.pkl             ids, metadata and (source, start, end) of each text
+        delta_<N>.pkl            vectors + metadata added by one ``update_index``
+
+    Chunks with ``byte_start``/``byte_end`` metadata are stored nowhere but in
+    the dialog history file itself.
+
+    Appends only ever write a new small delta file. Compaction writes a whole
+    new ``base_<N>`` directory and only then removes what it replaced, so a
+    crash at any point leaves a loadable index.
+    """
+
+    def __init__(
+        self,
+        index_dir: Path,
+        *,
+        storage: str = "flat",
+        ann_threshold: int = 0,
+        ann_type: str = "hnsw",
+        min_recall: float = 0.0,
+    ) -> None:
+        self.index_dir = index_dir
+        # How compaction stores vectors, see compact_index.choose_factory_key
+        self.storage = storage
+        self.ann_threshold = ann_threshold
+        self.ann_type = ann_type
+        self.min_recall = min_recall
+
+    # ------------------------------------------------------------------ #
+    #                     Reading
+    # ------------------------------------------------------------------ #
+    def latest_base(self) -> tuple[int, Optional[Path]]:
+        """(generation, path) of the newest base; (0, None) if there is none."""
+        bases = self._numbered(_BASE_RE)
+        if bases:
+            number, name = bases[-1]
+            return number, self.index_dir / name
+        if (self.index_dir / "index.faiss").exists():
+            return 0, self.index_dir
+        return 0, None
+
+    def deltas_after(self, generation: int) -> list[tuple[int, Path]]:
+        return [
+            (number, self.index_dir / name)
+            for number, name in self._numbered(_DELTA_RE)
+            if number > generation
+        ]
+
+    def last_delta_number(self) -> int:
+        deltas = self._numbered(_DELTA_RE)
+        return deltas[-1][0] if deltas else 0
+
+    def next_delta_number(self, last_known: int = 0) -> int:
+        """
+        Number for a new delta, above every segment on disk (not only those
+        a manager has loaded), so it never replaces another writer's delta.
+        """
+        return max(last_known, self.last_delta_number(), self.latest_base()[0]) + 1
+
+    @staticmethod
+    def load_base(
+        base_dir: Path,
+        embeddings: Embeddings,
+        history_path: Path,
+        use_mmap: bool = False,
+    ) -> FAISS:
+        """
+        Load a base snapshot. Chunk texts are never unpickled: the docstore
+        reads them from the history file (or ``texts.bin``) on demand. With
+        ``use_mmap`` the vectors stay in the OS page cache too, and new
+        additions go to an in-memory delta.
+        """
+        if not (base_dir / "docs.pkl").exists():
+            vs = FAISS.load_local(str(base_dir), embeddings, allow_dangerous_deserialization=True)
+            # Legacy pickled docstore: keep its texts, store new chunks as offsets
+            docstore = LazyTextDocstore(history_path)
+            docstore.add(vs.docstore._dict)
+            vs.docstore = docstore
+            return vs
+
+        with open(base_dir / "docs.pkl", "rb") as f:
+            state = pickle.load(f)
+        index_to_docstore_id = dict(enumerate(state["ids"]))
+
+        index = faiss.read_index(str(base_dir / "index.faiss"), MMAP_READ_FLAGS if use_mmap else 0)
+        if isinstance(index, faiss.IndexIVF):
+            # IVF can only reconstruct vectors by position with a direct map
+            index.make_direct_map()
+        if use_mmap:
+            index = LayeredIndex(index)
+        docstore = LazyTextDocstore(
+            history_path,
+            texts_path=base_dir / "texts.bin",
+            locations=state["locations"],
+            metadatas=state["metadatas"],
+        )
+        return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    @staticmethod
+    def read_delta(path: Path) -> dict:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    # ------------------------------------------------------------------ #
+    #                     Writing
+    # ------------------------------------------------------------------ #
+    def write_delta(
+        self,
+        number: int,
+        ids: list[str],
+        texts: list[str],
+        metadatas: list[dict],
+        embeddings: list[list[float]],
+    ) -> Path:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        # Texts already in the history file are resolved by byte range on load
+        texts = [
+            "" if "byte_start" in metadata and "byte_end" in metadata else text
+            for text, metadata in zip(texts, metadatas)
+        ]
+        path = self.index_dir / f"delta_{number:06d}.pkl"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {"ids": ids, "texts": texts, "metadatas": metadatas, "embeddings": embeddings},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path)
+        return path
+
+    def write_base(self, vectorstore: FAISS, generation: int) -> Path:
+        base_dir = self.index_dir / f"base_{generation:06d}"
+        tmp_dir = self.index_dir / f".base_{generation:06d}.tmp"
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir(parents=True)
+
+        index = vectorstore.index
+        kept: list[int] = []
+        ids: list[str] = []
+        locations: dict[str, tuple[str, int, int]] = {}
+        metadatas: dict[str, dict] = {}
+        position = 0
+        with open(tmp_dir / "texts.bin", "wb") as texts:
+            for i in range(index.ntotal):
+                _id = vectorstore.index_to_docstore_id[i]
+                location = None
+                if isinstance(vectorstore.docstore, LazyTextDocstore):
+                    location = vectorstore.docstore.location(_id)
+                doc = vectorstore.docstore.search(_id)
+                if not isinstance(doc, Document):
+                    continue
+                if location is None or location[0] != HISTORY:
+                    if not doc.page_content.strip():
+                        # Drops the junk "" vector of indexes created before lazy construction
+                        continue
+                    data = doc.page_content.encode("utf-8")
+                    texts.write(data)
+                    location = (TEXTS, position, position + len(data))
+                    position += len(data)
+                kept.append(i)
+                ids.append(_id)
+                locations[_id] = location
+                metadatas[_id] = doc.metadata
+        faiss.write_index(self._compacted_index(index, kept), str(tmp_dir / "index.faiss"))
+        with open(tmp_dir / "docs.pkl", "wb") as f:
+            pickle.dump(
+                {"ids": ids, "locations": locations, "metadatas": metadatas},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_dir, base_dir)
+        return base_dir
+
+    def _compacted_index(self, index, kept: list[int]) -> faiss.Index:
+        """
+        Index holding the vectors at positions ``kept``. Existing codes are
+        reused while the index kind stays the same; otherwise (first
+        compaction, storage change, crossing the ANN threshold) the vectors
+        are decoded and re-encoded.
+        """
+        base, delta = (index.base, index.delta) if isinstance(index, LayeredIndex) else (index, None)
+        key = choose_factory_key(len(kept), index.d, self.storage, self.ann_threshold, self.ann_type)
+        if len(kept) == index.ntotal and index_family(base) == key_family(key):
+            if delta is None:
+                return base
+            # A memory-mapped base does not own its codes and cannot grow (nor
+            # can a clone_index of it); a serialized round trip copies them
+            merged = faiss.deserialize_index(faiss.serialize_index(base))
+            merged.add(reconstruct_all(delta))
+            return merged
+
+        vectors = reconstruct_all(base)
+        if delta is not None:
+            vectors = np.vstack([vectors, reconstruct_all(delta)])
+        return build_index(
+            np.ascontiguousarray(vectors[kept], dtype="float32"),
+            storage=self.storage,
+            ann_threshold=self.ann_threshold,
+            ann_type=self.ann_type,
+            min_recall=self.min_recall,
+        )
+
+    def remove_folded(self, generation: int) -> None:
+        """Remove deltas and older bases already contained in ``base_<generation>``."""
+        for number, name in self._numbered(_DELTA_RE):
+            if number <= generation:
+                (self.index_dir / name).unlink(missing_ok=True)
+        for number, name in self._numbered(_BASE_RE):
+            if number < generation:
+                shutil.rmtree(self.index_dir / name, ignore_errors=True)
+        if generation > 0:
+            for legacy in ("index.faiss", "index.pkl"):
+                (self.index_dir / legacy).unlink(missing_ok=True)
+
+    def _numbered(self, pattern: re.Pattern) -> list[tuple[int, str]]:
+        if not self.index_dir.exists():
+            return []
+        found = []
+        for entry in os.listdir(self.index_dir):
+            match = pattern.match(entry)
+            if match:
+                found.append((int(match.group(1)), entry))
+        return sorted(found)
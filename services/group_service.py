@@ -1,10 +1,8 @@
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, field, asdict
 from datetime import datetime
-import json
-import os
-from pathlib import Path
 from services.character_service import CharacterService
+from services.state_store import StateStore, get_state_store
 
 @dataclass
 class GroupMember:
@@ -32,6 +30,25 @@ class Group:
     members: List[GroupMember] = field(default_factory=list)
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
+    # Индекс участников по имени персонажа; меняется вместе с members
+    # через add_member/remove_member
+    by_name: Dict[str, GroupMember] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        self.by_name = {member.character_name: member for member in self.members}
+
+    def has_member(self, character_name: str) -> bool:
+        return character_name in self.by_name
+
+    def add_member(self, member: GroupMember):
+        self.members.append(member)
+        self.by_name[member.character_name] = member
+
+    def remove_member(self, character_name: str) -> Optional[GroupMember]:
+        member = self.by_name.pop(character_name, None)
+        if member is not None:
+            self.members.remove(member)
+        return member
 
     def to_dict(self):
         return {
@@ -49,76 +66,88 @@ class Group:
         )
 
 class GroupService:
-    def __init__(self, groups_dir: str = "data/groups"):
-        self.groups_dir = Path(groups_dir)
-        self.groups: Dict[int, Group] = {}  # chat_id -> Group
+    def __init__(self, store: Optional[StateStore] = None):
+        self.store = store or get_state_store()
+        # Общий для всех экземпляров сервиса реестр групп: chat_id -> Group.
+        # Каждая группа читается из базы один раз, изменения видны всем экземплярам
+        self.groups = self.store.cache("groups", self._load_group)
         self.character_service = CharacterService()
-        self._ensure_groups_dir()
-        self._load_groups()
-
-    def _ensure_groups_dir(self):
-        """Создает директорию для хранения групп, если она не существует"""
-        self.groups_dir.mkdir(parents=True, exist_ok=True)
-
-    def _get_group_file_path(self, chat_id: int) -> Path:
-        """Возвращает путь к файлу группы"""
-        return self.groups_dir / f"group_{chat_id}.json"
-
-    def _load_groups(self):
-        """Загружает все сохраненные группы"""
-        for group_file in self.groups_dir.glob("group_*.json"):
-            try:
-                chat_id = int(group_file.stem.split('_')[1])
-                with open(group_file, 'r', encoding='utf-8') as f:
-                    group_data = json.load(f)
-                    self.groups[chat_id] = Group.from_dict(group_data)
-            except (json.JSONDecodeError, IOError, ValueError) as e:
-                print(f"Ошибка при загрузке группы из файла {group_file}: {e}")
-
-    def _save_group(self, chat_id: int):
-        """Сохраняет группу в файл"""
-        group = self.groups.get(chat_id)
-        if group:
-            try:
-                with open(self._get_group_file_path(chat_id), 'w', encoding='utf-8') as f:
-                    json.dump(group.to_dict(), f, ensure_ascii=False, indent=2)
-            except IOError as e:
-                print(f"Ошибка при сохранении группы {chat_id}: {e}")
+
+    def _load_group(self, chat_id: int) -> Group:
+        """Загружает группу из хранилища (участники - в порядке вступления)"""
+        row = self.store.fetchone("SELECT created_at, updated_at FROM groups WHERE chat_id = ?", (chat_id,))
+        if row is None:
+            return Group()
+        members = self.store.fetchall(
+            "SELECT user_id, character_name, joined_at FROM group_members WHERE chat_id = ? ORDER BY id",
+            (chat_id,),
+        )
+        return Group.from_dict({
+            'members': [dict(member) for member in members],
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+        })
+
+    def _touch_group(self, chat_id: int, group: Group):
+        """Сохраняет строку группы с новым временем изменения"""
+        self.store.execute(
+            "INSERT INTO groups (chat_id, created_at, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET updated_at = excluded.updated_at",
+            (chat_id, group.created_at.isoformat(), group.updated_at.isoformat()),
+        )
 
     def get_group(self, chat_id: int) -> Group:
         """Получает группу по ID чата"""
-        self._load_groups() # загружаем группы
-        if chat_id not in self.groups:
-            self.groups[chat_id] = Group()
-        return self.groups[chat_id]
+        return self.groups.get(chat_id)
 
     def add_member(self, chat_id: int, user_id: int, character_data: Dict[str, Any]) -> bool:
         group = self.get_group(chat_id)
         character_name = character_data['name']
         
         # Проверяем, не состоит ли уже персонаж в группе
-        if any(member.character_name == character_name for member in group.members):
+        if group.has_member(character_name):
             return False
             
-        group.members.append(GroupMember(
+        member = GroupMember(
             user_id=user_id,
             character_name=character_name
-        ))
+        )
+        group.add_member(member)
         group.updated_at = datetime.now()
-        self._save_group(chat_id)
+        try:
+            with self.store.transaction():
+                self._touch_group(chat_id, group)
+                self.store.execute(
+                    "INSERT OR IGNORE INTO group_members (chat_id, user_id, character_name, joined_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (chat_id, member.user_id, member.character_name, member.joined_at.isoformat()),
+                )
+        except Exception as e:
+            print(f"Ошибка при сохранении группы {chat_id}: {e}")
+            # В памяти не должно остаться того, чего нет в базе; об ошибке сообщит обработчик команды
+            self.groups.invalidate(chat_id)
+            raise
         return True
 
     def remove_member(self, chat_id: int, character_name: str) -> bool:
         group = self.get_group(chat_id)
         
         # Находим и удаляем участника
-        for i, member in enumerate(group.members):
-            if member.character_name == character_name:
-                group.members.pop(i)
-                group.updated_at = datetime.now()
-                self._save_group(chat_id)
-                return True
-        return False
+        if group.remove_member(character_name) is None:
+            return False
+        group.updated_at = datetime.now()
+        try:
+            with self.store.transaction():
+                self._touch_group(chat_id, group)
+                self.store.execute(
+                    "DELETE FROM group_members WHERE chat_id = ? AND character_name = ?",
+                    (chat_id, character_name),
+                )
+        except Exception as e:
+            print(f"Ошибка при сохранении группы {chat_id}: {e}")
+            self.groups.invalidate(chat_id)
+            raise
+        return True
 
     def get_members(self, chat_id: int) -> List[GroupMember]:
         group = self.get_group(chat_id)
@@ -140,5 +169,4 @@ class GroupService:
 
     def is_member_in_group(self, chat_id: int, character_name: str) -> bool:
         """Проверяет, состоит ли персонаж в группе"""
-        group = self.get_group(chat_id)
-        return any(member.character_name == character_name for member in group.members) 
\ No newline at end of file
+        return self.get_group(chat_id).has_member(character_name) 
\ No newline at end of file
@@ -1,15 +1,21 @@
 import re
-from typing import Dict, List
+import sqlite3
+from typing import Dict, List, Optional
 from dataclasses import dataclass, field
 from datetime import datetime
-import json
-import os
 from pathlib import Path
-from config.config import MAIN_PROMT, MAX_HISTORY_LENGTH
-from services.rag_service import get_or_create_rag_manager, RAGManager, delete_manager_and_clear_history, get_context
+from config.config import (
+    MAIN_PROMT, MAX_HISTORY_LENGTH, CAMPAIGN_INLINE_MAX_TOKENS, MAIN_OPENAI_MODEL, PROMPT_MAX_TOKENS,
+)
+from services.rag_service import schedule_index_update, delete_manager_and_clear_history, aget_context
+from services.campaign_index import aget_campaign_context
 from services.character_service import CharacterService
 from services.group_service import GroupService
 from services.campaign_service import CampaignService
+from services.prompt_assembler import PromptAssembler, PromptReport, PromptSection
+from services.state_store import StateStore, get_state_store
+from services.turn_chunker import format_turn
+from utils.tokens import truncate_to_tokens
 from utils.utils import get_path_to_simple_history_file
 
 
@@ -43,9 +49,9 @@ class ChatHistory:
     def add_message(self, role: str, content: str, chat_id: int):
         if len(self.messages) >= self.max_history_length:
 
+            # Индексация выполняется фоновым воркером, здесь только ставим задачу
             docs_path: Path = get_path_to_simple_history_file(chat_id)
-            rag_manager: RAGManager = get_or_create_rag_manager(docs_path)
-            rag_manager.update_index()
+            schedule_index_update(docs_path)
 
             self.messages.clear()
 
@@ -84,45 +90,74 @@ class ChatHistory:
         history.summary = data['summary']
         return history
 
+# Приоритеты частей промпта: при превышении PROMPT_MAX_TOKENS меньший сокращается первым.
+# Сначала меняющиеся части и старая история, а стабильный (кешируемый) префикс - последним
+RAG_PRIORITY = 10
+LORE_PRIORITY = 15
+HISTORY_PRIORITY = 20
+GROUP_PRIORITY = 30
+CAMPAIGN_PRIORITY = 40
+
 class HistoryService:
-    def __init__(self, history_dir: str = "data/history"):
-        self.history_dir = Path(history_dir)
+    def __init__(self, store: Optional[StateStore] = None):
+        self.store = store or get_state_store()
         self.chats: Dict[int, ChatHistory] = {}  # chat_id -> ChatHistory
         self.character_service = CharacterService()
         self.group_service = GroupService()
         self.campaign_service = CampaignService()
-        self._ensure_history_dir()
+        self.prompt_assembler = PromptAssembler(PROMPT_MAX_TOKENS, MAIN_OPENAI_MODEL)
+        # Размеры частей последнего промпта по чатам (для логов и отладки)
+        self.last_prompt_reports: Dict[int, PromptReport] = {}
         self._load_histories()
 
-    def _ensure_history_dir(self):
-        """Создает директорию для хранения истории, если она не существует"""
-        self.history_dir.mkdir(parents=True, exist_ok=True)
-
-    def _get_history_file_path(self, chat_id: int) -> Path:
-        """Возвращает путь к файлу истории"""
-        return self.history_dir / f"chat_{chat_id}.json"
-
     def _load_histories(self):
         """Загружает все сохраненные истории"""
-        for history_file in self.history_dir.glob("chat_*.json"):
-            try:
-                chat_id = int(history_file.stem.split('_')[1])
-                with open(history_file, 'r', encoding='utf-8') as f:
-                    history_data = json.load(f)
-                    self.chats[chat_id] = ChatHistory.from_dict(history_data)
-            except (json.JSONDecodeError, IOError, ValueError) as e:
-                print(f"Ошибка при загрузке истории из файла {history_file}: {e}")
+        try:
+            for row in self.store.fetchall("SELECT chat_id, role, content, timestamp FROM chat_messages ORDER BY id"):
+                history = self.chats.setdefault(row['chat_id'], ChatHistory())
+                history.messages.append(Message.from_dict(dict(row)))
+            for row in self.store.fetchall("SELECT chat_id, summary FROM chat_summaries"):
+                self.chats.setdefault(row['chat_id'], ChatHistory()).summary = row['summary']
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Ошибка при загрузке историй: {e}")
+
+    def _append_message(self, chat_id: int, role: str, content: str):
+        """Добавляет сообщение в историю: одна строка в хранилище вместо перезаписи всей истории"""
+        history = self.get_chat_history(chat_id)
+        count = len(history.messages)
+        history.add_message(role, content, chat_id)
+        message = history.messages[-1]
+        try:
+            with self.store.transaction():
+                # История переполнилась и была очищена перед добавлением
+                if len(history.messages) <= count:
+                    self.store.execute("DELETE FROM chat_messages WHERE chat_id = ?", (chat_id,))
+                self.store.execute(
+                    "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                    (chat_id, message.role, message.content, message.timestamp.isoformat()),
+                )
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении истории {chat_id}: {e}")
 
     def _save_history(self, chat_id: int):
-        """Сохраняет историю в файл"""
+        """Сохраняет историю чата целиком"""
         history = self.chats.get(chat_id)
         if history:
             try:
-                with open(self._get_history_file_path(chat_id), 'w', encoding='utf-8') as f:
-                    json.dump(history.to_dict(), f, ensure_ascii=False, indent=2)
-            except IOError as e:
+                with self.store.transaction():
+                    self.store.execute("DELETE FROM chat_messages WHERE chat_id = ?", (chat_id,))
+                    self.store.executemany(
+                        "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                        [(chat_id, m.role, m.content, m.timestamp.isoformat()) for m in history.messages],
+                    )
+                    self.store.execute(
+                        "INSERT OR REPLACE INTO chat_summaries (chat_id, summary) VALUES (?, ?)",
+                        (chat_id, history.summary),
+                    )
+            except sqlite3.Error as e:
                 print(f"Ошибка при сохранении истории {chat_id}: {e}")
 
+
     def _format_character_context(self, character: dict) -> str:
         """Format character information into a context string for the AI"""
         context = f"Персонаж пользователя с id {character['user_id']} по имени {character['name']}, "
@@ -185,20 +220,16 @@ class HistoryService:
         
         return context
 
-    def _format_group_context(self, chat_id: int) -> str:
-        """Format group information into a context string for the AI"""
-        members = self.group_service.get_members(chat_id)
-        if not members:
-            return ""
-            
-        context = "\n👥 Состав группы:\n"
-        for member in members:
+    def _format_group_members(self, chat_id: int) -> List[str]:
+        """Описание каждого участника группы отдельной строкой"""
+        members = []
+        for member in self.group_service.get_members(chat_id):
             character_data = self.character_service.get_active_character(member.user_id)
             if character_data:
-                context += f"\n{self._format_character_context(character_data)}"
+                members.append(self._format_character_context(character_data))
             else:
-                context += f"\nПерсонаж {member.character_name} (данные недоступны)"
-        return context
+                members.append(f"Персонаж {member.character_name} (данные недоступны)")
+        return members
 
     def get_chat_history(self, chat_id: int) -> ChatHistory:
         if chat_id not in self.chats:
@@ -206,44 +237,67 @@ class HistoryService:
         return self.chats[chat_id]
 
     def add_user_message(self, chat_id: int, content: str):
-        history = self.get_chat_history(chat_id)
-        history.add_message("user", content, chat_id)
-        self._save_history(chat_id)
+        self._append_message(chat_id, "user", content)
 
     def add_assistant_message(self, chat_id: int, content: str):
-        history = self.get_chat_history(chat_id)
-        history.add_message("assistant", content, chat_id)
-        self._save_history(chat_id)
+        self._append_message(chat_id, "assistant", content)
 
-    def _get_system_message(self, chat_id: int, user_message: str) -> dict:
-        """Формирует system-сообщение для API"""
-        system_content = MAIN_PROMT
+    async def _get_system_sections(self, chat_id: int, user_message: str) -> List[PromptSection]:
+        """
+        Части system-сообщения для API. Приоритет определяет порядок сокращения
+        при превышении бюджета: меньший сокращается первым
+        """
+        sections = [PromptSection("main", [MAIN_PROMT], required=True)]
 
-        # Добавляем описание кампании, если есть
+        # Добавляем описание кампании, если есть: длинное - только начало
+        # и разделы, относящиеся к сообщению
         campaign = self.campaign_service.get_campaign(chat_id)
+        lore = ""
         if campaign and campaign.description:
-            system_content += f"\n\nОписание текущей кампании:\n{campaign.description}"
+            try:
+                campaign_header, lore = await aget_campaign_context(chat_id, campaign.description, user_message)
+            except Exception as e:
+                print(f"Ошибка поиска по описанию кампании {chat_id}: {e}")
+                campaign_header = truncate_to_tokens(campaign.description, CAMPAIGN_INLINE_MAX_TOKENS)
+            sections.append(PromptSection(
+                "campaign", [campaign_header], priority=CAMPAIGN_PRIORITY,
+                header="\n\nОписание текущей кампании:\n",
+            ))
         
         # Перезагружаем информацию о группе перед каждым запросом
         # self.group_service._load_groups()
         
-        group_context = self._format_group_context(chat_id)
-        if group_context:
-            system_content += group_context
-
-        context: list[str] = get_context(chat_id, user_message)
-        if context:
-            system_content += f"\n\nПолезные отрывки из истории: {'\n'.join(context)} "
+        sections.append(PromptSection(
+            "group", self._format_group_members(chat_id), priority=GROUP_PRIORITY,
+            header="\n👥 Состав группы:\n\n", joiner="\n",
+        ))
+
+        # Дальше - части, меняющиеся с каждым сообщением: они идут отдельным
+        # system-сообщением после истории, чтобы не ломать кешируемый префикс
+        sections.append(PromptSection(
+            "lore", [lore] if lore else [], priority=LORE_PRIORITY, volatile=True,
+            header="Отрывки из описания кампании, относящиеся к запросу:\n",
+        ))
+
+        context: list[str] = await aget_context(chat_id, user_message)
+        sections.append(PromptSection(
+            "rag", context, priority=RAG_PRIORITY, volatile=True, header="\n\nПолезные отрывки из истории: ",
+        ))
 
         # if history.summary:
         #     system_content += f"\n\nПредыдущий контекст диалога: {history.summary}"
 
-        return {"role": "system", "content": system_content}
+        return sections
 
-    def get_messages_for_api(self, chat_id: int, user_message: str) -> list[dict]:
+    async def get_messages_for_api(self, chat_id: int, user_message: str) -> list[dict]:
         history = self.get_chat_history(chat_id)
-        system_message = self._get_system_message(chat_id, user_message)
-        return [system_message] + history.get_messages()
+        sections = await self._get_system_sections(chat_id, user_message)
+        messages, report = self.prompt_assembler.assemble(
+            sections, history.get_messages(), history_priority=HISTORY_PRIORITY
+        )
+        self.last_prompt_reports[chat_id] = report
+        print(f"[prompt] chat {chat_id}: {report.summary()}")
+        return messages
 
     def clear_history(self, chat_id: int):
         if chat_id in self.chats:
@@ -265,6 +319,6 @@ class HistoryService:
         user_content = re.sub(r"\n+", "\n", user_content)
         ai_response_content = re.sub(r"\n+", "\n", ai_response_content)
 
+        # Одна запись на обмен репликами, чтобы индексатор не увидел половину хода
         with open(path, "a", encoding="utf-8") as f:
-            f.write("Сообщение пользователя:" + "\n" + user_content + "\n\n")
-            f.write("Ответ мастера:" + "\n" + ai_response_content + "\n\n")
+            f.write(format_turn(user_content, ai_response_content))
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import queue
+import threading
+import traceback
+from typing import Callable, Hashable
+
+
+class IndexingQueue:
+    """
+    Background worker that owns index updates.
+
+    Jobs are keyed (one key == one chat file): while a job for a key is still
+    waiting, enqueuing the same key again is a no-op, so a burst of overflows
+    in one chat costs a single ``update_index`` run.
+    """
+
+    def __init__(self, name: str = "rag-indexer") -> None:
+        self.name = name
+        self._queue: "queue.Queue[Hashable]" = queue.Queue()
+        self._pending: dict[Hashable, Callable[[], None]] = {}
+        self._lock = threading.Lock()
+        self._worker: threading.Thread | None = None
+
+    def enqueue(self, key: Hashable, job: Callable[[], None]) -> bool:
+        """Schedule ``job`` for ``key``. Returns False if a job is already pending."""
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending[key] = job
+            self._ensure_worker()
+        self._queue.put(key)
+        return True
+
+    def discard(self, key: Hashable) -> bool:
+        """Drop a pending (not yet started) job, e.g. when the chat is cleared."""
+        with self._lock:
+            return self._pending.pop(key, None) is not None
+
+    def backlog_depth(self) -> int:
+        """Number of distinct keys waiting to be processed."""
+        with self._lock:
+            return len(self._pending)
+
+    def join(self) -> None:
+        """Block until every queued job has been processed."""
+        self._queue.join()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            try:
+                # Remove the key *before* running: new data arriving while the
+                # job runs must schedule a fresh pass.
+                with self._lock:
+                    job = self._pending.pop(key, None)
+                if job is not None:
+                    job()
+            except Exception:
+                print(f"[{self.name}] Indexing job for {key} failed")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import heapq
+import math
+import pickle
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+from services.mmap_index import MappedFile
+from services.turn_chunker import TurnChunk
+
+_WORD_RE = re.compile(r"\w+")
+# Crude stemming for Russian inflection: "гоблин", "гоблина", "гоблину" -> "гоблин"
+_STEM_LENGTH = 6
+_MIN_TOKEN_LENGTH = 3
+# Function words: absent from the index they would read as rare unmatched terms
+_STOP_WORDS = frozenset("""
+    что где как кто там тут это эта этот эти тот так уже еще ещё или для при про
+    над под без его ее её они она оно мне меня мой моя мое моё нас вас вам них
+    был была было были будет есть нет даже если чтобы когда тогда потом теперь
+    очень можно нужно надо все всё всех весь вот ли же бы
+    the and for with that this what where who how are was were you your
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    return [
+        word[:_STEM_LENGTH]
+        for word in _WORD_RE.findall(text.lower())
+        if len(word) >= _MIN_TOKEN_LENGTH and word not in _STOP_WORDS
+    ]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the turn chunks of one history file.
+
+    Chunks are referenced by their byte range in the history file, so only
+    term statistics live here; texts are read back through mmap. Persisted
+    as an append-only pickle log of added batches, each with the history
+    offset it brings the index up to.
+    """
+
+    def __init__(self, path: Path, history_path: Path, k1: float = 1.5, b: float = 0.75) -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.offset = 0
+        self.turns = 0
+        self._file = MappedFile(history_path)
+        self._postings: dict[str, dict[int, int]] = {}  # term -> {chunk: term frequency}
+        self._lengths: list[int] = []
+        self._chunks: list[tuple[int, int, dict]] = []  # (byte_start, byte_end, metadata)
+        self._total_length = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def add(self, chunks: list[TurnChunk], offset: int, turns: int) -> None:
+        """Index ``chunks``; the history file is now covered up to ``offset``."""
+        batch = {
+            "entries": [
+                (Counter(tokenize(c.text)), c.byte_start, c.byte_end, c.metadata())
+                for c in chunks
+            ],
+            "offset": offset,
+            "turns": turns,
+        }
+        with self._lock:
+            self._apply(batch)
+            with open(self.path, "ab") as f:
+                pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def search(self, query: str, k: int) -> tuple[list[tuple[Document, float]], float]:
+        """
+        Top-k chunks with their BM25 scores, and the confidence of the best
+        one: the idf-weighted share of the query terms it contains. Terms the
+        index has never seen count as rare ones, since only the vector search
+        can still match them.
+        """
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._chunks)
+            if not n or not terms:
+                return [], 0.0
+            average_length = self._total_length / n or 1.0
+            unseen_idf = self._idf(n, 1)
+            idfs: dict[str, float] = {}
+            scores: dict[int, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = idfs[term] = self._idf(n, len(postings))
+                for chunk, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[chunk] / average_length)
+                    scores[chunk] = scores.get(chunk, 0.0) + idf * tf * (self.k1 + 1) / norm
+            if not scores:
+                return [], 0.0
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            best = top[0][0]
+            matched = sum(idf for term, idf in idfs.items() if best in self._postings[term])
+            total = sum(idfs.values()) + unseen_idf * (len(terms) - len(idfs))
+            hits = [(self._chunks[chunk], score) for chunk, score in top]
+
+        results = []
+        for (start, end, metadata), score in hits:
+            text = self._file.read(start, end).decode("utf-8", errors="replace").strip()
+            results.append((Document(page_content=text, metadata=dict(metadata)), score))
+        return results, matched / total if total else 0.0
+
+    def delete(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._lengths.clear()
+            self._chunks.clear()
+            self._total_length = self.offset = self.turns = 0
+            self.path.unlink(missing_ok=True)
+
+    @staticmethod
+    def _idf(n: int, df: int) -> float:
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def _apply(self, batch: dict) -> None:
+        for counts, start, end, metadata in batch["entries"]:
+            chunk = len(self._chunks)
+            self._chunks.append((start, end, metadata))
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._total_length += length
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[chunk] = tf
+        self.offset = batch["offset"]
+        self.turns = batch["turns"]
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, "r+b") as f:
+            while True:
+                good = f.tell()
+                try:
+                    batch = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError):
+                    # End of log, or a torn write at the tail (crash mid-append):
+                    # cut it off so the batches re-added by the catch-up stay readable.
+                    f.truncate(good)
+                    break
+                self._apply(batch)
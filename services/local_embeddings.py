@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def _normalized(vectors: np.ndarray) -> list[list[float]]:
+    """Unit-length rows: similarity thresholds and MMR assume normalized vectors."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype("float32").tolist()
+
+
+class LocalOnnxEmbeddings(Embeddings):
+    """
+    Sentence embeddings computed on the CPU by an ONNX model (via ``fastembed``).
+
+    Documents are split into ``batch_size`` batches run by ``workers``
+    threads (ONNX Runtime releases the GIL); the ``threads`` CPU threads are
+    divided between them. Queries are embedded in the caller's thread.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        *,
+        batch_size: int = 32,
+        workers: int = 2,
+        threads: int = 0,
+        cache_dir: Optional[str] = None,
+    ) -> None:
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDINGS_BACKEND=local requires the fastembed package: pip install fastembed"
+            ) from e
+        threads = threads or os.cpu_count() or 1
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = TextEmbedding(
+            model_name=model_name,
+            cache_dir=cache_dir,
+            threads=max(threads // max(workers, 1), 1),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="local-embeddings")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        vectors: list[list[float]] = []
+        for result in self._executor.map(self._embed_batch, batches):
+            vectors.extend(result)
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_batch([text])[0]
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return _normalized(np.vstack(list(self.model.embed(texts, batch_size=len(texts)))))
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic feature-hashing embedder: words and character trigrams are
+    hashed (blake2b, signed) into ``dimensions`` buckets, then normalized.
+    No model and no network, and the same text always gets the same vector,
+    across processes too. Meant for tests and fully offline runs; texts that
+    share words come out close.
+    """
+
+    def __init__(self, dimensions: int = 384) -> None:
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return _normalized(np.vstack([self._embed(text) for text in texts])) if texts else []
+
+    def embed_query(self, text: str) -> list[float]:
+        return _normalized(self._embed(text)[None, :])[0]
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype="float32")
+        for feature in self._features(text):
+            value = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[value % self.dimensions] += 1.0 if value >> 63 else -1.0
+        return vector
+
+    @staticmethod
+    def _features(text: str) -> Iterator[str]:
+        for word in _WORD_RE.findall(text.lower()):
+            yield "w:" + word
+            padded = f"#{word}#"
+            for i in range(len(padded) - 2):
+                yield "c:" + padded[i:i + 3]
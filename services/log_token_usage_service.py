@@ -1,41 +1,188 @@
-import json
-import os
-from datetime import datetime
-from pathlib import Path
+import threading
+from dataclasses import dataclass, fields
+from datetime import date, datetime
+from typing import Dict, Optional, Tuple, Union
+from services.state_store import StateStore, get_state_store
+
+# Ключ агрегата: (chat_id, user_id, model, день в формате YYYY-MM-DD)
+AggregateKey = Tuple[int, int, str, str]
+_KEY_FIELDS = ("chat_id", "user_id", "model", "day")
+
+@dataclass
+class UsageTotals:
+    """Суммарный расход токенов за набор запросов"""
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cached_tokens: int = 0
+    # Сумма времени ответа и число запросов, для которых оно известно
+    latency_ms: int = 0
+    latency_requests: int = 0
+
+    def add(self, other: "UsageTotals"):
+        for f in fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    @property
+    def avg_latency_ms(self) -> Optional[float]:
+        return self.latency_ms / self.latency_requests if self.latency_requests else None
+
+
+def rebuild_token_usage_aggregates(store: StateStore):
+    """Пересчитывает дневные агрегаты по полному журналу (после импорта или обновления базы)"""
+    with store.transaction():
+        store.execute("DELETE FROM token_usage_daily")
+        store.execute(
+            "INSERT INTO token_usage_daily SELECT chat_id, user_id, model, substr(timestamp, 1, 10), "
+            "COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens), SUM(cached_tokens), "
+            "COALESCE(SUM(latency_ms), 0), COUNT(latency_ms) "
+            "FROM token_usage GROUP BY chat_id, user_id, model, substr(timestamp, 1, 10)"
+        )
+
 
 class TokenUsageService:
-    def __init__(self):
-        self.logs_dir = Path("logs/token_usage")
-        self.logs_dir.mkdir(parents=True, exist_ok=True)
+    """
+    Журнал расхода токенов. Каждый запрос - одна дописываемая строка журнала
+    и обновление дневного агрегата (чат, пользователь, модель, день) в той же
+    транзакции. Агрегаты держатся в памяти: запросы статистики не читают журнал.
+    """
+
+    def __init__(self, store: Optional[StateStore] = None):
+        self.store = store or get_state_store()
+        self._aggregates: Dict[AggregateKey, UsageTotals] = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self._load_aggregates()
 
-    def log_token_usage(self, chat_id: int, usage_info: dict):
+    def _load_aggregates(self):
+        """Загружает дневные агрегаты; в базе старой версии они сначала пересчитываются"""
+        if self.store.fetchone("SELECT 1 FROM token_usage_daily LIMIT 1") is None \
+                and self.store.fetchone("SELECT 1 FROM token_usage LIMIT 1") is not None:
+            rebuild_token_usage_aggregates(self.store)
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        """
+        Перечитывает агрегаты, если базу изменило другое соединение
+        (import_state.py, другой процесс бота); свои записи версию не меняют
+        """
+        version = self.store.data_version()
+        if version == self._version:
+            return
+        aggregates: Dict[AggregateKey, UsageTotals] = {}
+        for row in self.store.fetchall("SELECT * FROM token_usage_daily"):
+            row = dict(row)
+            key = tuple(row.pop(name) for name in _KEY_FIELDS)
+            aggregates[key] = UsageTotals(**row)
+        self._aggregates = aggregates
+        self._version = version
+
+    def log_token_usage(self, chat_id: int, usage_info: dict, user_id: int = 0):
         """
         Логирует информацию об использовании токенов для конкретного чата
         """
-        log_file = self.logs_dir / f"chat_{chat_id}.json"
-        
-        # Создаем запись о текущем использовании
-        current_usage = {
-            "timestamp": datetime.now().isoformat(),
-            "prompt_tokens": usage_info["prompt_tokens"],
-            "completion_tokens": usage_info["completion_tokens"],
-            "total_tokens": usage_info["total_tokens"],
+        timestamp = datetime.now().isoformat()
+        model = usage_info.get("model", "")
+        latency_ms = usage_info.get("latency_ms")
+        entry = UsageTotals(
+            requests=1,
+            prompt_tokens=usage_info["prompt_tokens"],
+            completion_tokens=usage_info["completion_tokens"],
+            total_tokens=usage_info["total_tokens"],
+            # Токены промпта, взятые из кеша OpenAI, и время ответа API
+            cached_tokens=usage_info.get("cached_tokens", 0),
+            latency_ms=latency_ms or 0,
+            latency_requests=int(latency_ms is not None),
+        )
+        key = (chat_id, user_id, model, timestamp[:10])
+
+        with self._lock:
+            try:
+                with self.store.transaction():
+                    self.store.execute(
+                        "INSERT INTO token_usage (chat_id, user_id, model, timestamp, prompt_tokens, "
+                        "completion_tokens, total_tokens, cached_tokens, latency_ms) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            chat_id, user_id, model, timestamp, entry.prompt_tokens,
+                            entry.completion_tokens, entry.total_tokens, entry.cached_tokens, latency_ms,
+                        ),
+                    )
+                    self.store.execute(
+                        "INSERT INTO token_usage_daily VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (chat_id, user_id, model, day) DO UPDATE SET "
+                        "requests = requests + 1, "
+                        "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                        "completion_tokens = completion_tokens + excluded.completion_tokens, "
+                        "total_tokens = total_tokens + excluded.total_tokens, "
+                        "cached_tokens = cached_tokens + excluded.cached_tokens, "
+                        "latency_ms = latency_ms + excluded.latency_ms, "
+                        "latency_requests = latency_requests + excluded.latency_requests",
+                        (
+                            *key, entry.prompt_tokens, entry.completion_tokens, entry.total_tokens,
+                            entry.cached_tokens, entry.latency_ms, entry.latency_requests,
+                        ),
+                    )
+            except Exception as e:
+                print(f"Ошибка при записи расхода токенов чата {chat_id}: {e}")
+                return
+            self._aggregates.setdefault(key, UsageTotals()).add(entry)
+
+    def get_totals_by(
+        self,
+        group_by: str,
+        chat_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+        model: Optional[str] = None,
+        since: Optional[Union[date, datetime]] = None,
+        until: Optional[Union[date, datetime]] = None,
+    ) -> Dict[Union[int, str], UsageTotals]:
+        """
+        Расход токенов с разбивкой по group_by ("chat_id", "user_id", "model"
+        или "day"), с фильтрами по чату, пользователю, модели и дням [since, until]
+        """
+        position = _KEY_FIELDS.index(group_by)
+        first = since.isoformat()[:10] if since else None
+        last = until.isoformat()[:10] if until else None
+        result: Dict[Union[int, str], UsageTotals] = {}
+        with self._lock:
+            self._refresh()
+            for key, totals in self._aggregates.items():
+                key_chat, key_user, key_model, day = key
+                if chat_id is not None and key_chat != chat_id:
+                    continue
+                if user_id is not None and key_user != user_id:
+                    continue
+                if model is not None and key_model != model:
+                    continue
+                if (first and day < first) or (last and day > last):
+                    continue
+                result.setdefault(key[position], UsageTotals()).add(totals)
+        return result
+
+    def get_totals(self, **filters) -> UsageTotals:
+        """Суммарный расход токенов с теми же фильтрами, что у get_totals_by"""
+        total = UsageTotals()
+        for totals in self.get_totals_by("chat_id", **filters).values():
+            total.add(totals)
+        return total
+
+    def get_cache_stats(self, chat_id: int) -> dict:
+        """
+        Доля токенов промпта, взятых из кеша, и среднее время ответа
+        для конкретного чата
+        """
+        totals = self.get_totals(chat_id=chat_id)
+        return {
+            "requests": totals.requests,
+            "prompt_tokens": totals.prompt_tokens,
+            "cached_tokens": totals.cached_tokens,
+            "cache_hit_ratio": totals.cache_hit_ratio,
+            "avg_latency_ms": totals.avg_latency_ms,
         }
-        
-        # Читаем существующие логи или создаем новый список
-        if log_file.exists():
-            with open(log_file, 'r', encoding='utf-8') as f:
-                try:
-                    logs = json.load(f)
-                except json.JSONDecodeError:
-                    logs = []
-        else:
-            logs = []
-        
-        # Добавляем новую запись
-        logs.append(current_usage)
-        
-        # Сохраняем обновленные логи
-        with open(log_file, 'w', encoding='utf-8') as f:
-            json.dump(logs, f, ensure_ascii=False, indent=2)
-            
\ No newline at end of file
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import mmap
+import threading
+from pathlib import Path
+from typing import Optional, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+# Flat codes are only memory-mapped by IO_FLAG_MMAP_IFC (newer faiss); older
+# builds accept IO_FLAG_MMAP and simply read flat indexes into RAM.
+MMAP_READ_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class LayeredIndex:
+    """
+    Read-only (memory-mapped) base index plus a small in-memory delta.
+
+    Exposes the subset of the faiss ``Index`` API LangChain's ``FAISS`` uses
+    (``d``, ``ntotal``, ``add``, ``search``, ``reconstruct``). Positions
+    ``[0, base.ntotal)`` belong to the base, the rest to the delta.
+    """
+
+    def __init__(self, base: faiss.Index) -> None:
+        self.base = base
+        self.d = base.d
+        self.delta = faiss.IndexFlatL2(base.d)
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal + self.delta.ntotal
+
+    def add(self, x: np.ndarray) -> None:
+        self.delta.add(x)
+
+    def search(self, x: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        base_d, base_i = self.base.search(x, k)
+        if self.delta.ntotal == 0:
+            return base_d, base_i
+        delta_d, delta_i = self.delta.search(x, k)
+        delta_i = np.where(delta_i >= 0, delta_i + self.base.ntotal, -1)
+        distances = np.concatenate([base_d, delta_d], axis=1)
+        ids = np.concatenate([base_i, delta_i], axis=1)
+        # Missing results come back as (FLT_MAX, -1) and sort last
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, 1), np.take_along_axis(ids, order, 1)
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        i = int(i)
+        if i < self.base.ntotal:
+            return self.base.reconstruct(i)
+        return self.delta.reconstruct(i - self.base.ntotal)
+
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        if n == 0:
+            return np.zeros((0, self.d), dtype="float32")
+        return np.vstack([self.reconstruct(i) for i in range(i0, i0 + n)])
+
+
+class MappedFile:
+    """Read-only mmap of a file, remapped when it has grown past the mapping."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._mmap: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def read(self, start: int, end: int) -> bytes:
+        if start >= end:
+            return b""
+        with self._lock:
+            if self._mmap is None or end > len(self._mmap):
+                if self._mmap is not None:
+                    self._mmap.close()
+                with open(self.path, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[start:end]
+
+
+HISTORY = "history"
+TEXTS = "texts"
+
+
+class LazyTextDocstore(Docstore, AddableMixin):
+    """
+    Docstore that keeps only metadata and text locations in memory.
+
+    Chunks carrying ``byte_start``/``byte_end`` metadata already exist in the
+    dialog history file, so only ``(offset, end)`` is stored for them and the
+    text is read back through mmap when a result is returned. Other texts
+    (written before byte ranges existed) live in the base's ``texts.bin`` or,
+    if added after load, in memory.
+    """
+
+    def __init__(
+        self,
+        history_path: Path,
+        texts_path: Optional[Path] = None,
+        locations: Optional[dict[str, tuple[str, int, int]]] = None,
+        metadatas: Optional[dict[str, dict]] = None,
+    ) -> None:
+        self._files = {HISTORY: MappedFile(history_path)}
+        if texts_path is not None:
+            self._files[TEXTS] = MappedFile(texts_path)
+        self._locations = locations or {}
+        self._metadatas = metadatas or {}
+        self._inline: dict[str, Document] = {}
+
+    def __len__(self) -> int:
+        return len(self._locations) + len(self._inline)
+
+    def search(self, search: str) -> Union[str, Document]:
+        if search in self._inline:
+            return self._inline[search]
+        location = self._locations.get(search)
+        if location is None:
+            return f"ID {search} not found."
+        source, start, end = location
+        text = self._files[source].read(start, end).decode("utf-8", errors="replace").strip()
+        return Document(page_content=text, metadata=dict(self._metadatas.get(search, {})), id=search)
+
+    def metadata(self, _id: str) -> dict:
+        """Metadata without reading the text."""
+        if _id in self._inline:
+            return self._inline[_id].metadata
+        return self._metadatas.get(_id, {})
+
+    def location(self, _id: str) -> Optional[tuple[str, int, int]]:
+        return self._locations.get(_id)
+
+    def add(self, texts: dict[str, Document]) -> None:
+        overlapping = set(texts) & (set(self._inline) | set(self._locations))
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for _id, doc in texts.items():
+            start, end = doc.metadata.get("byte_start"), doc.metadata.get("byte_end")
+            if start is not None and end is not None:
+                self._locations[_id] = (HISTORY, start, end)
+                self._metadatas[_id] = doc.metadata
+            else:
+                self._inline[_id] = doc
+
+    def delete(self, ids: list) -> None:
+        for _id in ids:
+            self._inline.pop(_id, None)
+            self._locations.pop(_id, None)
+            self._metadatas.pop(_id, None)
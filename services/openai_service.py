@@ -1,3 +1,5 @@
+import time
+
 from openai import AsyncOpenAI
 from config.config import OPENAI_API_KEY, MAIN_OPENAI_MODEL, MAIN_OPENAI_TEMPERATURE
 from services.history_service import HistoryService
@@ -56,28 +58,36 @@ class OpenAIService:
         self.history_service.add_user_message(chat_id, result_message)
         
         # Получаем историю диалога
-        messages = self.history_service.get_messages_for_api(chat_id, user_message)
+        messages = await self.history_service.get_messages_for_api(chat_id, user_message)
         
         # Логируем запрос
         self.logger_service.log_request(user_id, messages)
         
-        # Получаем ответ от OpenAI
+        # Получаем ответ от OpenAI. Ключ кеша по чату направляет запросы
+        # одного чата на сервер, где уже закеширован их общий префикс
+        started = time.monotonic()
         response = await self.client.chat.completions.create(
             model=self.model,
             messages=messages,  # type: ignore
-            temperature=self.temperature
+            temperature=self.temperature,
+            prompt_cache_key=f"chat-{chat_id}",
         )
+        latency_ms = round((time.monotonic() - started) * 1000)
 
         # Сохраняем ответ ассистента в историю
         assistant_response = response.choices[0].message.content
         self.history_service.add_assistant_message(chat_id, assistant_response)
         
         # Логируем использование токенов
+        details = response.usage.prompt_tokens_details
         usage_info = {
             "prompt_tokens": response.usage.prompt_tokens,
             "completion_tokens": response.usage.completion_tokens,
-            "total_tokens": response.usage.total_tokens
+            "total_tokens": response.usage.total_tokens,
+            "cached_tokens": (details.cached_tokens or 0) if details else 0,
+            "latency_ms": latency_ms,
+            "model": response.model,
         }
-        self.token_usage_service.log_token_usage(chat_id, usage_info)
+        self.token_usage_service.log_token_usage(chat_id, usage_info, user_id=user_id)
         
         return assistant_response 
\ No newline at end of file
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+
+from utils.tokens import count_tokens, truncate_to_tokens
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# A part cut shorter than this is dropped rather than kept as a stub
+_MIN_PART_TOKENS = 20
+
+
+@dataclass
+class PromptSection:
+    """
+    One block of the system message: ``header`` followed by ``parts``
+    joined with ``joiner``. When the prompt is over budget, sections are
+    trimmed from the lowest ``priority`` up; ``required`` ones never are.
+    Trimming shortens the longest parts first, so e.g. every character
+    sheet of a big party keeps its beginning.
+
+    ``volatile`` sections (changing with every message, like retrieved
+    excerpts) are kept out of the first system message, so that message
+    and the history after it form a prefix the API can cache.
+    """
+    name: str
+    parts: list[str]
+    priority: int = 0
+    required: bool = False
+    header: str = ""
+    joiner: str = "\n"
+    volatile: bool = False
+
+    def render(self) -> str:
+        return self.header + self.joiner.join(self.parts) if self.parts else ""
+
+
+@dataclass
+class PromptReport:
+    """Tokens per section before and after trimming for one request."""
+    budget: int
+    sections: dict[str, tuple[int, int]] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return sum(after for _, after in self.sections.values())
+
+    def summary(self) -> str:
+        sizes = " ".join(
+            f"{name}={after}" if after == before else f"{name}={after}/{before}"
+            for name, (before, after) in self.sections.items()
+        )
+        budget = f"/{self.budget}" if self.budget else ""
+        return f"{sizes} total={self.total}{budget}"
+
+
+class PromptAssembler:
+    """
+    Builds the messages for the chat API within ``budget`` tokens (0 = no
+    limit): a system message from the stable sections, the dialog history,
+    and a second system message with the volatile sections right before the
+    latest (player's) message. History has a priority like the sections; its
+    oldest messages go first, the latest one is always kept.
+    """
+
+    def __init__(self, budget: int, model: str) -> None:
+        self.budget = budget
+        self.model = model
+
+    def assemble(
+        self,
+        sections: list[PromptSection],
+        history: list[dict],
+        history_priority: int = 0,
+    ) -> tuple[list[dict], PromptReport]:
+        report = PromptReport(self.budget)
+        part_tokens = {s.name: [self._count(p) for p in s.parts] for s in sections}
+        section_tokens = {s.name: self._section_tokens(s, part_tokens[s.name]) for s in sections}
+        history_tokens = [self._count(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in history]
+        before = dict(section_tokens, history=sum(history_tokens))
+
+        system_messages = 1 + any(s.volatile and s.parts for s in sections)
+        over = (
+            sum(section_tokens.values()) + MESSAGE_OVERHEAD_TOKENS * system_messages
+            + sum(history_tokens) - self.budget
+        )
+        trimmable = [s for s in sections if not s.required and s.parts]
+        trimmable.append(None)  # the history
+        trimmable.sort(key=lambda s: history_priority if s is None else s.priority)
+        for section in trimmable:
+            if not self.budget or over <= 0:
+                break
+            if section is None:
+                while over > 0 and len(history) > 1:
+                    history = history[1:]
+                    over -= history_tokens.pop(0)
+                continue
+            current = section_tokens[section.name]
+            section.parts, part_tokens[section.name] = self._fit_parts(
+                section.parts, part_tokens[section.name], max(sum(part_tokens[section.name]) - over, 0)
+            )
+            section_tokens[section.name] = self._section_tokens(section, part_tokens[section.name])
+            over -= current - section_tokens[section.name]
+
+        for name, tokens in before.items():
+            after = sum(history_tokens) if name == "history" else section_tokens[name]
+            report.sections[name] = (tokens, after)
+        messages = [{"role": "system", "content": "".join(s.render() for s in sections if not s.volatile)}]
+        messages += history
+        volatile = "".join(s.render() for s in sections if s.volatile).strip()
+        if volatile:
+            messages.insert(max(len(messages) - 1, 1), {"role": "system", "content": volatile})
+        return messages, report
+
+    def _count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def _section_tokens(self, section: PromptSection, part_tokens: list[int]) -> int:
+        if not section.parts:
+            return 0
+        return self._count(section.header) + sum(part_tokens) + len(part_tokens) - 1
+
+    def _fit_parts(self, parts: list[str], tokens: list[int], target: int) -> tuple[list[str], list[int]]:
+        """Cap every part at the same token limit, the largest that fits ``target``."""
+        if sum(tokens) <= target:
+            return parts, tokens
+        low, high = 0, max(tokens)
+        while low < high:
+            limit = (low + high + 1) // 2
+            if sum(min(t, limit) for t in tokens) <= target:
+                low = limit
+            else:
+                high = limit - 1
+        fitted: list[tuple[str, int]] = []
+        for part, count in zip(parts, tokens):
+            if count <= low:
+                fitted.append((part, count))
+            elif low >= _MIN_PART_TOKENS:
+                fitted.append((truncate_to_tokens(part, low, self.model), low))
+        return [p for p, _ in fitted], [t for _, t in fitted]
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Entry(Generic[T]):
+    value: T
+    last_used: float
+
+
+class ManagerRegistry(Generic[T]):
+    """
+    Bounded LRU registry of loaded objects (one RAGManager per chat file).
+
+    Entries are evicted when the registry exceeds ``max_items`` or
+    ``max_memory_bytes`` (as reported by ``size_of``), and when they have not
+    been used for ``idle_ttl`` seconds. ``on_evict`` is called for every
+    evicted entry outside the registry lock, so it may block on I/O; until
+    it returns the key stays locked, so ``get_or_create`` waits for e.g. a
+    flush to finish instead of loading a second copy next to the old one.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[Hashable], T],
+        *,
+        max_items: int = 256,
+        max_memory_bytes: int = 0,
+        idle_ttl: float = 0,
+        size_of: Optional[Callable[[T], int]] = None,
+        on_evict: Optional[Callable[[Hashable, T], None]] = None,
+        sweep_interval: float = 60,
+    ) -> None:
+        self._factory = factory
+        self.max_items = max_items
+        self.max_memory_bytes = max_memory_bytes
+        self.idle_ttl = idle_ttl
+        self._size_of = size_of
+        self._on_evict = on_evict
+        self._sweep_interval = sweep_interval
+
+        self._entries: "OrderedDict[Hashable, _Entry[T]]" = OrderedDict()
+        self._key_locks: dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[T]:
+        """Return a loaded entry (marking it as used) or None, never loads."""
+        with self._lock:
+            entry = self._touch(key)
+        return entry.value if entry else None
+
+    def peek(self, key: Hashable) -> Optional[T]:
+        """Return a loaded entry without touching LRU order or counters."""
+        entry = self._entries.get(key)
+        return entry.value if entry else None
+
+    def get_or_create(self, key: Hashable) -> T:
+        with self._lock:
+            entry = self._touch(key)
+            if entry:
+                evicted = self._collect_evictions(force=False)
+            else:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if entry:
+            self._evict(evicted)
+            return entry.value
+
+        # Load outside the registry lock: other chats are not blocked while
+        # one index is read from disk, and one key is never loaded twice.
+        with key_lock:
+            with self._lock:
+                entry = self._touch(key)
+                if entry is None:
+                    self.misses += 1
+            if entry:
+                return entry.value
+            value = self._factory(key)
+            with self._lock:
+                self._entries[key] = _Entry(value, time.monotonic())
+                self._key_locks.pop(key, None)
+                evicted = self._collect_evictions(force=True)
+        self._evict(evicted)
+        return value
+
+    def pop(self, key: Hashable) -> Optional[T]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry.value if entry else None
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            evicted = self._collect_evictions(force=True)
+        self._evict(evicted)
+        return len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "loaded": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+            if self._size_of:
+                stats["memory_bytes"] = sum(self._size_of(e.value) for e in self._entries.values())
+            return stats
+
+    # ------------------------------------------------------------------ #
+    #                     Internals (called with self._lock held)
+    # ------------------------------------------------------------------ #
+    def _touch(self, key: Hashable) -> Optional[_Entry[T]]:
+        entry = self._entries.get(key)
+        if entry:
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return entry
+
+    def _collect_evictions(self, force: bool) -> list[tuple[Hashable, T]]:
+        now = time.monotonic()
+        if not force and now - self._last_sweep < self._sweep_interval:
+            return []
+        self._last_sweep = now
+        evicted: list[tuple[Hashable, T]] = []
+
+        if self.idle_ttl:
+            for key, entry in list(self._entries.items()):
+                # OrderedDict is in LRU order: stop at the first fresh entry
+                if now - entry.last_used < self.idle_ttl:
+                    break
+                evicted.append((key, self._entries.pop(key).value))
+
+        def over_budget() -> bool:
+            if self.max_items and len(self._entries) > self.max_items:
+                return True
+            if self.max_memory_bytes and self._size_of:
+                used = sum(self._size_of(e.value) for e in self._entries.values())
+                return used > self.max_memory_bytes
+            return False
+
+        # Always keep the most recently used entry, even if it alone is over budget
+        while len(self._entries) > 1 and over_budget():
+            key, entry = self._entries.popitem(last=False)
+            evicted.append((key, entry.value))
+
+        # Loaded keys have no key lock (it is dropped after loading): hold a
+        # new one until the entry is unloaded
+        for key, _ in evicted:
+            lock = threading.Lock()
+            lock.acquire()
+            self._key_locks[key] = lock
+
+        self.evictions += len(evicted)
+        return evicted
+
+    def _evict(self, evicted: list[tuple[Hashable, T]]) -> None:
+        for key, value in evicted:
+            try:
+                if self._on_evict:
+                    self._on_evict(key, value)
+            except Exception as e:
+                print(f"[registry] Failed to unload {key}: {e}")
+            finally:
+                # Left in _key_locks: a waiter may already hold a reference,
+                # and a later caller must queue on the same lock. The next
+                # load of the key removes it.
+                self._key_locks[key].release()
@@ -1,21 +1,86 @@
 # rag_manager.py
 from __future__ import annotations
 
+import asyncio
+import os
 import shutil
+import threading
+import uuid
+from collections import Counter
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
+
+import faiss
+import numpy as np
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
-from config.config import FAISS_SUFFIX, OFFSET_SUFFIX, OPENAI_API_KEY
+from config.config import (
+    FAISS_SUFFIX, OFFSET_SUFFIX, SUMMARY_SUFFIX, LEXICAL_SUFFIX, OPENAI_API_KEY,
+    EMBEDDINGS_CACHE_PATH, EMBEDDINGS_CACHE_MAX_ITEMS, EMBEDDINGS_BATCH_WINDOW_MS,
+    EMBEDDINGS_MAX_BATCH_SIZE,
+    FAISS_COMPACT_AFTER_SEGMENTS, RAG_CHUNK_SIZE,
+    RAG_MAX_LOADED_MANAGERS, RAG_MAX_MEMORY_MB, RAG_MANAGER_IDLE_TTL,
+    EMBEDDINGS_BACKEND, EMBEDDINGS_MODEL, EMBEDDINGS_DIMENSIONS,
+    EMBEDDINGS_LOCAL_MODEL, EMBEDDINGS_LOCAL_THREADS, EMBEDDINGS_HASHING_DIMENSIONS,
+    RAG_VECTOR_STORAGE, RAG_ANN_THRESHOLD, RAG_ANN_TYPE, RAG_MIN_RECALL,
+    RAG_HIERARCHICAL, RAG_SUMMARY_TURNS, RAG_SUMMARY_TOP_K,
+    RAG_HYBRID_RETRIEVAL, RAG_LEXICAL_MIN_CONFIDENCE, RAG_MIN_SIMILARITY, RAG_CONTEXT_MAX_TOKENS,
+    RAG_MMR_FETCH_FACTOR, RAG_MMR_LAMBDA, RAG_RECENCY_WEIGHT, RAG_RECENCY_HALF_LIFE_HOURS,
+    RAG_INDEX_MMAP, RAG_STORAGE_MODE, RAG_SHARED_INDEX_DIR, RAG_SHARED_INDEX_SHARDS, RAG_SHARED_JOURNAL_MAX_MB,
+)
+from services.context_postprocess import postprocess_context
+from services.embedding_service import EmbeddingCache, EmbeddingService
+from services.faiss_segments import SegmentedIndexDir
+from services.mmap_index import LayeredIndex, LazyTextDocstore
+from services.indexing_service import IndexingQueue
+from services.lexical_index import LexicalIndex
+from services.local_embeddings import HashingEmbeddings, LocalOnnxEmbeddings
+from services.rag_registry import ManagerRegistry
+from services.rerank import mmr_rerank
+from services.shared_index import ChatScopedVectorStore, SharedIndexShard, get_shared_shard
+from services.summary_layer import PendingBlock, SummaryLayer, SummaryNode
+from services.summary_service import SummaryService
+from services.turn_chunker import split_turns
 from utils.utils import get_path_to_simple_history_file
 
-GLOBAL_RAG_MANAGERS_DICT: dict[str, "RAGManager"] = {}
+GLOBAL_INDEXING_QUEUE = IndexingQueue()
+_GLOBAL_EMBEDDING_SERVICE: Optional[EmbeddingService] = None
+_GLOBAL_SUMMARY_SERVICE: Optional[SummaryService] = None
+
+# How each query was served: "lexical" (no embedding call), "vector", "empty"
+_RETRIEVAL_PATHS: Counter[str] = Counter()
+_RETRIEVAL_PATHS_LOCK = threading.Lock()
+
+def _count_retrieval(path: str) -> None:
+    with _RETRIEVAL_PATHS_LOCK:
+        _RETRIEVAL_PATHS[path] += 1
+
+def retrieval_stats() -> dict[str, int]:
+    with _RETRIEVAL_PATHS_LOCK:
+        return dict(_RETRIEVAL_PATHS)
+
+# BM25 hits scoring below this share of the best hit are dropped
+_LEXICAL_MIN_RELATIVE_SCORE = 0.5
+
+def _similarity(distance: float) -> float:
+    """Cosine similarity from a FAISS squared L2 distance (embeddings are unit length)."""
+    return 1.0 - float(distance) / 2
+
+def _check_dimension(name: str, index_dimension: int, vector: list[float]) -> None:
+    """An index built by another embedding model fails with this instead of a FAISS assertion."""
+    if index_dimension and len(vector) != index_dimension:
+        raise ValueError(
+            f"[{name}] Index holds {index_dimension}-dimensional vectors, but the active "
+            f"embeddings ({EMBEDDINGS_BACKEND!r}) produce {len(vector)}; rebuild the indexes: python reindex.py"
+        )
 
 class RAGManager:
     """
@@ -29,58 +94,217 @@ class RAGManager:
         *,
         index_dir: Optional[str | Path] = None,
         offset_file: Optional[str | Path] = None,
-        chunk_size: int = 1000,
-        chunk_overlap: int = 200,
+        summary_file: Optional[str | Path] = None,
+        lexical_file: Optional[str | Path] = None,
+        chunk_size: int = 4000,
         k: int = 2,
         model_name: str = "gpt-4o-mini",
         temperature: float = 0.0,
-        embeddings: Optional[OpenAIEmbeddings] = None,
+        embeddings: Optional[Embeddings] = None,
+        use_mmap: bool = False,
+        summarizer: Optional[Callable[[list[str]], str]] = None,
+        summary_turns: int = 5,
+        summary_top_k: int = 2,
+        lexical_min_confidence: Optional[float] = None,
+        min_similarity: float = 0.0,
+        context_max_tokens: int = 0,
+        mmr_fetch_factor: int = 1,
+        mmr_lambda: float = 0.7,
+        recency_weight: float = 0.0,
+        recency_half_life_hours: float = 72.0,
     ):
         self.docs_path = docs_path
         self.index_dir = Path(index_dir or f"{docs_path.parent}/{docs_path.stem}{FAISS_SUFFIX}")
         self.offset_file = Path(offset_file or f"{docs_path.parent}/{docs_path.stem}{OFFSET_SUFFIX}")
+        self.summary_file = Path(summary_file or f"{docs_path.parent}/{docs_path.stem}{SUMMARY_SUFFIX}")
+        self.lexical_file = Path(lexical_file or f"{docs_path.parent}/{docs_path.stem}{LEXICAL_SUFFIX}")
 
+        # One chunk per user/master exchange; only longer exchanges are cut
+        # (at line boundaries, without overlap) into chunk_size-sized parts.
         self.chunk_size = chunk_size
-        self.chunk_overlap = chunk_overlap
         self.k = k
+        # Post-processing of results: vector hits below min_similarity are
+        # dropped, the rest is merged and capped at context_max_tokens (0 = no cap).
+        self.min_similarity = min_similarity
+        self.context_max_tokens = context_max_tokens
+        # Re-ranking: k * mmr_fetch_factor nearest chunks are re-ordered by
+        # MMR diversity and turn recency before the best k are kept (1 = off).
+        self.mmr_fetch_factor = mmr_fetch_factor
+        self.mmr_lambda = mmr_lambda
+        self.recency_weight = recency_weight
+        self.recency_half_life_hours = recency_half_life_hours
         self.model_name = model_name
         self.temperature = temperature
-
-        self.embeddings = embeddings or OpenAIEmbeddings(api_key=OPENAI_API_KEY)
-        self.splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size, chunk_overlap=chunk_overlap
-        )
-
-        self.vectorstore = self._load_or_create_index()
-        self.retriever = self.vectorstore.as_retriever(search_kwargs={"k": k})
-        self.rag_chain = self._get_context_docs()
+        self.use_mmap = use_mmap
+        # Hierarchical retrieval: with a summarizer, every summary_turns turns
+        # get a summary node; queries search summaries first, then only the
+        # chunks of the summary_top_k best blocks.
+        self.summarizer = summarizer
+        self.summary_turns = summary_turns
+        self.summary_top_k = summary_top_k
+        self.summary_layer = SummaryLayer(self.summary_file)
+        self._turn_positions: Optional[dict[int, list[int]]] = None
+        # One summarization at a time; _epoch changes when the files are deleted
+        self._summary_lock = threading.Lock()
+        self._epoch = 0
+
+        self.embeddings = embeddings or create_base_embeddings()[0]
+        # Indexing runs on the background worker while searches run in
+        # request threads; FAISS does not allow add and search at once.
+        self._lock = threading.RLock()
+        self.segments: Optional[SegmentedIndexDir] = self._open_segments()
+        self._last_segment = 0
+
+        # No index (and no embedding call) until the first real chunk arrives;
+        # the retriever and chain are only built if someone asks for them.
+        self.vectorstore: Optional[FAISS] = self._load_index()
+        self._retriever = None
+        self._rag_chain = None
+
+        # Hybrid retrieval: a BM25 index over the same chunks answers the
+        # query without an embedding call when its best hit covers at least
+        # lexical_min_confidence of the query terms (None disables it).
+        self.lexical_min_confidence = lexical_min_confidence
+        self.lexical = LexicalIndex(self.lexical_file, self.docs_path)
+        self._sync_lexical(self._get_offset())
+
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            if self.vectorstore is None:
+                raise RuntimeError(f"[{self.docs_path.name}] Index is empty")
+            self._retriever = self.vectorstore.as_retriever(search_kwargs={"k": self.k})
+        return self._retriever
+
+    @property
+    def rag_chain(self):
+        if self._rag_chain is None:
+            self._rag_chain = self._get_context_docs()
+        return self._rag_chain
+
+    def is_empty(self) -> bool:
+        return self.vectorstore is None
+
+    def index_dimension(self) -> int:
+        """Dimension of the stored vectors, 0 while the index is empty."""
+        return self.vectorstore.index.d if self.vectorstore is not None else 0
 
     # ------------------------------------------------------------------ #
     #                     FAISS index handling
     # ------------------------------------------------------------------ #
-    def _load_or_create_index(self) -> FAISS:
-        if self.index_dir.exists():
-            print(f"[{self.docs_path.name}] Loading index from {self.index_dir}")
-            return FAISS.load_local(
-                str(self.index_dir),
+    def _open_segments(self) -> Optional[SegmentedIndexDir]:
+        return SegmentedIndexDir(
+            self.index_dir,
+            storage=RAG_VECTOR_STORAGE,
+            ann_threshold=RAG_ANN_THRESHOLD,
+            ann_type=RAG_ANN_TYPE,
+            min_recall=RAG_MIN_RECALL,
+        )
+
+    def _load_index(self) -> Optional[FAISS]:
+        generation, base_dir = self.segments.latest_base()
+        vs: Optional[FAISS] = None
+        if base_dir is not None:
+            print(f"[{self.docs_path.name}] Loading index from {base_dir}")
+            vs = self.segments.load_base(
+                base_dir, self.embeddings, self.docs_path, use_mmap=self.use_mmap
+            )
+
+        # Replay delta segments written after the base
+        self._last_segment = generation
+        for number, path in self.segments.deltas_after(generation):
+            delta = self.segments.read_delta(path)
+            vs = self._add_embeddings(
+                vs, delta["texts"], delta["embeddings"], delta["metadatas"], delta["ids"]
+            )
+            self._last_segment = number
+        return vs
+
+    def _add_embeddings(
+        self,
+        vs: Optional[FAISS],
+        texts: list[str],
+        embeddings: list[list[float]],
+        metadatas: list[dict],
+        ids: list[str],
+    ) -> FAISS:
+        if vs is None:
+            # Texts of turn chunks stay in the history file, only offsets are kept
+            vs = FAISS(
                 self.embeddings,
-                allow_dangerous_deserialization=True,
+                faiss.IndexFlatL2(len(embeddings[0])),
+                LazyTextDocstore(self.docs_path),
+                {},
             )
-        print(f"[{self.docs_path.name}] Creating empty index")
-        vs = FAISS.from_texts([""], self.embeddings)
-        self._save_offset(0)
+        _check_dimension(self.docs_path.name, vs.index.d, embeddings[0])
+        vs.add_embeddings(zip(texts, embeddings), metadatas=metadatas, ids=ids)
         return vs
 
+    def _append_segment(self, chunks: list[str], metadatas: Optional[list[dict]] = None) -> None:
+        """Add chunks to the in-memory index and persist only them as a new delta."""
+        metadatas = metadatas or [{} for _ in chunks]
+        embeddings = self.embeddings.embed_documents(chunks)
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        start = len(self.vectorstore.index_to_docstore_id) if self.vectorstore is not None else 0
+        self.vectorstore = self._add_embeddings(self.vectorstore, chunks, embeddings, metadatas, ids)
+        self._retriever = self._rag_chain = None
+        if self._turn_positions is not None:
+            for position, metadata in enumerate(metadatas, start):
+                if "turn" in metadata:
+                    self._turn_positions.setdefault(metadata["turn"], []).append(position)
+        self._last_segment = self.segments.next_delta_number(self._last_segment)
+        self.segments.write_delta(self._last_segment, ids, chunks, metadatas, embeddings)
+
+    def estimated_memory_bytes(self) -> int:
+        """Rough resident size: float32 vectors plus chunk texts."""
+        if self.vectorstore is None:
+            return 0
+        index = self.vectorstore.index
+        if isinstance(index, LayeredIndex):
+            # The memory-mapped base is owned by the page cache
+            index = index.delta
+        return index.ntotal * (index.d * 4 + self.chunk_size * 2)
+
+    def flush(self) -> None:
+        """
+        Wait for in-flight indexing before the manager is unloaded.
+        Deltas and offsets are written by every update, so nothing else is kept
+        only in memory.
+        """
+        with self._lock:
+            print(f"[{self.docs_path.name}] Unloading index")
+
+    def pending_segments(self) -> int:
+        generation, _ = self.segments.latest_base()
+        return len(self.segments.deltas_after(generation))
+
+    def compact(self) -> None:
+        """Fold every delta segment into a new base snapshot."""
+        with self._lock:
+            generation, _ = self.segments.latest_base()
+            if self.vectorstore is None or not self.segments.deltas_after(generation):
+                return
+            print(f"[{self.docs_path.name}] Compacting index up to segment {self._last_segment}")
+            generation = self._last_segment
+            self.segments.write_base(self.vectorstore, generation)
+        self.segments.remove_folded(generation)
+
     # ------------------------------------------------------------------ #
     #                     Offset handling
     # ------------------------------------------------------------------ #
-    def _get_offset(self) -> int:
+    # Offset file: "<byte offset> <turns indexed>"; old files hold only the offset.
+    def _get_offset_state(self) -> tuple[int, int]:
         if self.offset_file.exists():
-            return int(self.offset_file.read_text().strip())
-        return 0
+            parts = self.offset_file.read_text().split()
+            if parts:
+                return int(parts[0]), int(parts[1]) if len(parts) > 1 else 0
+        return 0, 0
 
-    def _save_offset(self, offset: int) -> None:
-        self.offset_file.write_text(str(offset))
+    def _get_offset(self) -> int:
+        return self._get_offset_state()[0]
+
+    def _save_offset(self, offset: int, turns: int = 0) -> None:
+        self.offset_file.write_text(f"{offset} {turns}")
 
     # ------------------------------------------------------------------ #
     #                     RAG chain
@@ -108,44 +332,304 @@ class RAGManager:
     # ------------------------------------------------------------------ #
     def update_index(self) -> None:
         """Read only the *new* part of the file and add it to FAISS."""
+        with self._lock:
+            chunks = self._update_index()
+        # Summaries take an LLM call: searches must not wait for it
+        if chunks and self.summarizer:
+            self._summarize(chunks)
+
+    def _update_index(self) -> list:
         if not self.docs_path.exists():
             print(f"[{self.docs_path.name}] File not found")
-            return
+            return []
 
-        offset = self._get_offset()
+        offset, turns = self._get_offset_state()
         file_size = self.docs_path.stat().st_size
 
         if offset >= file_size:
             print(f"[{self.docs_path.name}] No new data")
-            return
+            return []
 
         print(f"[{self.docs_path.name}] Processing {offset} → {file_size}")
-        with open(self.docs_path, "r", encoding="utf-8") as f:
+        # Binary read: offsets are exact byte positions, not text-mode cookies
+        with open(self.docs_path, "rb") as f:
             f.seek(offset)
-            new_text = f.read()
-            new_pos = f.tell()
+            data = f.read(file_size - offset)
 
-        if not new_text.strip():
-            print(f"[{self.docs_path.name}] New part is empty")
-            self._save_offset(new_pos)
-            return
+        chunks, consumed = split_turns(data, offset, turns, self.chunk_size)
+        if not consumed:
+            print(f"[{self.docs_path.name}] No complete turns yet")
+            return []
 
-        chunks = [c for c in self.splitter.split_text(new_text) if c.strip()]
         if chunks:
             print(f"[{self.docs_path.name}] Adding {len(chunks)} new chunks")
-            self.vectorstore.add_texts(chunks)
-            self.vectorstore.save_local(str(self.index_dir))
+            self._append_segment([c.text for c in chunks], [c.metadata() for c in chunks])
+            turns = chunks[-1].turn
         else:
             print(f"[{self.docs_path.name}] No useful chunks")
 
-        self._save_offset(new_pos)
+        self._save_offset(offset + consumed, turns)
+        if self.lexical.offset == offset:
+            self.lexical.add(chunks, offset + consumed, turns)
+        else:
+            self._sync_lexical(offset + consumed)
+        return chunks
+
+    # ------------------------------------------------------------------ #
+    #                     Lexical (BM25) retrieval
+    # ------------------------------------------------------------------ #
+    def _sync_lexical(self, offset: int) -> None:
+        """Bring the BM25 index up to ``offset`` of the history file (local, no API calls)."""
+        start = self.lexical.offset
+        if start >= offset or not self.docs_path.exists():
+            return
+        with open(self.docs_path, "rb") as f:
+            f.seek(start)
+            data = f.read(offset - start)
+        chunks, _ = split_turns(data, start, self.lexical.turns, self.chunk_size, final=True)
+        self.lexical.add(chunks, offset, chunks[-1].turn if chunks else self.lexical.turns)
+        print(f"[{self.docs_path.name}] Lexical index caught up with {len(chunks)} chunks")
+
+    def _lexical_search(self, question: str) -> tuple[list[Document], bool]:
+        """BM25 hits and whether they are good enough to skip the vector search."""
+        if self.lexical_min_confidence is None:
+            return [], False
+        hits, confidence = self.lexical.search(question, self.k)
+        docs = [doc for doc, score in hits if score >= hits[0][1] * _LEXICAL_MIN_RELATIVE_SCORE]
+        return docs, bool(docs) and confidence >= self.lexical_min_confidence
+
+    def _fuse(self, vector_docs: list[Document], lexical_docs: list[Document]) -> list[Document]:
+        """
+        Reciprocal rank fusion of the vector and BM25 rankings. Summary nodes
+        stay in front; chunks are matched by their byte range in the history.
+        """
+        if not lexical_docs:
+            return vector_docs
+        pinned = [d for d in vector_docs if d.metadata.get("node") == "summary"]
+        scores: dict = {}
+        docs: dict = {}
+        for ranking in ([d for d in vector_docs if d not in pinned], lexical_docs):
+            for rank, doc in enumerate(ranking):
+                key = (doc.metadata.get("byte_start"), doc.metadata.get("byte_end"), doc.page_content)
+                if key[0] is not None:
+                    key = key[:2]
+                scores[key] = scores.get(key, 0.0) + 1 / (60 + rank)
+                docs.setdefault(key, doc)
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return pinned + [docs[key] for key in best]
+
+    # ------------------------------------------------------------------ #
+    #                     Hierarchical retrieval
+    # ------------------------------------------------------------------ #
+    def _summarize(self, chunks: list) -> None:
+        """
+        Add one summary node per block of ``summary_turns`` new turns. Blocks
+        that failed earlier are retried first; a block that fails now is
+        recorded as pending together with the blocks after it.
+        """
+        with self._summary_lock:
+            epoch = self._epoch
+            by_turn: dict[int, list[tuple[int, int, int]]] = {}
+            for chunk in chunks:
+                if chunk.turn > self.summary_layer.last_turn:
+                    by_turn.setdefault(chunk.turn, []).append((chunk.turn, chunk.byte_start, chunk.byte_end))
+            turns = sorted(by_turn)
+            blocks = list(self.summary_layer.pending) + [
+                PendingBlock([c for t in turns[i:i + self.summary_turns] for c in by_turn[t]])
+                for i in range(0, len(turns), self.summary_turns)
+            ]
+            for i, block in enumerate(blocks):
+                span = f"{block.turn_start}-{block.turn_end}"
+                try:
+                    summary = self.summarizer(self._read_turns(block))
+                    embedding = self.embeddings.embed_query(summary)
+                except Exception as e:
+                    # Unsummarized turns stay reachable through the flat search
+                    print(f"[{self.docs_path.name}] Failed to summarize turns {span}, will retry: {e}")
+                    with self._lock:
+                        if self._epoch == epoch:
+                            for rest in blocks[i:]:
+                                self.summary_layer.defer(rest)
+                    return
+                with self._lock:
+                    # The history may have been cleared while the summarizer ran
+                    if self._epoch != epoch:
+                        return
+                    self.summary_layer.add(SummaryNode(summary, block.turn_start, block.turn_end), embedding)
+                print(f"[{self.docs_path.name}] Summarized turns {span}")
+
+    def _read_turns(self, block: PendingBlock) -> list[str]:
+        """Text of each turn of ``block``, read back from the history file by byte range."""
+        texts: dict[int, list[str]] = {}
+        with open(self.docs_path, "rb") as f:
+            for turn, start, end in block.chunks:
+                f.seek(start)
+                text = f.read(end - start).decode("utf-8", errors="replace").strip()
+                texts.setdefault(turn, []).append(text)
+        return ["\n".join(parts) for parts in texts.values()]
+
+    def _build_turn_positions(self) -> dict[int, list[int]]:
+        positions: dict[int, list[int]] = {}
+        docstore = self.vectorstore.docstore
+        if not isinstance(docstore, LazyTextDocstore):
+            return positions
+        for position, _id in self.vectorstore.index_to_docstore_id.items():
+            turn = docstore.metadata(_id).get("turn")
+            if turn is not None:
+                positions.setdefault(turn, []).append(position)
+        return positions
+
+    def _hierarchical_candidates(
+        self, embedding: list[float], fetch_k: int
+    ) -> Optional[tuple[list[tuple[Document, float]], list[tuple[int, float]]]]:
+        """
+        Stage 1: best summary nodes. Stage 2: exact scan over the chunks of
+        their turns (plus turns not summarized yet) only. Returns the best
+        summary as a document and the ``fetch_k`` nearest chunk positions,
+        all with squared L2 distances, or None when there is nothing to
+        narrow down to; the caller then falls back to flat search.
+        """
+        if not self.summarizer or not len(self.summary_layer):
+            return None
+        nodes = self.summary_layer.search(embedding, self.summary_top_k)
+        if self._turn_positions is None:
+            self._turn_positions = self._build_turn_positions()
+
+        turns: set[int] = set()
+        for node, _ in nodes:
+            turns.update(range(node.turn_start, node.turn_end + 1))
+        turns.update(t for t in self._turn_positions if t > self.summary_layer.last_turn)
+        turns.update(self.summary_layer.pending_turns())
+        positions = [p for t in sorted(turns) for p in self._turn_positions.get(t, ())]
+        if not positions:
+            return None
+
+        index = self.vectorstore.index
+        vectors = np.vstack([index.reconstruct(p) for p in positions])
+        distances = ((vectors - np.asarray(embedding, dtype="float32")) ** 2).sum(axis=1)
+
+        best_node, best_distance = nodes[0]
+        pinned = [(Document(
+            page_content=best_node.text,
+            metadata={"node": "summary", "turn_start": best_node.turn_start, "turn_end": best_node.turn_end},
+        ), best_distance)]
+        candidates = [(positions[i], float(distances[i])) for i in np.argsort(distances)[:fetch_k]]
+        return pinned, candidates
+
+    # ------------------------------------------------------------------ #
+    #                     Vector search and re-ranking
+    # ------------------------------------------------------------------ #
+    def _scored_search(self, embedding: list[float]) -> list[tuple[Document, float]]:
+        """
+        Best chunks with squared L2 distances: candidates from the
+        hierarchical or flat search, re-ranked by MMR and recency.
+        """
+        fetch_k = self.k * max(self.mmr_fetch_factor, 1)
+        hierarchical = self._hierarchical_candidates(embedding, fetch_k)
+        if hierarchical is None:
+            pinned, candidates = [], self._flat_candidates(embedding, fetch_k)
+        else:
+            pinned, candidates = hierarchical
+        if len(candidates) > self.k:
+            candidates = self._rerank(embedding, candidates)
+
+        results = list(pinned)
+        for position, distance in candidates[:self.k]:
+            doc = self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+            if isinstance(doc, Document):
+                results.append((doc, distance))
+        return results
+
+    def _flat_candidates(self, embedding: list[float], fetch_k: int) -> list[tuple[int, float]]:
+        distances, positions = self.vectorstore.index.search(
+            np.asarray([embedding], dtype="float32"), fetch_k
+        )
+        return [(int(p), float(d)) for p, d in zip(positions[0], distances[0]) if p != -1]
+
+    def _rerank(self, embedding: list[float], candidates: list[tuple[int, float]]) -> list[tuple[int, float]]:
+        index = self.vectorstore.index
+        vectors = np.vstack([index.reconstruct(position) for position, _ in candidates])
+        timestamps = [self._timestamp(position) for position, _ in candidates]
+        order = mmr_rerank(
+            np.asarray(embedding, dtype="float32"),
+            vectors,
+            timestamps,
+            self.k,
+            lambda_mult=self.mmr_lambda,
+            recency_weight=self.recency_weight,
+            half_life_hours=self.recency_half_life_hours,
+        )
+        return [candidates[i] for i in order]
+
+    def _timestamp(self, position: int) -> Optional[float]:
+        docstore = self.vectorstore.docstore
+        if not isinstance(docstore, LazyTextDocstore):
+            return None
+        value = docstore.metadata(self.vectorstore.index_to_docstore_id[position]).get("timestamp")
+        try:
+            return datetime.fromisoformat(value).timestamp() if value else None
+        except ValueError:
+            return None
 
     def query(self, question: str) -> dict:
         """Run RAG and return context + answer."""
-        return self.rag_chain.invoke(question)
+        with self._lock:
+            if self.is_empty():
+                _count_retrieval("empty")
+                return {"context": [], "user_message": question}
+            lexical_docs, confident = self._lexical_search(question)
+            if confident:
+                _count_retrieval("lexical")
+                return {"context": self._postprocess(lexical_docs), "user_message": question}
+            _count_retrieval("vector")
+            docs = self._search_by_vector(self.embeddings.embed_query(question))
+            return {"context": self._postprocess(self._fuse(docs, lexical_docs)), "user_message": question}
+
+    async def aquery(self, question: str) -> dict:
+        """
+        Async variant of ``query``: the question is embedded with the async
+        embeddings client and the BM25 and FAISS searches run in worker
+        threads, so the event loop is never blocked by retrieval.
+        """
+        if self.is_empty():
+            _count_retrieval("empty")
+            return {"context": [], "user_message": question}
+        lexical_docs, confident = await asyncio.to_thread(self._lexical_search, question)
+        if confident:
+            _count_retrieval("lexical")
+            context = await asyncio.to_thread(self._postprocess, lexical_docs)
+            return {"context": context, "user_message": question}
+        _count_retrieval("vector")
+        embedding = await self.embeddings.aembed_query(question)
+        docs = await asyncio.to_thread(self._search_by_vector, embedding)
+        context = await asyncio.to_thread(self._postprocess, self._fuse(docs, lexical_docs))
+        return {"context": context, "user_message": question}
+
+    def _search_by_vector(self, embedding: list[float]) -> list[Document]:
+        """Nearest chunks, best first, without those below ``min_similarity``."""
+        with self._lock:
+            if self.is_empty():
+                return []
+            _check_dimension(self.docs_path.name, self.index_dimension(), embedding)
+            scored = self._scored_search(embedding)
+        # Indexes created before lazy construction hold a junk "" vector
+        return [
+            doc for doc, distance in scored
+            if doc.page_content.strip() and _similarity(distance) >= self.min_similarity
+        ]
+
+    def _postprocess(self, docs: list[Document]) -> list[Document]:
+        return postprocess_context(docs, self.context_max_tokens, self.model_name)
 
     def delete_files(self) -> None:
         """Delete crated files"""
+        with self._lock:
+            self._epoch += 1
+            self._delete_files()
+
+    def _delete_files(self) -> None:
+        self.summary_layer.delete()
+        self.lexical.delete()
         for path in [self.offset_file, self.index_dir, self.docs_path]:
             if path.exists():
                 if path.is_file():
@@ -164,9 +648,122 @@ class RAGManager:
         print(result["answer"])
 
 
+class SharedIndexRAGManager(RAGManager):
+    """
+    RAGManager for ``RAG_STORAGE_MODE=shared``: the chat's vectors live in one
+    of a few shared FAISS shards, tagged with the history file stem, instead
+    of a private ``<stem>_faiss`` directory. Offsets stay per chat.
+
+    Shards keep no per-chat positions, so there is no summary layer to
+    narrow a search with: the summarizer is always off in this mode.
+    """
+
+    def __init__(self, docs_path: Path, **kwargs) -> None:
+        kwargs["summarizer"] = None
+        super().__init__(docs_path, **kwargs)
+
+    def _open_segments(self) -> None:
+        return None
+
+    def _load_index(self) -> ChatScopedVectorStore:
+        tenant = self.docs_path.stem
+        return ChatScopedVectorStore(
+            _shared_shard(tenant), tenant, self.embeddings, history_path=self.docs_path
+        )
+
+    def is_empty(self) -> bool:
+        return self.vectorstore.shard.count(self.vectorstore.tenant) == 0
+
+    def index_dimension(self) -> int:
+        return self.vectorstore.shard.dimension
+
+    def _append_segment(self, chunks: list[str], metadatas: Optional[list[dict]] = None) -> None:
+        embeddings = self.embeddings.embed_documents(chunks)
+        _check_dimension(self.docs_path.name, self.index_dimension(), embeddings[0])
+        self.vectorstore.add_embeddings(zip(chunks, embeddings), metadatas=metadatas)
+
+    def estimated_memory_bytes(self) -> int:
+        # Turn texts are read back from the history file, only vectors stay resident
+        shard = self.vectorstore.shard
+        return shard.count(self.vectorstore.tenant) * shard.dimension * 4
+
+    def pending_segments(self) -> int:
+        # Shards compact their own journal
+        return 0
+
+    def compact(self) -> None:
+        pass
+
+    def _scored_search(self, embedding: list[float]) -> list[tuple[Document, float]]:
+        # Shards keep no per-chat positions: no hierarchical narrowing or re-ranking
+        return self.vectorstore.similarity_search_with_score_by_vector(embedding, k=self.k)
+
+    def _delete_files(self) -> None:
+        self.vectorstore.delete()
+        self.summary_layer.delete()
+        self.lexical.delete()
+        for path in [self.offset_file, self.docs_path]:
+            if path.exists():
+                path.unlink()
+
+
+def _shared_shard(tenant: str) -> SharedIndexShard:
+    return get_shared_shard(
+        tenant,
+        root=RAG_SHARED_INDEX_DIR,
+        shards=RAG_SHARED_INDEX_SHARDS,
+        journal_max_bytes=RAG_SHARED_JOURNAL_MAX_MB * 1024 * 1024,
+    )
+
+
 # ---------------------------------------------------------------------- #
 #   Factory – create a manager for *every* file you need
 # ---------------------------------------------------------------------- #
+def create_base_embeddings() -> tuple[Embeddings, str]:
+    """The configured (EMBEDDINGS_BACKEND) embedding model and the cache namespace of its vectors."""
+    if EMBEDDINGS_BACKEND == "local":
+        embeddings = LocalOnnxEmbeddings(
+            EMBEDDINGS_LOCAL_MODEL,
+            batch_size=min(EMBEDDINGS_MAX_BATCH_SIZE, 64),
+            threads=EMBEDDINGS_LOCAL_THREADS,
+        )
+        return embeddings, f"local:{EMBEDDINGS_LOCAL_MODEL}"
+    if EMBEDDINGS_BACKEND == "hashing":
+        return HashingEmbeddings(EMBEDDINGS_HASHING_DIMENSIONS), f"hashing:{EMBEDDINGS_HASHING_DIMENSIONS}"
+    if EMBEDDINGS_BACKEND != "openai":
+        raise ValueError(f"Unknown EMBEDDINGS_BACKEND: {EMBEDDINGS_BACKEND!r}")
+
+    embeddings = OpenAIEmbeddings(
+        api_key=OPENAI_API_KEY,
+        model=EMBEDDINGS_MODEL,
+        dimensions=EMBEDDINGS_DIMENSIONS or None,
+    )
+    namespace = EMBEDDINGS_MODEL
+    if EMBEDDINGS_DIMENSIONS:
+        namespace += f":{EMBEDDINGS_DIMENSIONS}"
+    return embeddings, namespace
+
+def get_embedding_service() -> EmbeddingService:
+    """Shared, batching and caching embeddings used by every manager."""
+    global _GLOBAL_EMBEDDING_SERVICE
+    if _GLOBAL_EMBEDDING_SERVICE is None:
+        embeddings, namespace = create_base_embeddings()
+        _GLOBAL_EMBEDDING_SERVICE = EmbeddingService(
+            embeddings,
+            namespace=namespace,
+            cache=EmbeddingCache(EMBEDDINGS_CACHE_PATH, max_items=EMBEDDINGS_CACHE_MAX_ITEMS),
+            # Collecting a batch only pays off for network round-trips
+            batch_window=EMBEDDINGS_BATCH_WINDOW_MS / 1000 if EMBEDDINGS_BACKEND == "openai" else 0,
+            max_batch_size=EMBEDDINGS_MAX_BATCH_SIZE,
+        )
+    return _GLOBAL_EMBEDDING_SERVICE
+
+def get_summary_service() -> SummaryService:
+    global _GLOBAL_SUMMARY_SERVICE
+    if _GLOBAL_SUMMARY_SERVICE is None:
+        _GLOBAL_SUMMARY_SERVICE = SummaryService()
+    return _GLOBAL_SUMMARY_SERVICE
+
 def _build_manager(
     docs_path: str | Path,
 ) -> RAGManager:
@@ -175,20 +772,65 @@ def _build_manager(
     All managers share the same **common_kwargs** (chunk size, k, model …)
     """
     path = Path(docs_path)
-    manager = RAGManager(docs_path=path)
-    manager.update_index()
+    manager_cls = SharedIndexRAGManager if RAG_STORAGE_MODE == "shared" else RAGManager
+    manager = manager_cls(
+        docs_path=path,
+        chunk_size=RAG_CHUNK_SIZE,
+        embeddings=get_embedding_service(),
+        use_mmap=RAG_INDEX_MMAP,
+        summarizer=get_summary_service().summarize_turns if RAG_HIERARCHICAL else None,
+        summary_turns=RAG_SUMMARY_TURNS,
+        summary_top_k=RAG_SUMMARY_TOP_K,
+        lexical_min_confidence=RAG_LEXICAL_MIN_CONFIDENCE if RAG_HYBRID_RETRIEVAL else None,
+        min_similarity=RAG_MIN_SIMILARITY,
+        context_max_tokens=RAG_CONTEXT_MAX_TOKENS,
+        mmr_fetch_factor=RAG_MMR_FETCH_FACTOR,
+        mmr_lambda=RAG_MMR_LAMBDA,
+        recency_weight=RAG_RECENCY_WEIGHT,
+        recency_half_life_hours=RAG_RECENCY_HALF_LIFE_HOURS,
+    )
+    schedule_index_update(docs_path)
     return manager
 
+def _registry_key(docs_path: str | Path) -> Path:
+    """One key per file, whether it came in as ``str``, relative or absolute ``Path``."""
+    return Path(os.path.abspath(docs_path))
+
+GLOBAL_RAG_REGISTRY: ManagerRegistry[RAGManager] = ManagerRegistry(
+    _build_manager,
+    max_items=RAG_MAX_LOADED_MANAGERS,
+    max_memory_bytes=RAG_MAX_MEMORY_MB * 1024 * 1024,
+    idle_ttl=RAG_MANAGER_IDLE_TTL,
+    size_of=lambda manager: manager.estimated_memory_bytes(),
+    on_evict=lambda _key, manager: manager.flush(),
+)
+
 def get_or_create_rag_manager(
     docs_path: str | Path,
 ) -> RAGManager:
-    manager = GLOBAL_RAG_MANAGERS_DICT.get(docs_path, None)
+    return GLOBAL_RAG_REGISTRY.get_or_create(_registry_key(docs_path))
 
-    if manager is None:
-        manager = _build_manager(docs_path)
-        GLOBAL_RAG_MANAGERS_DICT[docs_path] = manager
+def schedule_index_update(
+    docs_path: str | Path,
+) -> bool:
+    """
+    Queue an incremental ``update_index`` for the file on the background worker.
+    The caller never waits; duplicate requests for the same file are merged.
+    """
+    key = _registry_key(docs_path)
+    return GLOBAL_INDEXING_QUEUE.enqueue(key, lambda: _index_job(key))
 
-    return manager
+def _index_job(key: Path) -> None:
+    manager = get_or_create_rag_manager(key)
+    manager.update_index()
+    if manager.pending_segments() >= FAISS_COMPACT_AFTER_SEGMENTS:
+        GLOBAL_INDEXING_QUEUE.enqueue(("compact", key), lambda: _compact_job(key))
+
+def _compact_job(key: Path) -> None:
+    # Only compact a loaded manager: an unloaded one is already consistent on disk
+    manager = GLOBAL_RAG_REGISTRY.peek(key)
+    if manager is not None:
+        manager.compact()
 
 def get_context(
     chat_id: int,
@@ -200,21 +842,49 @@ def get_context(
     context: list[str] = [c.page_content for c in response["context"]]
     return context
 
+async def aget_context(
+    chat_id: int,
+    user_message: str,
+) -> list[str]:
+    """Async ``get_context``: index loading and search run off the event loop."""
+    docs_path: str|Path = get_path_to_simple_history_file(chat_id)
+    manager = GLOBAL_RAG_REGISTRY.get(_registry_key(docs_path))
+    if manager is None:
+        manager = await asyncio.to_thread(get_or_create_rag_manager, docs_path)
+    response: dict = await manager.aquery(user_message)
+    context: list[str] = [c.page_content for c in response["context"]]
+    return context
+
 def delete_manager_and_clear_history(
     docs_path: str | Path,
 ) -> None:
-    manager = GLOBAL_RAG_MANAGERS_DICT.pop(docs_path, None)
-    if not manager:
-        manager = get_or_create_rag_manager(docs_path)
-    if manager:
+    """
+    Delete the history file and every index of the chat. A loaded manager
+    deletes its own files; otherwise they are removed directly, so clearing
+    a chat never loads its index or schedules indexing.
+    """
+    key = _registry_key(docs_path)
+    GLOBAL_INDEXING_QUEUE.discard(key)
+    GLOBAL_INDEXING_QUEUE.discard(("compact", key))
+    manager = GLOBAL_RAG_REGISTRY.pop(key)
+    if manager is not None:
         manager.delete_files()
-        GLOBAL_RAG_MANAGERS_DICT.pop(docs_path, None)
-
-
-
-
-
-
-
-
-
+    else:
+        _delete_index_files(key)
+    # An index job already running may have loaded the manager meanwhile
+    GLOBAL_RAG_REGISTRY.pop(key)
+
+def _delete_index_files(docs_path: Path) -> None:
+    """Remove the files a manager of ``docs_path`` would use, without creating one."""
+    stem = docs_path.stem
+    if RAG_STORAGE_MODE == "shared":
+        _shared_shard(stem).delete_tenant(stem)
+    paths = [docs_path] + [
+        docs_path.parent / f"{stem}{suffix}"
+        for suffix in (FAISS_SUFFIX, OFFSET_SUFFIX, SUMMARY_SUFFIX, LEXICAL_SUFFIX)
+    ]
+    for path in paths:
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink(missing_ok=True)
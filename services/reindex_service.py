@@ -0,0 +1,268 @@
+"""
+Offline rebuild of every chat's RAG index (after changing RAG_CHUNK_SIZE, the
+embedding model or the vector storage format). Run with the bot stopped:
+
+    python reindex.py [--workers N] [--tokens-per-minute N] [--restart] [chat_id ...]
+
+Each chat is rebuilt in a worker process into ``<chat dir>/.reindex/`` and
+swapped in once complete. Progress is saved after every chat, so an
+interrupted run continues where it stopped.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Optional
+
+from config.config import (
+    EMBEDDINGS_BACKEND, EMBEDDINGS_CACHE_MAX_ITEMS, EMBEDDINGS_CACHE_PATH, EMBEDDINGS_DIMENSIONS,
+    EMBEDDINGS_MAX_BATCH_SIZE,
+    EMBEDDINGS_MODEL, EMBEDDINGS_LOCAL_MODEL, EMBEDDINGS_HASHING_DIMENSIONS,
+    FAISS_SUFFIX, LEXICAL_SUFFIX, OFFSET_SUFFIX, SUMMARY_SUFFIX,
+    RAG_ANN_THRESHOLD, RAG_ANN_TYPE, RAG_CHUNK_SIZE, RAG_STORAGE_MODE, RAG_VECTOR_STORAGE,
+    REINDEX_STATE_PATH, REINDEX_TOKENS_PER_MINUTE,
+)
+from services.embedding_service import EmbeddingCache, EmbeddingService, RateLimitedEmbeddings
+from services.rag_service import RAGManager, create_base_embeddings
+from services.summary_layer import SummaryLayer
+from utils.tokens import count_tokens
+
+HISTORIES_ROOT = Path("simple_histories")
+STAGING_DIR = ".reindex"
+# Written into the staging dir once every artifact is built; lists them
+DONE_MARKER = "DONE"
+
+_WORKER_EMBEDDINGS: Optional[EmbeddingService] = None
+
+
+def find_histories(root: Path = HISTORIES_ROOT, chat_ids: Optional[list[str]] = None) -> list[Path]:
+    """``simple_histories/<chat_id>/simple_history_<chat_id>.txt`` of every (or the given) chat."""
+    if not root.exists():
+        return []
+    names = chat_ids or sorted(entry.name for entry in root.iterdir() if entry.is_dir())
+    paths = [root / name / f"simple_history_{name}.txt" for name in names]
+    return [path for path in paths if path.exists()]
+
+
+def index_fingerprint() -> dict:
+    """Settings an index depends on: a run is only resumed if they did not change."""
+    return {
+        "backend": EMBEDDINGS_BACKEND,
+        "model": {"local": EMBEDDINGS_LOCAL_MODEL, "hashing": "hashing"}.get(EMBEDDINGS_BACKEND, EMBEDDINGS_MODEL),
+        "dimensions": EMBEDDINGS_HASHING_DIMENSIONS if EMBEDDINGS_BACKEND == "hashing" else EMBEDDINGS_DIMENSIONS,
+        "chunk_size": RAG_CHUNK_SIZE,
+        "storage": RAG_VECTOR_STORAGE,
+        "ann_threshold": RAG_ANN_THRESHOLD,
+        "ann_type": RAG_ANN_TYPE,
+    }
+
+
+# ---------------------------------------------------------------------- #
+#   Worker process
+# ---------------------------------------------------------------------- #
+def _init_worker(tokens_per_minute: int) -> None:
+    """Per-process embeddings: rate limited, writing to a private cache part file."""
+    global _WORKER_EMBEDDINGS
+    embeddings, namespace = create_base_embeddings()
+    limited = RateLimitedEmbeddings(
+        embeddings,
+        tokens_per_minute,
+        batch_size=EMBEDDINGS_MAX_BATCH_SIZE,
+        count_tokens=lambda text: count_tokens(text, EMBEDDINGS_MODEL),
+    )
+    _WORKER_EMBEDDINGS = EmbeddingService(
+        limited,
+        namespace=namespace,
+        cache=EmbeddingCache(
+            f"{EMBEDDINGS_CACHE_PATH}.part{os.getpid()}",
+            read_paths=[EMBEDDINGS_CACHE_PATH],
+            max_items=EMBEDDINGS_CACHE_MAX_ITEMS,
+        ),
+        batch_window=0,
+        max_batch_size=EMBEDDINGS_MAX_BATCH_SIZE,
+        max_concurrent_batches=1,
+    )
+
+
+def _artifacts(docs_path: Path) -> list[str]:
+    """Names of a chat's index files; the offset goes last, it marks the new index as current."""
+    stem = docs_path.stem
+    return [f"{stem}{FAISS_SUFFIX}", f"{stem}{SUMMARY_SUFFIX}", f"{stem}{LEXICAL_SUFFIX}", f"{stem}{OFFSET_SUFFIX}"]
+
+
+def reindex_chat(docs_path: Path) -> int:
+    """Rebuild one chat's index into the staging dir and swap it in. Returns the chunk count."""
+    staging = docs_path.parent / STAGING_DIR
+    if (staging / DONE_MARKER).exists():
+        # Built by an interrupted run: only the swap is left
+        _swap(docs_path, staging)
+        return 0
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir()
+
+    index_name, summary_name, lexical_name, offset_name = _artifacts(docs_path)
+    manager = RAGManager(
+        docs_path,
+        index_dir=staging / index_name,
+        offset_file=staging / offset_name,
+        summary_file=staging / summary_name,
+        lexical_file=staging / lexical_name,
+        chunk_size=RAG_CHUNK_SIZE,
+        embeddings=_WORKER_EMBEDDINGS,
+    )
+    manager.update_index()
+    manager.compact()
+    chunks = len(manager.lexical)
+
+    # Summary texts are kept (no LLM calls), only their vectors are recomputed;
+    # blocks whose summary failed stay pending
+    old_summaries = SummaryLayer(docs_path.parent / summary_name)
+    if len(old_summaries):
+        vectors = _WORKER_EMBEDDINGS.embed_documents([node.text for node in old_summaries.nodes])
+        for node, vector in zip(old_summaries.nodes, vectors):
+            manager.summary_layer.add(node, vector)
+    for block in old_summaries.pending:
+        manager.summary_layer.defer(block)
+
+    built = [name for name in _artifacts(docs_path) if (staging / name).exists()]
+    (staging / DONE_MARKER).write_text(json.dumps(built))
+    _swap(docs_path, staging)
+    return chunks
+
+
+def _swap(docs_path: Path, staging: Path) -> None:
+    """
+    Move the staged artifacts over the live ones. Every step can be repeated,
+    so a run interrupted mid-swap is finished by the next one.
+    """
+    built = set(json.loads((staging / DONE_MARKER).read_text()))
+    for name in _artifacts(docs_path):
+        staged, live = staging / name, docs_path.parent / name
+        if name not in built:
+            # Not produced by the rebuild (e.g. no summaries): drop the stale one
+            _remove(live)
+            continue
+        if not staged.exists():
+            continue  # Already moved
+        if staged.is_dir():
+            old = live.with_name(live.name + ".old")
+            _remove(old)
+            if live.exists():
+                os.rename(live, old)
+            os.rename(staged, live)
+            _remove(old)
+        else:
+            os.replace(staged, live)
+    shutil.rmtree(staging)
+
+
+def _remove(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+# ---------------------------------------------------------------------- #
+#   Coordinator
+# ---------------------------------------------------------------------- #
+def _load_state(path: Path, fingerprint: dict) -> set[str]:
+    if not path.exists():
+        return set()
+    state = json.loads(path.read_text())
+    if state.get("fingerprint") != fingerprint:
+        print("[reindex] Index settings changed since the last run, starting over")
+        return set()
+    return set(state.get("done", []))
+
+
+def _save_state(path: Path, fingerprint: dict, done: set[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({"fingerprint": fingerprint, "done": sorted(done)}))
+    os.replace(tmp, path)
+
+
+def _merge_cache_parts() -> None:
+    """Fold the workers' cache part files into the main embeddings cache."""
+    parts = glob.glob(f"{EMBEDDINGS_CACHE_PATH}.part*")
+    if not parts:
+        return
+    cache = EmbeddingCache(EMBEDDINGS_CACHE_PATH)
+    for part in parts:
+        cache.put_many(EmbeddingCache(part).items())
+        os.remove(part)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def run(histories: list[Path], workers: int, tokens_per_minute: int, state_path: Path, restart: bool) -> None:
+    fingerprint = index_fingerprint()
+    done = set() if restart else _load_state(state_path, fingerprint)
+    # Parts left behind by a crashed run still hold paid-for vectors
+    _merge_cache_parts()
+
+    todo = [path for path in histories if str(path) not in done]
+    print(f"[reindex] {len(histories)} chats, {len(histories) - len(todo)} already done, {workers} workers")
+    if not todo:
+        return
+
+    started = time.monotonic()
+    finished = chunks = failed = 0
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(max(tokens_per_minute // workers, 1) if tokens_per_minute > 0 else 0,),
+    ) as pool:
+        futures = {pool.submit(reindex_chat, path): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            finished += 1
+            try:
+                chunks += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"[reindex] {path.name}: failed: {e}")
+            else:
+                done.add(str(path))
+                _save_state(state_path, fingerprint, done)
+            elapsed = time.monotonic() - started
+            left = elapsed / finished * (len(todo) - finished)
+            print(
+                f"[reindex] {finished}/{len(todo)} chats ({finished / len(todo):.0%}), "
+                f"{chunks} chunks, {_format_duration(elapsed)} elapsed, ~{_format_duration(left)} left"
+            )
+    _merge_cache_parts()
+    print(f"[reindex] Done in {_format_duration(time.monotonic() - started)}, {failed} failed")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the RAG indexes of all chats.")
+    parser.add_argument("chat_ids", nargs="*", help="only these chats (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--tokens-per-minute", type=int, default=REINDEX_TOKENS_PER_MINUTE,
+        help="embedding rate limit shared by all workers (0 = unlimited)",
+    )
+    parser.add_argument("--restart", action="store_true", help="ignore the progress of a previous run")
+    args = parser.parse_args()
+
+    if RAG_STORAGE_MODE != "per_chat":
+        parser.error("only RAG_STORAGE_MODE=per_chat indexes can be rebuilt offline")
+    run(
+        find_histories(HISTORIES_ROOT, args.chat_ids or None),
+        workers=max(args.workers, 1),
+        tokens_per_minute=args.tokens_per_minute,
+        state_path=Path(REINDEX_STATE_PATH),
+        restart=args.restart,
+    )
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import math
+from typing import Optional
+
+import numpy as np
+
+
+def mmr_rerank(
+    query: np.ndarray,
+    vectors: np.ndarray,
+    timestamps: list[Optional[float]],
+    k: int,
+    lambda_mult: float = 0.7,
+    recency_weight: float = 0.0,
+    half_life_hours: float = 72.0,
+) -> list[int]:
+    """
+    Order of the best ``k`` candidates by maximal marginal relevance.
+
+    Relevance is the cosine similarity to ``query``, scaled by a recency
+    factor ``1 - recency_weight + recency_weight * decay`` where ``decay``
+    halves every ``half_life_hours`` before the newest candidate (candidates
+    without a timestamp count as the oldest). Each pick then maximises
+    ``lambda_mult * relevance - (1 - lambda_mult) * similarity to the picks``,
+    so near-duplicates of an already chosen chunk lose to other passages.
+    """
+    n = vectors.shape[0]
+    if n == 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.maximum(norms, 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = unit @ query
+
+    if recency_weight and any(t is not None for t in timestamps):
+        known = [t for t in timestamps if t is not None]
+        newest, oldest = max(known), min(known)
+        ages = np.array([newest - (t if t is not None else oldest) for t in timestamps], dtype="float32")
+        decay = np.exp(-ages / 3600 / half_life_hours * math.log(2))
+        relevance = relevance * (1 - recency_weight + recency_weight * decay)
+
+    similarity = unit @ unit.T
+    selected: list[int] = []
+    # Highest similarity of every candidate to anything selected so far
+    redundancy = np.full(n, -np.inf, dtype="float32")
+    available = np.ones(n, dtype=bool)
+    for _ in range(min(k, n)):
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * penalty
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
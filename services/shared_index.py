@@ -0,0 +1,334 @@
+from __future__ import annotations
+
+import os
+import pickle
+import re
+import shutil
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from services.mmap_index import MappedFile
+
+_SNAPSHOT_RE = re.compile(r"^snapshot_(\d+)$")
+
+
+class SharedIndexShard:
+    """
+    One FAISS index shared by many chats ("tenants").
+
+    Every vector gets an int64 id; the tenant owning it is remembered in
+    ``_tenant_ids`` and searches pass an ``IDSelectorBatch`` so a chat only
+    ever sees its own vectors. Deleting a tenant is ``remove_ids``.
+
+    A text of ``None`` means the chunk lives in the tenant's history file at
+    its ``byte_start``/``byte_end`` metadata; ``ChatScopedVectorStore`` reads
+    it back, so such texts are neither held in memory nor persisted.
+
+    Persistence:
+        shard_dir/snapshot_<G>/index.faiss + docs.pkl   full state
+        shard_dir/journal_<G>.bin                      pickled ops after G
+    A snapshot directory is written completely before it is renamed into
+    place, and journal_<G> is only replayed on top of snapshot_<G>.
+    """
+
+    def __init__(self, shard_dir: Path, journal_max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.shard_dir = shard_dir
+        self.journal_max_bytes = journal_max_bytes
+        self._lock = threading.RLock()
+
+        self._index: Optional[faiss.IndexIDMap2] = None
+        self._docs: dict[int, tuple[str, Optional[str], dict]] = {}  # id -> (tenant, text, metadata)
+        self._tenant_ids: dict[str, set[int]] = {}
+        self._selectors: dict[str, tuple[np.ndarray, Any]] = {}
+        self._next_id = 0
+        self._generation = 0
+
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    # ------------------------------------------------------------------ #
+    #                     Public API
+    # ------------------------------------------------------------------ #
+    def add(
+        self,
+        tenant: str,
+        texts: list[Optional[str]],
+        embeddings: list[list[float]],
+        metadatas: Optional[list[dict]] = None,
+    ) -> list[int]:
+        metadatas = metadatas or [{} for _ in texts]
+        with self._lock:
+            ids = list(range(self._next_id, self._next_id + len(texts)))
+            op = {
+                "op": "add",
+                "tenant": tenant,
+                "ids": ids,
+                "texts": texts,
+                "metadatas": metadatas,
+                "embeddings": np.asarray(embeddings, dtype="float32"),
+            }
+            self._apply(op)
+            self._journal(op)
+        return ids
+
+    def search(
+        self, tenant: str, embedding: list[float], k: int
+    ) -> list[tuple[Optional[str], dict, float]]:
+        """(text, metadata, distance) of the tenant's nearest vectors."""
+        with self._lock:
+            if self._index is None or not self._tenant_ids.get(tenant):
+                return []
+            _, selector = self._selector(tenant)
+            query = np.asarray([embedding], dtype="float32")
+            params = faiss.SearchParameters(sel=selector)
+            distances, ids = self._index.search(query, k, params=params)
+            results = []
+            for distance, vector_id in zip(distances[0], ids[0]):
+                if vector_id == -1:
+                    continue
+                _, text, metadata = self._docs[int(vector_id)]
+                results.append((text, metadata, float(distance)))
+            return results
+
+    def delete_tenant(self, tenant: str) -> int:
+        with self._lock:
+            op = {"op": "delete", "tenant": tenant}
+            removed = self._apply(op)
+            if removed:
+                self._journal(op)
+            return removed
+
+    def count(self, tenant: str) -> int:
+        return len(self._tenant_ids.get(tenant, ()))
+
+    @property
+    def dimension(self) -> int:
+        return self._index.d if self._index is not None else 0
+
+    def compact(self) -> None:
+        """Write a new snapshot and start an empty journal."""
+        with self._lock:
+            generation = self._generation + 1
+            tmp_dir = self.shard_dir / f".snapshot_{generation:06d}.tmp"
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+            tmp_dir.mkdir()
+            if self._index is not None:
+                faiss.write_index(self._index, str(tmp_dir / "index.faiss"))
+            with open(tmp_dir / "docs.pkl", "wb") as f:
+                pickle.dump(
+                    {"docs": self._docs, "next_id": self._next_id},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_dir, self.shard_dir / f"snapshot_{generation:06d}")
+            old_generation, self._generation = self._generation, generation
+            shutil.rmtree(self.shard_dir / f"snapshot_{old_generation:06d}", ignore_errors=True)
+            self._journal_path(old_generation).unlink(missing_ok=True)
+            print(f"[{self.shard_dir.name}] Compacted shard to generation {generation}")
+
+    # ------------------------------------------------------------------ #
+    #                     Internals
+    # ------------------------------------------------------------------ #
+    def _apply(self, op: dict) -> int:
+        if op["op"] == "add":
+            embeddings = op["embeddings"]
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatL2(embeddings.shape[1]))
+            ids = np.asarray(op["ids"], dtype="int64")
+            self._index.add_with_ids(embeddings, ids)
+            tenant_ids = self._tenant_ids.setdefault(op["tenant"], set())
+            for vector_id, text, metadata in zip(op["ids"], op["texts"], op["metadatas"]):
+                self._docs[vector_id] = (op["tenant"], text, metadata)
+                tenant_ids.add(vector_id)
+            if op["ids"]:
+                self._next_id = max(self._next_id, op["ids"][-1] + 1)
+            self._selectors.pop(op["tenant"], None)
+            return len(op["ids"])
+
+        tenant_ids = self._tenant_ids.pop(op["tenant"], set())
+        self._selectors.pop(op["tenant"], None)
+        if tenant_ids and self._index is not None:
+            self._index.remove_ids(np.asarray(sorted(tenant_ids), dtype="int64"))
+            for vector_id in tenant_ids:
+                self._docs.pop(vector_id, None)
+        return len(tenant_ids)
+
+    def _selector(self, tenant: str) -> tuple[np.ndarray, Any]:
+        cached = self._selectors.get(tenant)
+        if cached is None:
+            ids = np.asarray(sorted(self._tenant_ids[tenant]), dtype="int64")
+            # Keep ``ids`` referenced next to the selector built from it
+            cached = (ids, faiss.IDSelectorBatch(ids))
+            self._selectors[tenant] = cached
+        return cached
+
+    def _journal_path(self, generation: int) -> Path:
+        return self.shard_dir / f"journal_{generation:06d}.bin"
+
+    def _journal(self, op: dict) -> None:
+        path = self._journal_path(self._generation)
+        with open(path, "ab") as f:
+            pickle.dump(op, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if path.stat().st_size > self.journal_max_bytes:
+            self.compact()
+
+    def _load(self) -> None:
+        snapshots = sorted(
+            (int(m.group(1)), entry)
+            for entry in os.listdir(self.shard_dir)
+            if (m := _SNAPSHOT_RE.match(entry))
+        )
+        if snapshots:
+            self._generation, name = snapshots[-1]
+            snapshot_dir = self.shard_dir / name
+            if (snapshot_dir / "index.faiss").exists():
+                self._index = faiss.read_index(str(snapshot_dir / "index.faiss"))
+            with open(snapshot_dir / "docs.pkl", "rb") as f:
+                state = pickle.load(f)
+            self._docs = state["docs"]
+            self._next_id = state["next_id"]
+            for vector_id, (tenant, _, _) in self._docs.items():
+                self._tenant_ids.setdefault(tenant, set()).add(vector_id)
+
+        journal = self._journal_path(self._generation)
+        if not journal.exists():
+            return
+        replayed = 0
+        with open(journal, "rb") as f:
+            while True:
+                try:
+                    op = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError):
+                    # Torn write at the tail (crash mid-append) – ignore it.
+                    break
+                self._apply(op)
+                replayed += 1
+        print(f"[{self.shard_dir.name}] Loaded {len(self._docs)} vectors, replayed {replayed} ops")
+
+
+class ChatScopedVectorStore(VectorStore):
+    """LangChain view of one chat's vectors inside a ``SharedIndexShard``."""
+
+    def __init__(
+        self,
+        shard: SharedIndexShard,
+        tenant: str,
+        embeddings: Embeddings,
+        history_path: Optional[Path] = None,
+    ) -> None:
+        self.shard = shard
+        self.tenant = tenant
+        self._embeddings = embeddings
+        # Chunks with a byte range are read from here instead of being stored
+        self._history = MappedFile(history_path) if history_path is not None else None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embeddings
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[list[dict]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        return self.add_embeddings(zip(texts, self._embeddings.embed_documents(texts)), metadatas)
+
+    def add_embeddings(
+        self,
+        text_embeddings: Iterable[tuple[str, list[float]]],
+        metadatas: Optional[list[dict]] = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        pairs = list(text_embeddings)
+        if not pairs:
+            return []
+        metadatas = metadatas or [{} for _ in pairs]
+        texts = [
+            None if self._history is not None and _has_byte_range(metadata) else text
+            for (text, _), metadata in zip(pairs, metadatas)
+        ]
+        ids = self.shard.add(self.tenant, texts, [e for _, e in pairs], metadatas)
+        return [str(i) for i in ids]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        results = []
+        for text, metadata, distance in self.shard.search(self.tenant, embedding, k):
+            if text is None:
+                data = self._history.read(metadata["byte_start"], metadata["byte_end"])
+                text = data.decode("utf-8", errors="replace").strip()
+            results.append((Document(page_content=text, metadata=dict(metadata)), distance))
+        return results
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> list[Document]:
+        return self.similarity_search_by_vector(self._embeddings.embed_query(query), k)
+
+    def delete(self, ids: Optional[list[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Deletes every vector of the chat (per-id deletion is not needed by the bot)."""
+        self.shard.delete_tenant(self.tenant)
+        return True
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: Optional[list[dict]] = None,
+        *,
+        tenant: str,
+        root: str | Path,
+        shards: int = 1,
+        journal_max_bytes: int = 64 * 1024 * 1024,
+        history_path: Optional[Path] = None,
+        **kwargs: Any,
+    ) -> ChatScopedVectorStore:
+        """Add ``texts`` to ``tenant``'s shard under ``root`` and return the tenant's view."""
+        shard = get_shared_shard(tenant, root=root, shards=shards, journal_max_bytes=journal_max_bytes)
+        store = cls(shard, tenant, embedding, history_path)
+        store.add_texts(texts, metadatas)
+        return store
+
+
+def _has_byte_range(metadata: dict) -> bool:
+    return metadata.get("byte_start") is not None and metadata.get("byte_end") is not None
+
+
+_SHARDS: dict[Path, SharedIndexShard] = {}
+_SHARDS_LOCK = threading.Lock()
+
+
+def get_shared_shard(
+    tenant: str,
+    *,
+    root: str | Path,
+    shards: int,
+    journal_max_bytes: int,
+) -> SharedIndexShard:
+    """Shard for a tenant; a stable crc32 hash spreads chats across ``shards`` indexes."""
+    number = zlib.crc32(tenant.encode("utf-8")) % max(shards, 1)
+    shard_dir = Path(root) / f"shard_{number:03d}"
+    with _SHARDS_LOCK:
+        shard = _SHARDS.get(shard_dir)
+        if shard is None:
+            shard = SharedIndexShard(shard_dir, journal_max_bytes)
+            _SHARDS[shard_dir] = shard
+        return shard
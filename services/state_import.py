@@ -0,0 +1,147 @@
+"""
+One-shot import of the old per-service JSON files into the state database:
+
+    python import_state.py [--data-dir data] [--logs-dir logs]
+
+Run with the bot stopped. Every imported chat/user replaces its rows in the
+database, so running the import again gives the same result. The JSON files
+are left in place; delete them once the bot works from the database.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+from services.log_token_usage_service import rebuild_token_usage_aggregates
+from services.state_store import StateStore, get_state_store
+
+
+def _read_json(path: Path) -> Any:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _chat_files(directory: Path, prefix: str) -> Iterator[tuple[int, Any]]:
+    """``(chat_id, data)`` of every ``<prefix>_<chat_id>.json`` in ``directory``."""
+    for path in sorted(directory.glob(f"{prefix}_*.json")):
+        try:
+            yield int(path.stem.split("_", 1)[1]), _read_json(path)
+        except (json.JSONDecodeError, OSError, ValueError) as e:
+            print(f"[import] Skipping {path}: {e}")
+
+
+def import_histories(store: StateStore, directory: Path) -> int:
+    count = 0
+    for chat_id, data in _chat_files(directory, "chat"):
+        store.execute("DELETE FROM chat_messages WHERE chat_id = ?", (chat_id,))
+        store.executemany(
+            "INSERT INTO chat_messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+            [(chat_id, m["role"], m["content"], m["timestamp"]) for m in data.get("messages", [])],
+        )
+        store.execute(
+            "INSERT OR REPLACE INTO chat_summaries (chat_id, summary) VALUES (?, ?)",
+            (chat_id, data.get("summary", "")),
+        )
+        count += 1
+    return count
+
+
+def import_groups(store: StateStore, directory: Path) -> int:
+    count = 0
+    for chat_id, data in _chat_files(directory, "group"):
+        store.execute(
+            "INSERT OR REPLACE INTO groups (chat_id, created_at, updated_at) VALUES (?, ?, ?)",
+            (chat_id, data["created_at"], data["updated_at"]),
+        )
+        store.execute("DELETE FROM group_members WHERE chat_id = ?", (chat_id,))
+        store.executemany(
+            "INSERT OR IGNORE INTO group_members (chat_id, user_id, character_name, joined_at) VALUES (?, ?, ?, ?)",
+            [(chat_id, m["user_id"], m["character_name"], m["joined_at"]) for m in data.get("members", [])],
+        )
+        count += 1
+    return count
+
+
+def import_campaigns(store: StateStore, directory: Path) -> int:
+    rows = [
+        (chat_id, data.get("description", ""), data.get("updated_at") or "1970-01-01T00:00:00")
+        for chat_id, data in _chat_files(directory, "campaign")
+    ]
+    store.executemany("INSERT OR REPLACE INTO campaigns (chat_id, description, updated_at) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+def import_usage(store: StateStore, path: Path) -> int:
+    if not path.exists():
+        return 0
+    data = _read_json(path)
+    store.executemany(
+        "INSERT OR REPLACE INTO usage (user_id, remaining_requests, last_request, total_requests, first_name, username) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                int(user_id), stats["remaining_requests"], stats.get("last_request"),
+                stats.get("total_requests", 0), stats.get("first_name"), stats.get("username"),
+            )
+            for user_id, stats in data.items()
+        ],
+    )
+    return len(data)
+
+
+def import_chat_settings(store: StateStore, path: Path) -> int:
+    if not path.exists():
+        return 0
+    data = _read_json(path)
+    store.executemany(
+        "INSERT OR REPLACE INTO chat_settings (chat_id, voice_enabled) VALUES (?, ?)",
+        [(int(chat_id), int(bool(settings.get("voice_enabled", False)))) for chat_id, settings in data.items()],
+    )
+    return len(data)
+
+
+def import_token_usage(store: StateStore, directory: Path) -> int:
+    count = 0
+    for chat_id, entries in _chat_files(directory, "chat"):
+        store.execute("DELETE FROM token_usage WHERE chat_id = ?", (chat_id,))
+        store.executemany(
+            "INSERT INTO token_usage (chat_id, timestamp, prompt_tokens, completion_tokens, total_tokens, "
+            "cached_tokens, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    chat_id, e["timestamp"], e["prompt_tokens"], e["completion_tokens"], e["total_tokens"],
+                    e.get("cached_tokens", 0), e.get("latency_ms"),
+                )
+                for e in entries
+            ],
+        )
+        count += len(entries)
+    return count
+
+
+def run(store: StateStore, data_dir: Path, logs_dir: Path) -> dict[str, int]:
+    """Import everything in one transaction: a failed import leaves the database untouched."""
+    with store.transaction():
+        counts = {
+            "histories": import_histories(store, data_dir / "history"),
+            "groups": import_groups(store, data_dir / "groups"),
+            "campaigns": import_campaigns(store, data_dir / "campaigns"),
+            "users": import_usage(store, data_dir / "usage" / "usage_stats.json"),
+            "chat settings": import_chat_settings(store, data_dir / "chat_settings" / "chat_settings.json"),
+            "token usage records": import_token_usage(store, logs_dir / "token_usage"),
+        }
+        rebuild_token_usage_aggregates(store)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import the bot's JSON state files into the state database.")
+    parser.add_argument("--data-dir", default="data", help="directory with history/, groups/, campaigns/, ...")
+    parser.add_argument("--logs-dir", default="logs", help="directory with token_usage/")
+    args = parser.parse_args()
+
+    store = get_state_store()
+    counts = run(store, Path(args.data_dir), Path(args.logs_dir))
+    print(f"[import] Imported into {store.path}: " + ", ".join(f"{n} {name}" for name, n in counts.items()))
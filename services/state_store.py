@@ -0,0 +1,246 @@
+"""
+Embedded SQLite store for the bot's state: dialog histories, groups,
+campaigns, usage limits, chat settings and token usage logs.
+
+One connection in WAL mode is shared by all services, so readers never
+wait for the writer and a change is a few row writes instead of a whole
+JSON file rewrite. Statements are parameterized and reused through the
+connection's statement cache; multi-row changes go through ``transaction()``.
+"""
+from __future__ import annotations
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Generic, Hashable, Iterable, Iterator, Optional, TypeVar
+
+from config.config import STATE_DB_PATH
+
+V = TypeVar("V")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chat_messages_chat ON chat_messages (chat_id, id);
+
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    chat_id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS groups (
+    chat_id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS group_members (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    character_name TEXT NOT NULL,
+    joined_at TEXT NOT NULL,
+    UNIQUE (chat_id, character_name)
+);
+
+CREATE TABLE IF NOT EXISTS campaigns (
+    chat_id INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usage (
+    user_id INTEGER PRIMARY KEY,
+    remaining_requests INTEGER NOT NULL,
+    last_request TEXT,
+    total_requests INTEGER NOT NULL DEFAULT 0,
+    first_name TEXT,
+    username TEXT
+);
+
+CREATE TABLE IF NOT EXISTS chat_settings (
+    chat_id INTEGER PRIMARY KEY,
+    voice_enabled INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS token_usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL DEFAULT 0,
+    latency_ms INTEGER,
+    user_id INTEGER NOT NULL DEFAULT 0,
+    model TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS token_usage_chat ON token_usage (chat_id, id);
+
+CREATE TABLE IF NOT EXISTS token_usage_daily (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    day TEXT NOT NULL,
+    requests INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    latency_ms INTEGER NOT NULL,
+    latency_requests INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, user_id, model, day)
+);
+"""
+
+# Columns added to existing tables after their first release: table -> {column: definition}
+ADDED_COLUMNS = {
+    "token_usage": {
+        "user_id": "INTEGER NOT NULL DEFAULT 0",
+        "model": "TEXT NOT NULL DEFAULT ''",
+    },
+}
+
+
+class StateStore:
+    """
+    Thread-safe wrapper around one SQLite connection.
+
+    Single statements run in autocommit mode; ``transaction()`` groups
+    several into one ``BEGIN IMMEDIATE`` ... ``COMMIT``. With
+    ``synchronous=NORMAL`` a commit is a WAL append without an fsync.
+    """
+
+    def __init__(self, path: str | Path = STATE_DB_PATH) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False, cached_statements=256
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._caches: dict[str, ReadThroughCache] = {}
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self) -> None:
+        """Add the columns a database created by an older version lacks."""
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for name, definition in columns.items():
+                if name not in existing:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    @contextmanager
+    def transaction(self) -> Iterator[StateStore]:
+        """Run the enclosed statements atomically; nested calls join the outer transaction."""
+        with self._lock:
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield self
+                finally:
+                    self._depth -= 1
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._depth = 1
+            try:
+                yield self
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+            finally:
+                self._depth = 0
+
+    def execute(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params))
+
+    def executemany(self, sql: str, rows: Iterable[Iterable[Any]]) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.executemany(sql, rows)
+
+    def fetchone(self, sql: str, params: Iterable[Any] = ()) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchone()
+
+    def fetchall(self, sql: str, params: Iterable[Any] = ()) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def data_version(self) -> int:
+        """
+        Changes whenever another connection (another process, the sqlite3
+        shell, import_state.py) commits; this connection's own commits do
+        not change it. In WAL mode it is read from shared memory, not disk.
+        """
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def cache(self, name: str, loader: Callable[[Hashable], V]) -> ReadThroughCache[V]:
+        """The store-wide cache ``name``, shared by every service instance using it."""
+        with self._lock:
+            if name not in self._caches:
+                self._caches[name] = ReadThroughCache(self, loader)
+            return self._caches[name]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ReadThroughCache(Generic[V]):
+    """
+    Values loaded from the store by ``loader`` on first access. Services
+    update or drop the entries they write; everything is dropped when
+    another connection changed the database.
+    """
+
+    def __init__(self, store: StateStore, loader: Callable[[Hashable], V]) -> None:
+        self.store = store
+        self.loader = loader
+        self._values: dict[Hashable, V] = {}
+        self._version = store.data_version()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> V:
+        with self._lock:
+            version = self.store.data_version()
+            if version != self._version:
+                self._values.clear()
+                self._version = version
+            if key not in self._values:
+                self._values[key] = self.loader(key)
+            return self._values[key]
+
+    def set(self, key: Hashable, value: V) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+
+_GLOBAL_STATE_STORE: Optional[StateStore] = None
+
+
+def get_state_store() -> StateStore:
+    """Process-wide store shared by every service instance."""
+    global _GLOBAL_STATE_STORE
+    if _GLOBAL_STATE_STORE is None:
+        _GLOBAL_STATE_STORE = StateStore()
+    return _GLOBAL_STATE_STORE
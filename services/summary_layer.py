@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import pickle
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+
+@dataclass
+class SummaryNode:
+    text: str
+    turn_start: int
+    turn_end: int
+
+
+@dataclass
+class PendingBlock:
+    """Turns whose summary failed: (turn, byte_start, byte_end) of each of their chunks."""
+    chunks: list[tuple[int, int, int]]
+
+    @property
+    def turn_start(self) -> int:
+        return self.chunks[0][0]
+
+    @property
+    def turn_end(self) -> int:
+        return self.chunks[-1][0]
+
+
+class SummaryLayer:
+    """
+    Upper level of the hierarchical index: one summary per block of turns.
+
+    Small enough for a brute-force NumPy scan, so it is kept as an
+    append-only pickle log next to the chat's offset file. Blocks whose
+    summary failed are logged as ``PendingBlock`` until a node covers them.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.nodes: list[SummaryNode] = []
+        self.pending: list[PendingBlock] = []
+        self._last_turn = 0
+        self._vectors: list[np.ndarray] = []
+        self._matrix: np.ndarray | None = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    @property
+    def last_turn(self) -> int:
+        """Last turn handed to the summarizer, whether summarized or pending."""
+        return self._last_turn
+
+    def pending_turns(self) -> set[int]:
+        with self._lock:
+            return {turn for block in self.pending for turn, _, _ in block.chunks}
+
+    def add(self, node: SummaryNode, embedding: list[float]) -> None:
+        vector = np.asarray(embedding, dtype="float32")
+        with self._lock:
+            self._append(node, vector)
+            self._write((node, vector))
+
+    def defer(self, block: PendingBlock) -> None:
+        """Remember a block the summarizer failed on, to retry it later."""
+        with self._lock:
+            if block in self.pending:
+                return
+            self._defer(block)
+            self._write(block)
+
+    def search(self, embedding: list[float], k: int) -> list[tuple[SummaryNode, float]]:
+        with self._lock:
+            if not self.nodes:
+                return []
+            if self._matrix is None:
+                self._matrix = np.vstack(self._vectors)
+            matrix = self._matrix
+            nodes = list(self.nodes)
+        query = np.asarray(embedding, dtype="float32")
+        distances = ((matrix - query) ** 2).sum(axis=1)
+        top = np.argsort(distances)[:k]
+        return [(nodes[i], float(distances[i])) for i in top]
+
+    def delete(self) -> None:
+        with self._lock:
+            self.nodes.clear()
+            self.pending.clear()
+            self._vectors.clear()
+            self._matrix = None
+            self._last_turn = 0
+            self.path.unlink(missing_ok=True)
+
+    def _write(self, record) -> None:
+        with open(self.path, "ab") as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _append(self, node: SummaryNode, vector: np.ndarray) -> None:
+        self.nodes.append(node)
+        self._vectors.append(vector)
+        self._matrix = None
+        self._last_turn = max(self._last_turn, node.turn_end)
+        self.pending = [
+            block for block in self.pending
+            if not (node.turn_start <= block.turn_start and block.turn_end <= node.turn_end)
+        ]
+
+    def _defer(self, block: PendingBlock) -> None:
+        if block not in self.pending:
+            self.pending.append(block)
+        self._last_turn = max(self._last_turn, block.turn_end)
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError):
+                    # Torn write at the tail (crash mid-append) – ignore it.
+                    break
+                if isinstance(record, PendingBlock):
+                    self._defer(record)
+                else:
+                    self._append(*record)
@@ -16,13 +16,23 @@ class SummaryService:
         if previous_summary:
             context = f"Предыдущий контекст диалога: {previous_summary}\n\n"
         
+        return self._summarize(
+            f"{context}Вот новая история диалога:\n" + "\n".join([f"{msg.role}: {msg.content}" for msg in messages])
+        )
+
+    def summarize_turns(self, turns: list[str]) -> str:
+        """Создает саммари блока ходов из файла истории (для иерархического индекса)"""
+        return self._summarize("Вот история диалога:\n" + "\n\n".join(turns))
+
+    def _summarize(self, dialog: str) -> str:
+        """Запрос саммари диалога к модели (с логированием запроса и ответа)"""
         summary_prompt = [
             {"role": "system", "content": SUMMARY_PROMPT},
-            {"role": "user", "content": f"{context}Вот новая история диалога:\n" + "\n".join([f"{msg.role}: {msg.content}" for msg in messages])}
+            {"role": "user", "content": dialog}
         ]
 
         self.logger_service.log_request(1, summary_prompt)
-        
+
         response = self.client.chat.completions.create(
             model=self.model,
             messages=summary_prompt,
@@ -30,4 +40,4 @@ class SummaryService:
         )
 
         self.logger_service.log_request(2, response.choices[0].message.content)
-        return response.choices[0].message.content 
\ No newline at end of file
+        return response.choices[0].message.content
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+# Format of the simple dialog history file, one block per exchange:
+#   Сообщение пользователя [2025-01-01T12:00:00]:
+#   <user text>
+#
+#   Ответ мастера:
+#   <master text>
+#
+USER_HEADER = "Сообщение пользователя"
+MASTER_HEADER = "Ответ мастера:"
+
+_TURN_START_RE = re.compile(
+    rb"(?m)^" + USER_HEADER.encode("utf-8") + rb"(?: \[([^\]\n]+)\])?:\n"
+)
+_MASTER_MARK = ("\n" + MASTER_HEADER + "\n").encode("utf-8")
+_TURN_END = b"\n\n"
+
+
+def format_turn(user_content: str, ai_response_content: str, timestamp: Optional[datetime] = None) -> str:
+    """One exchange as written to the simple history file."""
+    timestamp = timestamp or datetime.now()
+    return (
+        f"{USER_HEADER} [{timestamp.isoformat(timespec='seconds')}]:\n{user_content}\n\n"
+        f"{MASTER_HEADER}\n{ai_response_content}\n\n"
+    )
+
+
+@dataclass
+class TurnChunk:
+    text: str
+    turn: int
+    timestamp: Optional[str]
+    byte_start: int
+    byte_end: int
+
+    def metadata(self) -> dict:
+        return {
+            "turn": self.turn,
+            "timestamp": self.timestamp,
+            "byte_start": self.byte_start,
+            "byte_end": self.byte_end,
+        }
+
+
+def split_turns(
+    data: bytes,
+    base_offset: int,
+    first_turn: int,
+    max_chars: int,
+    final: bool = False,
+) -> tuple[list[TurnChunk], int]:
+    """
+    Split the unread tail of the history file into one chunk per exchange.
+
+    ``data`` starts at byte ``base_offset`` of the file. Only complete
+    exchanges are consumed (the writer may be mid-append): a turn is complete
+    when the next one starts, or when it has a master answer and ends with a
+    blank line. With ``final=True`` whatever is left is consumed too.
+
+    Returns the chunks and the number of bytes consumed. Exchanges longer than
+    ``max_chars`` are cut at line boundaries into non-overlapping parts that
+    share the turn number.
+    """
+    starts = [m.start() for m in _TURN_START_RE.finditer(data)]
+    bounds: list[tuple[int, int]] = []
+    if not starts or starts[0] > 0:
+        # Text that does not follow the turn format (e.g. written by hand)
+        head_end = starts[0] if starts else len(data)
+        if starts or final:
+            bounds.append((0, head_end))
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(data)
+        bounds.append((start, end))
+
+    if bounds and not final:
+        start, end = bounds[-1]
+        block = data[start:end]
+        if end == len(data) and not (_MASTER_MARK in block and block.endswith(_TURN_END)):
+            bounds.pop()
+
+    chunks: list[TurnChunk] = []
+    turn = first_turn
+    consumed = 0
+    for start, end in bounds:
+        consumed = end
+        block = data[start:end]
+        if not block.strip():
+            continue
+        match = _TURN_START_RE.match(block)
+        timestamp = match.group(1).decode("utf-8") if match and match.group(1) else None
+        turn += 1
+        for part_start, part_end in _split_block(block, max_chars):
+            text = block[part_start:part_end].decode("utf-8", errors="replace").strip()
+            if text:
+                chunks.append(TurnChunk(
+                    text=text,
+                    turn=turn,
+                    timestamp=timestamp,
+                    byte_start=base_offset + start + part_start,
+                    byte_end=base_offset + start + part_end,
+                ))
+    return chunks, consumed
+
+
+def _split_block(block: bytes, max_chars: int) -> list[tuple[int, int]]:
+    """Byte ranges of line-aligned parts of at most ~``max_chars`` characters."""
+    if len(block.decode("utf-8", errors="replace")) <= max_chars:
+        return [(0, len(block))]
+    parts: list[tuple[int, int]] = []
+    part_start = pos = chars = 0
+    for line in block.splitlines(keepends=True):
+        line_chars = len(line.decode("utf-8", errors="replace"))
+        if chars and chars + line_chars > max_chars:
+            parts.append((part_start, pos))
+            part_start, chars = pos, 0
+        pos += len(line)
+        chars += line_chars
+    if pos > part_start:
+        parts.append((part_start, pos))
+    return parts
@@ -1,44 +1,52 @@
-import json
-from pathlib import Path
+import atexit
+import threading
 from datetime import datetime
-from typing import Dict, Optional, Tuple
-from config.config import DEFAULT_REQUESTS_LIMIT
+from typing import Dict, Optional, Set, Tuple
+from config.config import DEFAULT_REQUESTS_LIMIT, USAGE_FLUSH_INTERVAL
+from services.state_store import StateStore, get_state_store
 
 class UsageService:
-    def __init__(self, usage_dir: str = "data/usage"):
-        self.usage_dir = Path(usage_dir)
-        self._ensure_usage_dir()
+    """
+    Лимиты запросов пользователей. Все записи загружаются в память один раз;
+    изменения копятся в памяти и сбрасываются в хранилище одной транзакцией
+    каждые USAGE_FLUSH_INTERVAL секунд и при завершении процесса.
+    """
 
-    def _ensure_usage_dir(self):
-        """Создает директорию для хранения данных об использовании"""
-        self.usage_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, store: Optional[StateStore] = None, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        self.store = store or get_state_store()
+        self.flush_interval = flush_interval
+        self._records: Dict[int, Dict] = {}
+        self._dirty: Set[int] = set()
+        self._lock = threading.Lock()
+        # Сбросы идут по одному, чтобы старый снимок не перезаписал более новый
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._load_usage_data()
+        atexit.register(self.close)
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True).start()
 
-    def _get_usage_file_path(self) -> Path:
-        """Возвращает путь к файлу с данными об использовании"""
-        return self.usage_dir / "usage_stats.json"
+    def _load_usage_data(self):
+        """Загружает записи всех пользователей из хранилища"""
+        for row in self.store.fetchall(
+            "SELECT user_id, remaining_requests, last_request, total_requests, first_name, username FROM usage"
+        ):
+            record = dict(row)
+            self._records[record.pop("user_id")] = record
 
-    def _read_usage_data(self) -> Dict:
-        """Читает данные об использовании из файла"""
-        usage_file = self._get_usage_file_path()
-        if not usage_file.exists():
-            return {}
-            
-        try:
-            with open(usage_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Преобразуем строковые ключи в целые числа
-                return {int(k): v for k, v in data.items()}
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Ошибка при чтении данных об использовании: {e}")
-            return {}
-
-    def _write_usage_data(self, data: Dict):
-        """Записывает данные об использовании в файл"""
-        try:
-            with open(self._get_usage_file_path(), 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except IOError as e:
-            print(f"Ошибка при записи данных об использовании: {e}")
+    def _get_record(self, user_id: int) -> Dict:
+        """Запись пользователя; новая создается с лимитом по умолчанию (вызывать под self._lock)"""
+        record = self._records.get(user_id)
+        if record is None:
+            record = self._records[user_id] = {
+                "remaining_requests": DEFAULT_REQUESTS_LIMIT,
+                "last_request": None,
+                "total_requests": 0,
+                "first_name": None,
+                "username": None
+            }
+            self._dirty.add(user_id)
+        return record
 
     def update_user_info(self, user_id: int, first_name: Optional[str] = None, username: Optional[str] = None):
         """
@@ -49,23 +57,15 @@ class UsageService:
             first_name (Optional[str]): Имя пользователя
             username (Optional[str]): Ник пользователя
         """
-        data = self._read_usage_data()
-        
-        if user_id not in data:
-            data[user_id] = {
-                "remaining_requests": DEFAULT_REQUESTS_LIMIT,
-                "last_request": None,
-                "total_requests": 0,
-                "first_name": None,
-                "username": None
-            }
-        
-        if first_name:
-            data[user_id]["first_name"] = first_name
-        if username:
-            data[user_id]["username"] = username
-            
-        self._write_usage_data(data)
+        with self._lock:
+            record = self._get_record(user_id)
+            # Обычно имя и ник не меняются - тогда ничего не записываем
+            if first_name and record["first_name"] != first_name:
+                record["first_name"] = first_name
+                self._dirty.add(user_id)
+            if username and record["username"] != username:
+                record["username"] = username
+                self._dirty.add(user_id)
 
     def decrement_usage(self, user_id: int) -> Tuple[bool, int]:
         """
@@ -77,36 +77,60 @@ class UsageService:
         Returns:
             Tuple[bool, int]: (можно ли использовать нейросеть, оставшееся количество запросов)
         """
-        data = self._read_usage_data()
-        
-        # Инициализируем данные для пользователя, если их еще нет
-        if user_id not in data:
-            data[user_id] = {
-                "remaining_requests": DEFAULT_REQUESTS_LIMIT,
-                "last_request": None,
-                "total_requests": 0,
-                "first_name": None,
-                "username": None
-            }
-        
-        # Проверяем, есть ли еще доступные запросы
-        if data[user_id]["remaining_requests"] <= 0:
-            return False, 0
-            
-        # Уменьшаем счетчик и обновляем время последнего запроса
-        data[user_id]["remaining_requests"] -= 1
-        data[user_id]["total_requests"] += 1
-        data[user_id]["last_request"] = datetime.now().isoformat()
-        
-        # Сохраняем обновленные данные
-        self._write_usage_data(data)
-        
-        return True, data[user_id]["remaining_requests"]
+        # Проверка и списание под одной блокировкой: параллельные запросы
+        # не потеряют списание и не уведут счетчик в минус
+        with self._lock:
+            record = self._get_record(user_id)
+            if record["remaining_requests"] <= 0:
+                return False, 0
+            record["remaining_requests"] -= 1
+            record["total_requests"] += 1
+            record["last_request"] = datetime.now().isoformat()
+            self._dirty.add(user_id)
+            return True, record["remaining_requests"]
 
     def get_usage_stats(self, user_id: int) -> Optional[Dict]:
         """Возвращает статистику использования для пользователя"""
-        data = self._read_usage_data()
-        return data.get(user_id)
+        with self._lock:
+            record = self._records.get(user_id)
+            return dict(record) if record else None
+
+    def flush(self):
+        """Сбрасывает измененные записи в хранилище одной транзакцией"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                rows = []
+                for user_id in self._dirty:
+                    r = self._records[user_id]
+                    rows.append((
+                        user_id, r["remaining_requests"], r["last_request"],
+                        r["total_requests"], r["first_name"], r["username"],
+                    ))
+                self._dirty.clear()
+            try:
+                with self.store.transaction():
+                    self.store.executemany(
+                        "INSERT OR REPLACE INTO usage "
+                        "(user_id, remaining_requests, last_request, total_requests, first_name, username) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+            except Exception as e:
+                print(f"Ошибка при записи данных об использовании: {e}")
+                # Не потерять изменения: записи попадут в следующий сброс
+                with self._lock:
+                    self._dirty.update(row[0] for row in rows)
+
+    def close(self):
+        """Останавливает периодический сброс и записывает оставшиеся изменения"""
+        self._stopped.set()
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
 
     def get_formatted_usage_stats(self, user_id: int) -> str:
         """Возвращает отформатированную статистику использования"""
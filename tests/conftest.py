@@ -0,0 +1,39 @@
+import os
+
+# Offline defaults, set before config.config is imported by any test module
+os.environ.setdefault("EMBEDDINGS_BACKEND", "hashing")
+os.environ.setdefault("MY_PERSONAL_OPENAI_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pytest
+
+import utils.tokens
+
+
+class _WhitespaceEncoding:
+    """One token per space-separated word: tiktoken needs its BPE files from the network."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split(" ") if text else []
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def offline_tokens(monkeypatch):
+    monkeypatch.setattr(utils.tokens, "_encoding", lambda model: _WhitespaceEncoding())
+    utils.tokens.count_tokens.cache_clear()
+    yield
+    utils.tokens.count_tokens.cache_clear()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A fresh state database, also installed as the process-wide one."""
+    from services import state_store
+
+    store = state_store.StateStore(tmp_path / "state.db")
+    monkeypatch.setattr(state_store, "_GLOBAL_STATE_STORE", store)
+    yield store
+    store.close()
@@ -0,0 +1,42 @@
+from langchain_core.documents import Document
+
+from services.context_postprocess import postprocess_context
+
+
+def _chunk(text, start, end, **metadata):
+    return Document(page_content=text, metadata={"byte_start": start, "byte_end": end, **metadata})
+
+
+def test_duplicates_and_contained_chunks_are_dropped():
+    docs = [
+        Document(page_content="тролль охраняет мост"),
+        Document(page_content="тролль охраняет мост"),
+        Document(page_content="мост"),
+    ]
+    assert [d.page_content for d in postprocess_context(docs)] == ["тролль охраняет мост"]
+
+
+def test_adjacent_chunks_merge_and_follow_history_order_after_summaries():
+    docs = [
+        _chunk("второй ход", 100, 200),
+        Document(page_content="краткое содержание", metadata={"node": "summary"}),
+        _chunk("первый ход", 0, 100),
+        _chunk("пятый ход", 500, 600),
+    ]
+
+    result = postprocess_context(docs)
+
+    assert [d.page_content for d in result] == ["краткое содержание", "первый ход\n\nвторой ход", "пятый ход"]
+    assert (result[1].metadata["byte_start"], result[1].metadata["byte_end"]) == (0, 200)
+
+
+def test_budget_keeps_best_chunks_and_truncates_the_last():
+    best = _chunk(" ".join(["слово"] * 80), 1000, 2000)
+    second = _chunk(" ".join(["другое"] * 80), 0, 900)
+    third = _chunk("совсем мало", 3000, 3100)
+
+    result = postprocess_context([best, second, third], max_tokens=140)
+
+    assert [d.metadata["byte_start"] for d in result] == [0, 1000]
+    assert result[0].metadata["truncated"] and len(result[0].page_content.split()) == 60
+    assert "truncated" not in result[1].metadata
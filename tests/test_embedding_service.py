@@ -0,0 +1,44 @@
+import hashlib
+
+import numpy as np
+
+from services.embedding_service import EmbeddingCache, EmbeddingService
+from services.local_embeddings import HashingEmbeddings
+
+
+def _digest(n: int) -> bytes:
+    return hashlib.sha256(str(n).encode()).digest()
+
+
+def test_cache_round_trips_float32_vectors(tmp_path):
+    path = tmp_path / "cache.bin"
+    cache = EmbeddingCache(path)
+    cache.put_many([(_digest(1), [0.5, -1.25]), (_digest(1), [9.0, 9.0])])
+
+    assert cache.items()[0][1].dtype == np.float32
+    assert EmbeddingCache(path).get(_digest(1)) == [0.5, -1.25]
+    assert path.stat().st_size == 32 + 4 + 2 * 4
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.bin", max_items=2)
+    cache.put_many([(_digest(1), [1.0]), (_digest(2), [2.0])])
+    cache.get(_digest(1))
+    cache.put_many([(_digest(3), [3.0])])
+
+    assert cache.get(_digest(2)) is None
+    assert cache.get(_digest(1)) == [1.0] and cache.get(_digest(3)) == [3.0]
+    # The newest records are the ones reloaded under the same bound
+    assert EmbeddingCache(tmp_path / "cache.bin", max_items=2).get(_digest(1)) is None
+
+
+def test_query_embeddings_are_not_written_to_disk(tmp_path):
+    path = tmp_path / "cache.bin"
+    service = EmbeddingService(HashingEmbeddings(8), cache=EmbeddingCache(path), batch_window=0)
+
+    query = service.embed_query("какой сегодня день?")
+    assert not path.exists() or path.stat().st_size == 0
+    assert service.embed_query("какой сегодня день?") == query
+
+    service.embed_documents(["первый ход"])
+    assert len(EmbeddingCache(path)) == 1
@@ -0,0 +1,66 @@
+import pytest
+
+from services.faiss_segments import SegmentedIndexDir
+from services.local_embeddings import HashingEmbeddings
+from services.rag_service import RAGManager
+from services.turn_chunker import format_turn
+
+
+def test_next_delta_number_is_above_every_segment_on_disk(tmp_path):
+    segments = SegmentedIndexDir(tmp_path / "idx")
+    assert segments.next_delta_number() == 1
+
+    segments.write_delta(7, ["id"], ["text"], [{}], [[0.0, 1.0]])
+    assert segments.next_delta_number() == 8
+    assert segments.next_delta_number(last_known=3) == 8
+    assert segments.next_delta_number(last_known=9) == 10
+
+
+def _manager(docs_path):
+    return RAGManager(docs_path, chunk_size=4000, embeddings=HashingEmbeddings(32))
+
+
+def test_two_managers_on_one_file_do_not_replace_each_others_deltas(tmp_path):
+    docs_path = tmp_path / "simple_history_1.txt"
+    docs_path.write_text(format_turn("первый ход", "ответ мастера"), encoding="utf-8")
+    first = _manager(docs_path)
+    second = _manager(docs_path)  # loaded before the first one writes anything
+
+    first.update_index()
+    with open(docs_path, "a", encoding="utf-8") as f:
+        f.write(format_turn("второй ход", "еще ответ"))
+    second.update_index()
+
+    assert [n for n, _ in first.segments.deltas_after(0)] == [1, 2]
+    assert _manager(docs_path).vectorstore.index.ntotal == 2
+
+
+def test_index_of_another_embedding_model_fails_clearly(tmp_path):
+    docs_path = tmp_path / "simple_history_1.txt"
+    docs_path.write_text(format_turn("первый ход", "ответ мастера"), encoding="utf-8")
+    _manager(docs_path).update_index()
+
+    manager = RAGManager(docs_path, chunk_size=4000, embeddings=HashingEmbeddings(64))
+    with pytest.raises(ValueError, match="reindex"):
+        manager.query("первый ход")
+
+
+def test_compaction_merges_memory_mapped_base_with_new_delta(tmp_path):
+    docs_path = tmp_path / "simple_history_1.txt"
+    docs_path.write_text(format_turn("первый ход", "ответ мастера"), encoding="utf-8")
+    first = _manager(docs_path)
+    first.update_index()
+    first.compact()
+
+    manager = RAGManager(docs_path, chunk_size=4000, embeddings=HashingEmbeddings(32), use_mmap=True)
+    with open(docs_path, "a", encoding="utf-8") as f:
+        f.write(format_turn("второй ход", "еще ответ"))
+    manager.update_index()
+    assert manager.pending_segments() == 1
+    manager.compact()
+
+    reloaded = RAGManager(docs_path, chunk_size=4000, embeddings=HashingEmbeddings(32), use_mmap=True)
+    assert reloaded.vectorstore.index.ntotal == 2
+    assert reloaded.pending_segments() == 0
+    context = reloaded.query("второй ход")["context"]
+    assert any("второй ход" in doc.page_content for doc in context)
@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from services.group_service import GroupService
+
+
+def test_members_are_shared_and_persisted(store):
+    first, second = GroupService(store=store), GroupService(store=store)
+
+    assert first.add_member(1, 10, {"name": "Арвен"})
+    assert not first.add_member(1, 11, {"name": "Арвен"})
+    assert second.is_member_in_group(1, "Арвен")
+
+    store.cache("groups", None).invalidate(1)
+    assert [m.character_name for m in second.get_members(1)] == ["Арвен"]
+    assert second.remove_member(1, "Арвен")
+    assert not first.is_member_in_group(1, "Арвен")
+    assert not second.remove_member(1, "Арвен")
+
+
+def test_failed_write_is_reported_and_not_kept_in_memory(store, monkeypatch):
+    service = GroupService(store=store)
+    service.add_member(1, 10, {"name": "Арвен"})
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(store, "execute", fail)
+        with pytest.raises(sqlite3.OperationalError):
+            service.add_member(1, 11, {"name": "Гимли"})
+        with pytest.raises(sqlite3.OperationalError):
+            service.remove_member(1, "Арвен")
+
+    assert [m.character_name for m in service.get_members(1)] == ["Арвен"]
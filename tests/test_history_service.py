@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from services.history_service import HistoryService
+
+
+@pytest.fixture
+def history_service(store, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    service = HistoryService(store=store)
+    monkeypatch.setattr(service.character_service, "get_active_character", lambda user_id: None)
+    return service
+
+
+def test_get_messages_for_api_smoke(history_service):
+    history_service.group_service.add_member(1, 42, {"name": "Гимли"})
+    history_service.add_user_message(1, "Привет")
+
+    messages = asyncio.run(history_service.get_messages_for_api(1, "Привет"))
+
+    assert messages[0]["role"] == "system"
+    assert "Персонаж Гимли (данные недоступны)" in messages[0]["content"]
+    assert messages[-1] == {"role": "user", "content": "Привет"}
+
+
+def test_messages_survive_restart_and_overflow(history_service, store):
+    limit = history_service.get_chat_history(1).max_history_length
+    for i in range(limit + 1):
+        history_service.add_user_message(1, f"m{i}")
+
+    reloaded = HistoryService(store=store)
+    assert [m["content"] for m in reloaded.get_chat_history(1).get_messages()] == [f"m{limit}"]
+
+
+def test_old_history_is_trimmed_before_the_stable_prefix(history_service):
+    history_service.group_service.add_member(1, 42, {"name": "Гимли"})
+    for i in range(5):
+        history_service.add_user_message(1, " ".join([f"m{i}"] * 20))
+    history_service.prompt_assembler.budget = 0
+    asyncio.run(history_service.get_messages_for_api(1, "m4"))
+    full = history_service.last_prompt_reports[1].total
+
+    history_service.prompt_assembler.budget = full - 30
+    messages = asyncio.run(history_service.get_messages_for_api(1, "m4"))
+
+    report = history_service.last_prompt_reports[1]
+    before, after = report.sections["group"]
+    assert before == after
+    assert report.sections["history"][1] < report.sections["history"][0]
+    assert "Гимли" in messages[0]["content"]
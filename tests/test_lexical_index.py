@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from services.lexical_index import LexicalIndex, tokenize
+from services.turn_chunker import format_turn, split_turns
+
+STAMP = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def _index(tmp_path, *turns):
+    history = tmp_path / "history.txt"
+    history.write_text("".join(format_turn(u, a, STAMP) for u, a in turns), encoding="utf-8")
+    data = history.read_bytes()
+    chunks, _ = split_turns(data, 0, 0, 4000, final=True)
+    index = LexicalIndex(tmp_path / "history.lex", history)
+    index.add(chunks, len(data), chunks[-1].turn)
+    return index, history
+
+
+def test_tokenize_stems_and_drops_stop_words():
+    assert tokenize("Где гоблина видели?") == ["гоблин", "видели"]
+
+
+def test_search_ranks_matching_turn_first_with_confidence(tmp_path):
+    index, _ = _index(
+        tmp_path,
+        ("кто охраняет мост?", "мост охраняет старый тролль"),
+        ("что в таверне?", "в таверне шумно, пахнет элем"),
+    )
+
+    hits, confidence = index.search("старый тролль", k=2)
+
+    assert "тролль" in hits[0][0].page_content
+    assert hits[0][0].metadata["turn"] == 1
+    assert confidence == 1.0
+    assert index.search("дракон", k=2) == ([], 0.0)
+
+
+def test_index_is_reloaded_from_its_log(tmp_path):
+    index, history = _index(tmp_path, ("кто охраняет мост?", "старый тролль"))
+
+    reloaded = LexicalIndex(tmp_path / "history.lex", history)
+
+    assert len(reloaded) == len(index) == 1
+    assert (reloaded.offset, reloaded.turns) == (index.offset, index.turns)
+    assert reloaded.search("тролль", k=1)[0]
@@ -0,0 +1,52 @@
+from datetime import date, datetime
+
+from services.log_token_usage_service import TokenUsageService
+from services.state_import import run as import_state
+from services.state_store import StateStore
+
+
+def _usage(prompt, completion, cached=0, latency=None, model="gpt-4.1"):
+    usage = {
+        "prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion,
+        "cached_tokens": cached, "model": model,
+    }
+    if latency is not None:
+        usage["latency_ms"] = latency
+    return usage
+
+
+def test_totals_by_chat_user_and_model(store):
+    service = TokenUsageService(store=store)
+    service.log_token_usage(1, _usage(100, 10, cached=50, latency=200), user_id=7)
+    service.log_token_usage(1, _usage(300, 30, cached=150), user_id=8)
+    service.log_token_usage(2, _usage(10, 1, model="gpt-4o-mini", latency=100), user_id=7)
+
+    chat = service.get_totals(chat_id=1)
+    assert (chat.requests, chat.prompt_tokens, chat.total_tokens) == (2, 400, 440)
+    assert chat.cache_hit_ratio == 0.5
+    assert chat.avg_latency_ms == 200
+    assert {k: v.requests for k, v in service.get_totals_by("user_id").items()} == {7: 2, 8: 1}
+    assert set(service.get_totals_by("model")) == {"gpt-4.1", "gpt-4o-mini"}
+    assert service.get_totals(since=date(2000, 1, 1), until=datetime.now()).requests == 3
+    assert service.get_totals(until=date(2000, 1, 1)).requests == 0
+
+    # The same totals come back from the daily table after a restart
+    assert TokenUsageService(store=store).get_totals(chat_id=1) == chat
+
+
+def test_aggregates_follow_changes_made_by_another_connection(store, tmp_path):
+    service = TokenUsageService(store=store)
+    service.log_token_usage(1, _usage(100, 10))
+
+    logs = tmp_path / "logs" / "token_usage"
+    logs.mkdir(parents=True)
+    (logs / "chat_2.json").write_text(
+        '[{"timestamp": "2025-01-01T12:00:00", "prompt_tokens": 5, "completion_tokens": 5, "total_tokens": 10}]',
+        encoding="utf-8",
+    )
+    other = StateStore(store.path)
+    import_state(other, tmp_path / "data", tmp_path / "logs")
+    other.close()
+
+    assert service.get_totals(chat_id=2).total_tokens == 10
+    assert service.get_totals(chat_id=1).total_tokens == 110
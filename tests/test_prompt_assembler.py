@@ -0,0 +1,49 @@
+from services.prompt_assembler import PromptAssembler, PromptSection
+
+
+def _history(*contents):
+    roles = ["user", "assistant"]
+    return [{"role": roles[i % 2], "content": c} for i, c in enumerate(contents)]
+
+
+def test_volatile_sections_go_right_before_the_latest_message():
+    sections = [
+        PromptSection("main", ["ты мастер игры"], required=True),
+        PromptSection("rag", ["отрывок из истории"], volatile=True, header="\nОтрывки: "),
+    ]
+    messages, report = PromptAssembler(0, "gpt-4o").assemble(sections, _history("привет", "здравствуй", "что дальше?"))
+
+    assert messages[0] == {"role": "system", "content": "ты мастер игры"}
+    assert messages[-2] == {"role": "system", "content": "Отрывки: отрывок из истории"}
+    assert messages[-1]["content"] == "что дальше?"
+    assert [m["content"] for m in messages[1:-2]] == ["привет", "здравствуй"]
+    assert report.sections["rag"][0] == report.sections["rag"][1]
+
+
+def test_without_volatile_content_there_is_one_system_message():
+    sections = [
+        PromptSection("main", ["ты мастер игры"], required=True),
+        PromptSection("rag", [], volatile=True),
+    ]
+    messages, _ = PromptAssembler(0, "gpt-4o").assemble(sections, _history("привет"))
+
+    assert [m["role"] for m in messages] == ["system", "user"]
+
+
+def test_over_budget_trims_lowest_priority_first_and_keeps_the_latest_message():
+    long_part = " ".join(["слово"] * 200)
+    sections = [
+        PromptSection("main", ["ты мастер игры"], required=True),
+        PromptSection("group", [long_part, long_part], priority=30),
+        PromptSection("rag", [long_part], priority=10, volatile=True),
+    ]
+    history = _history(long_part, long_part, "последний ход")
+    messages, report = PromptAssembler(300, "gpt-4o").assemble(sections, history, history_priority=20)
+
+    assert report.total <= 300
+    assert report.sections["rag"][1] == 0
+    assert report.sections["main"][0] == report.sections["main"][1]
+    assert messages[-1]["content"] == "последний ход"
+    # The group section is cut part by part: both members keep their beginning
+    group = messages[0]["content"]
+    assert long_part not in group and group.count("\n") == 1
@@ -0,0 +1,60 @@
+import threading
+import time
+
+from services.rag_registry import ManagerRegistry
+
+
+def test_lru_eviction_calls_on_evict_and_keeps_newest():
+    evicted = []
+    registry = ManagerRegistry(lambda key: f"m{key}", max_items=2, on_evict=lambda k, v: evicted.append(k))
+
+    registry.get_or_create(1)
+    registry.get_or_create(2)
+    registry.get_or_create(1)  # 2 becomes least recently used
+    registry.get_or_create(3)
+
+    assert evicted == [2]
+    assert 1 in registry and 3 in registry and 2 not in registry
+
+
+def test_idle_entries_are_evicted():
+    registry = ManagerRegistry(lambda key: key, idle_ttl=0.01, sweep_interval=0)
+    registry.get_or_create("a")
+    time.sleep(0.02)
+    assert registry.evict_idle() == 1
+    assert len(registry) == 0
+
+
+def test_reload_waits_for_evicted_entry_to_flush():
+    flushing = threading.Event()
+    release = threading.Event()
+    events = []
+
+    def on_evict(key, value):
+        flushing.set()
+        release.wait(5)
+        events.append(("flushed", value))
+
+    created = iter(range(100))
+
+    def factory(key):
+        value = f"{key}#{next(created)}"
+        events.append(("loaded", value))
+        return value
+
+    registry = ManagerRegistry(factory, max_items=1, on_evict=on_evict)
+    registry.get_or_create("a")
+    evictor = threading.Thread(target=registry.get_or_create, args=("b",))
+    evictor.start()
+    assert flushing.wait(5)
+
+    reloader = threading.Thread(target=registry.get_or_create, args=("a",))
+    reloader.start()
+    time.sleep(0.05)
+    # The second "a" must not be loaded while the first one is still flushing
+    assert ("loaded", "a#2") not in events
+    release.set()
+    evictor.join(5)
+    reloader.join(5)
+
+    assert events.index(("flushed", "a#0")) < events.index(("loaded", "a#2"))
@@ -0,0 +1,32 @@
+from services import rag_service
+from services.local_embeddings import HashingEmbeddings
+from services.rag_service import RAGManager, delete_manager_and_clear_history
+from services.turn_chunker import format_turn
+
+
+def test_clearing_an_unloaded_chat_removes_files_without_loading_it(tmp_path):
+    docs_path = tmp_path / "simple_history_1.txt"
+    docs_path.write_text(format_turn("кто охраняет мост?", "старый тролль"), encoding="utf-8")
+    RAGManager(docs_path, embeddings=HashingEmbeddings(16)).update_index()
+    assert len(list(tmp_path.iterdir())) > 1
+    misses = rag_service.GLOBAL_RAG_REGISTRY.misses
+
+    delete_manager_and_clear_history(docs_path)
+
+    assert list(tmp_path.iterdir()) == []
+    assert rag_service.GLOBAL_RAG_REGISTRY.misses == misses
+    assert rag_service._registry_key(docs_path) not in rag_service.GLOBAL_RAG_REGISTRY
+
+
+def test_shared_mode_keeps_no_private_index_and_no_summaries(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_service, "RAG_SHARED_INDEX_DIR", str(tmp_path / "shared"))
+    docs_path = tmp_path / "simple_history_1.txt"
+    docs_path.write_text(format_turn("кто охраняет мост?", "старый тролль"), encoding="utf-8")
+    manager = rag_service.SharedIndexRAGManager(
+        docs_path, embeddings=HashingEmbeddings(16), summarizer=lambda turns: "саммари"
+    )
+    manager.update_index()
+
+    assert manager.summarizer is None and manager.segments is None
+    assert not manager.index_dir.exists() and not manager.summary_file.exists()
+    assert "старый тролль" in manager.query("кто охраняет мост?")["context"][0].page_content
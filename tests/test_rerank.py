@@ -0,0 +1,25 @@
+import numpy as np
+
+from services.rerank import mmr_rerank
+
+
+def test_near_duplicates_lose_to_other_passages():
+    query = np.array([1.0, 0.0, 0.0])
+    vectors = np.array([
+        [0.9, 0.1, 0.0],
+        [0.9, 0.1, 0.001],  # near-duplicate of the best one
+        [0.7, 0.0, 0.7],
+    ])
+    assert mmr_rerank(query, vectors, [None] * 3, k=2, lambda_mult=0.5) == [0, 2]
+    assert mmr_rerank(query, vectors, [None] * 3, k=2, lambda_mult=1.0) == [0, 1]
+
+
+def test_recency_favours_newer_turns():
+    query = np.array([1.0, 0.0])
+    vectors = np.array([[1.0, 0.05], [1.0, 0.0]])
+    hour = 3600.0
+    timestamps = [100 * hour, 0.0]
+
+    assert mmr_rerank(query, vectors, timestamps, k=1, lambda_mult=1.0)[0] == 1
+    assert mmr_rerank(query, vectors, timestamps, k=1, lambda_mult=1.0, recency_weight=0.5, half_life_hours=24)[0] == 0
+    assert mmr_rerank(query, np.empty((0, 2)), [], k=3) == []
@@ -0,0 +1,35 @@
+from services.local_embeddings import HashingEmbeddings
+from services.shared_index import ChatScopedVectorStore, SharedIndexShard
+
+
+def test_from_texts_adds_to_the_tenant_shard_only(tmp_path):
+    embeddings = HashingEmbeddings(16)
+    first = ChatScopedVectorStore.from_texts(
+        ["тролль охраняет мост", "в таверне шумно"], embeddings,
+        metadatas=[{"turn": 1}, {"turn": 2}], tenant="chat_1", root=tmp_path,
+    )
+    second = ChatScopedVectorStore.from_texts(["дракон спит"], embeddings, tenant="chat_2", root=tmp_path)
+
+    assert first.shard is second.shard
+    hits = first.similarity_search("тролль охраняет мост", k=5)
+    assert [d.page_content for d in hits][0] == "тролль охраняет мост"
+    assert hits[0].metadata["turn"] == 1
+    assert "дракон спит" not in [d.page_content for d in hits]
+    assert [d.page_content for d in second.similarity_search("дракон", k=5)] == ["дракон спит"]
+
+
+def test_turn_texts_are_read_from_the_history_file_not_stored(tmp_path):
+    history = tmp_path / "simple_history_1.txt"
+    history.write_bytes("тролль охраняет мост".encode("utf-8"))
+    end = history.stat().st_size
+    store = ChatScopedVectorStore.from_texts(
+        ["тролль охраняет мост", "в таверне шумно"], HashingEmbeddings(16),
+        metadatas=[{"byte_start": 0, "byte_end": end}, {}],
+        tenant=history.stem, root=tmp_path / "shards", history_path=history,
+    )
+
+    assert sorted(text or "" for _, text, _ in store.shard._docs.values()) == ["", "в таверне шумно"]
+    store.shard.compact()
+    reloaded = SharedIndexShard(store.shard.shard_dir)
+    view = ChatScopedVectorStore(reloaded, history.stem, HashingEmbeddings(16), history)
+    assert view.similarity_search("тролль охраняет мост", k=1)[0].page_content == "тролль охраняет мост"
@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+from services.state_store import StateStore
+
+
+def test_transaction_rolls_back_and_nests(store):
+    with pytest.raises(RuntimeError):
+        with store.transaction():
+            store.execute("INSERT INTO campaigns VALUES (1, 'a', 't')")
+            with store.transaction():
+                store.execute("INSERT INTO campaigns VALUES (2, 'b', 't')")
+            raise RuntimeError
+    assert store.fetchall("SELECT * FROM campaigns") == []
+
+    with store.transaction():
+        with store.transaction():
+            store.execute("INSERT INTO campaigns VALUES (1, 'a', 't')")
+    assert store.fetchone("SELECT description FROM campaigns")["description"] == "a"
+
+
+def test_columns_added_after_release_are_migrated(tmp_path):
+    path = tmp_path / "old.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE token_usage (id INTEGER PRIMARY KEY, chat_id INTEGER, timestamp TEXT, "
+        "prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER, "
+        "cached_tokens INTEGER DEFAULT 0, latency_ms INTEGER)"
+    )
+    conn.execute("INSERT INTO token_usage (chat_id, timestamp, prompt_tokens, completion_tokens, total_tokens) "
+                 "VALUES (1, '2025-01-01', 1, 1, 2)")
+    conn.commit()
+    conn.close()
+
+    row = StateStore(path).fetchone("SELECT user_id, model FROM token_usage")
+    assert (row["user_id"], row["model"]) == (0, "")
+
+
+def test_cache_is_shared_and_dropped_after_external_commit(store):
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        row = store.fetchone("SELECT description FROM campaigns WHERE chat_id = ?", (key,))
+        return row["description"] if row else None
+
+    cache = store.cache("test", loader)
+    assert store.cache("test", loader) is cache
+    assert cache.get(1) is None and cache.get(1) is None
+    assert loads == [1]
+
+    # Own writes do not change data_version: the service updates the cache itself
+    store.execute("INSERT INTO campaigns VALUES (1, 'own', 't')")
+    assert cache.get(1) is None
+    cache.invalidate(1)
+    assert cache.get(1) == "own"
+
+    other = StateStore(store.path)
+    other.execute("UPDATE campaigns SET description = 'external' WHERE chat_id = 1")
+    other.close()
+    assert cache.get(1) == "external"
@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from services.local_embeddings import HashingEmbeddings
+from services.rag_service import RAGManager
+from services.turn_chunker import format_turn
+
+STAMP = datetime(2025, 1, 1, 12, 0, 0)
+
+
+class FlakySummarizer:
+    def __init__(self):
+        self.fail = True
+        self.calls = []
+
+    def __call__(self, turns):
+        self.calls.append(turns)
+        if self.fail:
+            raise RuntimeError("API unavailable")
+        return f"summary of {len(turns)} turns"
+
+
+def _append_turns(path, start, count):
+    with open(path, "a", encoding="utf-8") as f:
+        for i in range(start, start + count):
+            f.write(format_turn(f"вопрос {i}", f"ответ {i}", STAMP))
+
+
+def _manager(path, summarizer):
+    return RAGManager(path, embeddings=HashingEmbeddings(16), summarizer=summarizer, summary_turns=2)
+
+
+def test_failed_blocks_are_retried_on_the_next_update(tmp_path):
+    path = tmp_path / "simple_history_1.txt"
+    summarizer = FlakySummarizer()
+    _append_turns(path, 1, 4)
+    manager = _manager(path, summarizer)
+
+    manager.update_index()
+    assert len(manager.summary_layer) == 0
+    assert [(b.turn_start, b.turn_end) for b in manager.summary_layer.pending] == [(1, 2), (3, 4)]
+
+    # Pending blocks survive a reload and are summarized before new turns
+    summarizer.fail = False
+    manager = _manager(path, summarizer)
+    _append_turns(path, 5, 2)
+    manager.update_index()
+
+    nodes = [(n.turn_start, n.turn_end) for n in manager.summary_layer.nodes]
+    assert nodes == [(1, 2), (3, 4), (5, 6)]
+    assert manager.summary_layer.pending == []
+    assert summarizer.calls[-3][0].startswith("Сообщение пользователя") and "вопрос 1" in summarizer.calls[-3][0]
+    assert len(_manager(path, summarizer).summary_layer) == 3
+
+
+def test_summary_is_dropped_when_history_was_cleared_meanwhile(tmp_path):
+    path = tmp_path / "simple_history_1.txt"
+    _append_turns(path, 1, 2)
+
+    def summarizer(turns):
+        manager.delete_files()
+        return "stale summary"
+
+    manager = _manager(path, summarizer)
+    manager.update_index()
+
+    assert len(manager.summary_layer) == 0
+    assert not manager.summary_file.exists()
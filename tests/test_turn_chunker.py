@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from services.turn_chunker import format_turn, split_turns
+
+STAMP = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def test_complete_turns_are_split_with_byte_ranges():
+    text = format_turn("привет", "здравствуй, путник", STAMP) + format_turn("куда идти?", "на север", STAMP)
+    data = text.encode("utf-8")
+
+    chunks, consumed = split_turns(data, base_offset=100, first_turn=4, max_chars=4000)
+
+    assert consumed == len(data)
+    assert [c.turn for c in chunks] == [5, 6]
+    assert chunks[0].timestamp == "2025-01-01T12:00:00"
+    first = chunks[0]
+    assert data[first.byte_start - 100:first.byte_end - 100].decode("utf-8").strip() == first.text
+
+
+def test_turn_being_written_is_left_for_later():
+    done = format_turn("привет", "здравствуй", STAMP).encode("utf-8")
+    partial = "Сообщение пользователя [2025-01-01T12:01:00]:\nещё пишу".encode("utf-8")
+
+    chunks, consumed = split_turns(done + partial, 0, 0, 4000)
+    assert len(chunks) == 1 and consumed == len(done)
+
+    chunks, consumed = split_turns(done + partial, 0, 0, 4000, final=True)
+    assert len(chunks) == 2 and consumed == len(done + partial)
+
+
+def test_long_turn_is_cut_at_line_boundaries_sharing_the_turn():
+    answer = "\n".join(f"строка номер {i}" for i in range(50))
+    chunks, _ = split_turns(format_turn("расскажи", answer, STAMP).encode("utf-8"), 0, 0, max_chars=120)
+
+    assert len(chunks) > 1
+    assert {c.turn for c in chunks} == {1}
+    assert all(a.byte_end == b.byte_start for a, b in zip(chunks, chunks[1:]))
@@ -0,0 +1,54 @@
+import threading
+
+from config.config import DEFAULT_REQUESTS_LIMIT
+from services.usage_service import UsageService
+
+
+def _stored(store, user_id):
+    row = store.fetchone("SELECT remaining_requests, total_requests FROM usage WHERE user_id = ?", (user_id,))
+    return tuple(row) if row else None
+
+
+def test_changes_reach_the_store_only_on_flush(store):
+    service = UsageService(store=store, flush_interval=0)
+    service.update_user_info(1, first_name="Фродо")
+    assert service.decrement_usage(1) == (True, DEFAULT_REQUESTS_LIMIT - 1)
+    assert _stored(store, 1) is None
+
+    service.flush()
+    assert _stored(store, 1) == (DEFAULT_REQUESTS_LIMIT - 1, 1)
+    assert UsageService(store=store, flush_interval=0).get_usage_stats(1)["first_name"] == "Фродо"
+
+
+def test_concurrent_requests_never_overspend_the_limit(store):
+    service = UsageService(store=store, flush_interval=0)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(service.decrement_usage(1)[0]))
+        for _ in range(DEFAULT_REQUESTS_LIMIT + 20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == DEFAULT_REQUESTS_LIMIT
+    assert service.get_usage_stats(1)["remaining_requests"] == 0
+    service.close()
+    assert _stored(store, 1) == (0, DEFAULT_REQUESTS_LIMIT)
+
+
+def test_failed_flush_keeps_changes_for_the_next_one(store, monkeypatch):
+    service = UsageService(store=store, flush_interval=0)
+    service.decrement_usage(1)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(store, "executemany", fail)
+        service.flush()
+    assert _stored(store, 1) is None
+
+    service.flush()
+    assert _stored(store, 1) == (DEFAULT_REQUESTS_LIMIT - 1, 1)
@@ -0,0 +1,25 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str) -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+# Prompt parts such as the main prompt and character sheets repeat on every request
+@lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    return len(_encoding(model).encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """First ``max_tokens`` tokens of ``text``."""
+    tokens = _encoding(model).encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return _encoding(model).decode(tokens[:max_tokens])